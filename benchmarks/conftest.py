@@ -0,0 +1,10 @@
+import pytest
+
+from zc_events.client import EventClient
+from zc_events.transport import InMemoryTransport
+
+
+@pytest.fixture
+def event_client():
+    """An EventClient publishing to and reading responses from memory instead of RabbitMQ and Redis."""
+    return EventClient(transport=InMemoryTransport())
@@ -0,0 +1,92 @@
+import mock
+import pytest
+from rest_framework import viewsets
+from rest_framework.response import Response
+from zc_common.jwt_auth.authentication import JWTAuthentication
+
+from zc_events.utils import model_to_dict
+
+
+class OrderViewSet(viewsets.ViewSet):
+    authentication_classes = (JWTAuthentication,)
+    permission_classes = ()
+
+    def retrieve(self, request, pk=None):
+        return Response({'data': {'type': 'Order', 'id': pk, 'attributes': {'name': 'Order {}'.format(pk)}}})
+
+
+class Order(object):
+
+    def __init__(self, id):
+        self.id = id
+        self.name = 'Order {}'.format(id)
+        self.total = id * 10.5
+
+
+class FakeQuerySet(object):
+    """The part of the QuerySet API used by emit_index_rebuild_event."""
+
+    def __init__(self, count):
+        self.objects = [Order(i) for i in range(count)]
+
+    def count(self):
+        return len(self.objects)
+
+    def order_by(self, *fields):
+        return self
+
+    def __getitem__(self, index):
+        return self.objects[index]
+
+
+def _serialize_order(instance):
+    return model_to_dict(instance, {'id': 'id', 'name': 'name', 'total': 'total'})
+
+
+def test_emit_microservice_message(benchmark, event_client):
+    def emit():
+        event_client.emit_microservice_message(event_client.events_exchange, '', 'order_updated',
+                                               resource_type='Order', resource_id='1', user_id='42')
+        event_client.transport.reset()
+
+    benchmark(emit)
+
+
+def test_emit_microservice_messages(benchmark, event_client):
+    events_kwargs = [{'resource_type': 'Order', 'resource_id': str(i)} for i in range(100)]
+
+    def emit():
+        event_client.emit_microservice_messages(event_client.events_exchange, '', 'order_updated', events_kwargs)
+        event_client.transport.reset()
+
+    benchmark(emit)
+
+
+@pytest.mark.parametrize('response_mode', ['redis', 'amqp'])
+@pytest.mark.parametrize('trusted', [False, True], ids=['jwt', 'trusted'])
+def test_request_round_trip(benchmark, event_client, settings, trusted, response_mode):
+    settings.EVENTS_TRUSTED_INTERNAL_REQUESTS = trusted
+    event_client.response_mode = response_mode
+    event_client.transport.register_view('Order', viewset=OrderViewSet)
+
+    def round_trip():
+        order = event_client.get_remote_resource('Order', pk='1')
+        event_client.transport.reset()
+        return order
+
+    order = benchmark(round_trip)
+    assert order.name == 'Order 1'
+
+
+@pytest.mark.parametrize('count', [10, 1000], ids=['small', 'large'])
+@mock.patch('zc_events.aws.save_string_contents_to_s3', return_value='index/key')
+def test_emit_index_rebuild_event(mock_save, benchmark, event_client, settings, count):
+    settings.AWS_INDEXER_BUCKET_NAME = 'indexer'
+    queryset = FakeQuerySet(count)
+
+    def rebuild():
+        event_client.emit_index_rebuild_event('order_index_rebuild', 'Order', None, 50, _serialize_order,
+                                              queryset=queryset)
+        event_client.transport.reset()
+
+    benchmark(rebuild)
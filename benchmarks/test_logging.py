@@ -0,0 +1,57 @@
+import logging
+
+import pytest
+
+from zc_events.client import EventClient
+
+MESSAGE = {
+    'task': 'microservice.event',
+    'id': '2b2d9a4c-6a5e-4b8c-9d7c-3f1e0a6b5c4d',
+    'args': ['user_updated'],
+    'kwargs': {'resource_type': 'User', 'resource_id': '1234', 'user_id': '42'},
+}
+
+
+def _eager_log(logger, exchange, message):
+    # How emits were logged before, formatting the line whether or not INFO is enabled.
+    kwargs = message['kwargs']
+    logger.info('{}::EMIT: Emitting [{}:{}] event for object ({}:{}) and user {}'.format(
+        exchange.upper(), message['args'][0], message['id'], kwargs.get('resource_type'),
+        kwargs.get('resource_id'), kwargs.get('user_id')))
+
+
+@pytest.fixture
+def logger():
+    logger = logging.getLogger('django')
+    level = logger.level
+    handler = logging.NullHandler()
+    logger.setLevel(logging.WARNING)
+    logger.addHandler(handler)
+    yield logger
+    logger.removeHandler(handler)
+    logger.setLevel(level)
+
+
+def _deferred_log(event_client, exchange, message):
+    if event_client._should_log_emit():
+        event_client._log_emit('%s::EMIT: Emitting [%s:%s] event for object (%s:%s) and user %s', exchange, message)
+
+
+def test_eager_emit_log_disabled(benchmark, logger):
+    benchmark(_eager_log, logger, 'events', MESSAGE)
+
+
+def test_deferred_emit_log_disabled(benchmark, logger):
+    benchmark(_deferred_log, EventClient(), 'events', MESSAGE)
+
+
+def test_eager_emit_log_enabled(benchmark, logger):
+    logger.setLevel(logging.INFO)
+    benchmark(_eager_log, logger, 'events', MESSAGE)
+
+
+def test_deferred_emit_log_sampled(benchmark, logger):
+    logger.setLevel(logging.INFO)
+    event_client = EventClient()
+    event_client.log_sample_rate = 0.01
+    benchmark(_deferred_log, event_client, 'events', MESSAGE)
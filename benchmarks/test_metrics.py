@@ -0,0 +1,29 @@
+from zc_events.metrics import InMemoryMetrics, NullMetrics
+
+
+def _noop():
+    pass
+
+
+def test_untimed(benchmark):
+    benchmark(_noop)
+
+
+def test_null_metrics_timer(benchmark):
+    metrics = NullMetrics()
+
+    def timed():
+        with metrics.timer('event.publish', tags={'exchange': 'events'}):
+            pass
+
+    benchmark(timed)
+
+
+def test_in_memory_metrics_timer(benchmark):
+    metrics = InMemoryMetrics()
+
+    def timed():
+        with metrics.timer('event.publish', tags={'exchange': 'events'}):
+            pass
+
+    benchmark(timed)
@@ -0,0 +1,33 @@
+import ujson
+
+import pytest
+
+from zc_events.request import wrap_resource_from_response
+
+
+def _order(i):
+    return {
+        'type': 'Order',
+        'id': str(i),
+        'attributes': {'name': 'Order {}'.format(i), 'total': i * 10.5, 'deliveryDate': '2016-05-01'},
+        'relationships': {
+            'customer': {'data': {'type': 'Customer', 'id': str(i % 10)},
+                         'links': {'related': '/orders/{}/customer'.format(i)}},
+            'orderItems': {'data': [{'type': 'OrderItem', 'id': '{}-{}'.format(i, j)} for j in range(3)]},
+        },
+    }
+
+
+def _response(count):
+    included = [{'type': 'Customer', 'id': str(i), 'attributes': {'name': 'Customer {}'.format(i)}}
+                for i in range(min(count, 10))]
+    return {'status': 200, 'body': ujson.dumps({'data': [_order(i) for i in range(count)], 'included': included})}
+
+
+@pytest.fixture(params=[1, 100, 1000], ids=['small', 'medium', 'large'])
+def response(request):
+    return _response(request.param)
+
+
+def test_wrap_resource_from_response(benchmark, response):
+    benchmark(wrap_resource_from_response, response)
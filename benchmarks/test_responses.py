@@ -0,0 +1,56 @@
+import ujson
+import zlib
+
+import pytest
+
+from zc_events.django_request import parse_response, structure_framed_response, structure_response
+from zc_events.responses import EventRequestsMock
+
+
+def _payload(count):
+    return ujson.dumps({
+        'data': [
+            {'type': 'Order', 'id': str(i), 'attributes': {'name': 'Order {}'.format(i), 'total': i * 10.5}}
+            for i in range(count)
+        ]
+    })
+
+
+@pytest.fixture(params=[1, 100, 1000], ids=['small', 'medium', 'large'])
+def body(request):
+    return _payload(request.param)
+
+
+def test_json_response_round_trip(benchmark, body):
+    def round_trip():
+        response = ujson.loads(zlib.decompress(structure_response(200, body)))
+        return ujson.loads(response['body'])
+
+    benchmark(round_trip)
+
+
+def test_framed_response_round_trip(benchmark, body):
+    def round_trip():
+        response = parse_response(structure_framed_response(200, body))
+        return ujson.loads(response['body'])
+
+    benchmark(round_trip)
+
+
+@pytest.fixture(params=[10, 1000], ids=['few', 'many'])
+def events_mock(request):
+    events_mock = EventRequestsMock()
+    for i in range(request.param):
+        events_mock.add('GET', 'Order', pk=i, json={'data': {'type': 'Order', 'id': str(i)}})
+    return events_mock
+
+
+def test_events_mock_find_match(benchmark, events_mock):
+    count = len(events_mock._events)
+
+    def find_all():
+        for i in range(count):
+            events_mock._find_match('Order', method='GET', id=str(i))
+
+    # Each round uses up all the fixtures, so only one round can run.
+    benchmark.pedantic(find_all, rounds=1, iterations=1)
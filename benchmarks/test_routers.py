@@ -0,0 +1,48 @@
+import re
+
+from django.conf import settings
+
+from zc_events.routers import TaskRouter
+
+TASKS = ['microservice.event', 'microservice.notification', 'service.some_task']
+
+
+class RegexTaskRouter(object):
+    """The previous router implementation, kept as a baseline."""
+
+    def route_for_task(self, task, args=None, kwargs=None):
+        if re.match('^microservice.event', task) is not None:
+            return {'exchange': settings.EVENTS_EXCHANGE,
+                    'exchange_type': 'fanout',
+                    'routing_key': ''}
+        elif re.match('^microservice.notification', task) is not None:
+            return {'exchange': settings.NOTIFICATIONS_EXCHANGE,
+                    'exchange_type': 'topic',
+                    'routing_key': 'microservice.notification.*'}
+        else:
+            return {'exchange': 'default',
+                    'exchange_type': 'direct',
+                    'routing_key': settings.DEFAULT_QUEUE_NAME}
+
+
+def _route_all(router):
+    for task in TASKS:
+        router.route_for_task(task)
+
+
+def test_regex_router(benchmark):
+    benchmark(_route_all, RegexTaskRouter())
+
+
+def test_task_router(benchmark):
+    benchmark(_route_all, TaskRouter())
+
+
+def test_task_router_lookup_route(benchmark):
+    router = TaskRouter()
+
+    def lookup_all():
+        for task in TASKS:
+            router.lookup_route(task)
+
+    benchmark(lookup_all)
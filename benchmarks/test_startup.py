@@ -0,0 +1,39 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from zc_events.client import EventClient
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STARTUP_SCRIPTS = {
+    'interpreter': 'import django.conf',
+    'import': 'import zc_events',
+    'client': 'import zc_events; zc_events.EventClient()',
+}
+
+
+def _run(script):
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE='tests.settings', PYTHONPATH=ROOT)
+    subprocess.check_call([sys.executable, '-W', 'ignore', '-c', script], cwd=ROOT, env=env)
+
+
+@pytest.mark.parametrize('name', ['interpreter', 'import', 'client'])
+def test_startup(benchmark, name):
+    # Every round starts a fresh interpreter, `interpreter` is the baseline to subtract from the others.
+    benchmark.pedantic(_run, args=(STARTUP_SCRIPTS[name],), rounds=5)
+
+
+def test_event_client_init(benchmark):
+    benchmark(EventClient)
+
+
+def test_first_emit(benchmark, settings):
+    settings.EVENTS_TRANSPORT = 'zc_events.transport.InMemoryTransport'
+
+    def emit():
+        EventClient().emit_microservice_event('order_created', resource_type='Order', resource_id='1')
+
+    benchmark(emit)
@@ -0,0 +1,33 @@
+import datetime
+
+from zc_events.utils import model_to_dict
+
+
+class Customer(object):
+
+    def __init__(self):
+        self.name = 'Customer'
+        self.created = datetime.datetime(2016, 5, 1, 12, 30)
+
+
+class Order(object):
+
+    def __init__(self):
+        self.id = 1
+        self.total = 10.5
+        self.customer = Customer()
+
+    def get_name(self):
+        return 'Order 1'
+
+
+def test_model_to_dict(benchmark):
+    attributes = {
+        'id': 'id',
+        'name': 'get_name',
+        'total': 'total',
+        'customer_name': 'customer.name',
+        'customer_created': 'customer.created',
+    }
+
+    benchmark(model_to_dict, Order(), attributes)
@@ -35,7 +35,7 @@ setup(
         'boto==2.43.0',
         'celery>=3.1.10,<4.0.0',
         'inflection>=0.3.1,<0.4',
-        'pika>=0.10.0,<0.11.0',
+        'pika==0.10.0',
         'pika_pool>=0.1.3,<0.1.4',
         'redis>=2.10.5,<2.11.0',
         'ujson>=1.35,<1.36',
@@ -7,3 +7,11 @@ REDIS_URL = 'redis://redis:6379'
 STAGING_NAME = 'test'
 EVENTS_EXCHANGE = 'test-exchange'
 NOTIFICATIONS_EXCHANGE = 'test-notification-exchange'
+DEFAULT_QUEUE_NAME = 'zc-events-test-default'
+INSTALLED_APPS = ['zc_events']
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': ':memory:',
+    }
+}
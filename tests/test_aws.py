@@ -0,0 +1,111 @@
+import os
+import tempfile
+
+import boto
+import mock
+import pytest
+from moto import mock_s3_deprecated
+
+from zc_events.aws import (
+    MIN_MULTIPART_PART_SIZE, S3IOException, iter_s3_file_chunks, read_s3_file_as_string,
+    save_file_contents_to_s3, save_s3_file_to_path, save_string_contents_to_s3
+)
+
+BUCKET_NAME = 'zc-events-test-bucket'
+
+
+@pytest.fixture
+def bucket():
+    with mock_s3_deprecated():
+        connection = boto.connect_s3('aws-access-key', 'aws-secret-key')
+        yield connection.create_bucket(BUCKET_NAME)
+
+
+@pytest.fixture
+def large_data():
+    # Two full parts and a short last one.
+    return os.urandom(1024) * (2 * MIN_MULTIPART_PART_SIZE // 1024) + 'tail'
+
+
+def test_save_string_contents_to_s3(bucket):
+    key = save_string_contents_to_s3('small contents', BUCKET_NAME)
+
+    assert read_s3_file_as_string(BUCKET_NAME, key) == 'small contents'
+
+
+@mock.patch('zc_events.aws.MultiPartUpload.upload_part_from_file', autospec=True)
+def test_save_string_contents_to_s3__below_threshold_skips_multipart(mock_upload_part, bucket):
+    save_string_contents_to_s3('small contents', BUCKET_NAME, 'key')
+
+    assert not mock_upload_part.called
+
+
+def test_save_string_contents_to_s3__multipart(bucket, large_data):
+    save_string_contents_to_s3(large_data, BUCKET_NAME, 'large', multipart_threshold=1024, concurrency=1)
+
+    assert read_s3_file_as_string(BUCKET_NAME, 'large') == large_data
+
+
+@mock.patch('zc_events.aws.MultiPartUpload.complete_upload')
+@mock.patch('zc_events.aws.MultiPartUpload.upload_part_from_file', autospec=True)
+def test_save_string_contents_to_s3__multipart_parallel_parts(mock_upload_part, mock_complete, bucket,
+                                                              large_data):
+    uploaded = {}
+
+    def upload_part(multipart, fp, part_number, size=None):
+        uploaded[part_number] = (multipart.id, fp.read(), size)
+
+    mock_upload_part.side_effect = upload_part
+
+    save_string_contents_to_s3(large_data, BUCKET_NAME, 'large', multipart_threshold=1024,
+                               part_size=MIN_MULTIPART_PART_SIZE, concurrency=3)
+
+    assert sorted(uploaded) == [1, 2, 3]
+    assert len(set(upload_id for upload_id, _, _ in uploaded.values())) == 1
+    assert ''.join(uploaded[i][1] for i in (1, 2, 3)) == large_data
+    assert [uploaded[i][2] for i in (1, 2, 3)] == [MIN_MULTIPART_PART_SIZE, MIN_MULTIPART_PART_SIZE, 4]
+    assert mock_complete.called
+
+
+def test_save_file_contents_to_s3__multipart(bucket, large_data):
+    with tempfile.NamedTemporaryFile() as f:
+        f.write(large_data)
+        f.flush()
+
+        save_file_contents_to_s3(f.name, BUCKET_NAME, 'large', multipart_threshold=1024, concurrency=1)
+
+    assert read_s3_file_as_string(BUCKET_NAME, 'large') == large_data
+
+
+@mock.patch('zc_events.aws.MultiPartUpload.upload_part_from_file', side_effect=IOError('boom'))
+def test_save_string_contents_to_s3__multipart_failure_cancels_upload(mock_upload_part, bucket, large_data):
+    with pytest.raises(S3IOException):
+        save_string_contents_to_s3(large_data, BUCKET_NAME, 'large', multipart_threshold=1024)
+
+    assert list(bucket.get_all_multipart_uploads()) == []
+    assert bucket.get_key('large') is None
+
+
+def test_iter_s3_file_chunks(bucket):
+    data = os.urandom(2500)
+    save_string_contents_to_s3(data, BUCKET_NAME, 'key')
+
+    chunks = list(iter_s3_file_chunks(BUCKET_NAME, 'key', chunk_size=1024))
+
+    assert [len(chunk) for chunk in chunks] == [1024, 1024, 452]
+    assert ''.join(chunks) == data
+
+
+def test_iter_s3_file_chunks__missing_key(bucket):
+    with pytest.raises(S3IOException):
+        list(iter_s3_file_chunks(BUCKET_NAME, 'missing'))
+
+
+def test_save_s3_file_to_path(bucket):
+    data = os.urandom(2500)
+    save_string_contents_to_s3(data, BUCKET_NAME, 'key')
+
+    with tempfile.NamedTemporaryFile() as f:
+        save_s3_file_to_path(BUCKET_NAME, 'key', f.name, chunk_size=1024)
+
+        assert open(f.name, 'rb').read() == data
@@ -1,7 +1,20 @@
 import mock
+import pika
 import pytest
+import threading
+import time
+import ujson
+import zlib
 
+from zc_events.amqp import PublisherConfirms
 from zc_events.client import structure_response, MethodNotAllowed, EventClient
+from zc_events.django_request import parse_response, structure_framed_response
+from zc_events.event import ResourceRequestEvent
+from zc_events.exceptions import EmitEventException, RequestTimeout
+from zc_events.metrics import InMemoryMetrics
+from zc_events.priority import PriorityPolicy
+from zc_events.transport import InMemoryTransport
+from zc_events.workers import warm_up_worker
 
 
 def test_structure_response():
@@ -18,6 +31,364 @@ def test_structure_response():
     assert response['body'] == body
 
 
+def test_parse_response_with_timings():
+    body = '{"data": []}'
+    timings = {'received_at': 1.5, 'started_at': 2.25, 'finished_at': 3.125}
+
+    expected = {'status': 200, 'body': body, 'timings': timings}
+    assert parse_response(structure_framed_response(200, body, timings=timings)) == expected
+    assert parse_response(structure_response(200, body, timings=timings)) == expected
+
+
+def test_parse_response():
+    body = '{"data": {"type": "User", "id": "1234"}}'
+
+    assert parse_response(structure_framed_response(404, body)) == {'status': 404, 'body': body}
+    assert parse_response(structure_framed_response(200, body.decode('utf-8'))) == {'status': 200, 'body': body}
+    assert parse_response(structure_response(200, body)) == {'status': 200, 'body': body}
+
+
+class TestLazyTransport:
+
+    @mock.patch('zc_events.client.get_transport', side_effect=InMemoryTransport)
+    def test_transport_is_created_on_first_use(self, mock_get_transport):
+        event_client = EventClient()
+        assert not mock_get_transport.called
+
+        event_client.emit_microservice_event('order_created')
+        event_client.emit_microservice_event('order_created')
+
+        assert mock_get_transport.call_count == 1
+        assert len(event_client.transport.get_messages('order_created')) == 2
+
+    @mock.patch('zc_events.client.get_transport', side_effect=InMemoryTransport)
+    def test_transport_is_created_right_away_when_prewarming(self, mock_get_transport, settings):
+        settings.EVENTS_POOL_PREWARM = 1
+
+        EventClient()
+
+        assert mock_get_transport.call_count == 1
+
+    def test_transport_is_reset_after_fork(self):
+        transport = mock.Mock(spec=InMemoryTransport)
+        event_client = EventClient(transport=transport)
+        event_client.pika_pool
+
+        with mock.patch('zc_events.client.os.getpid', return_value=event_client._pid + 1):
+            event_client.pika_pool
+            event_client.redis_client
+
+        assert transport.after_fork.call_count == 1
+
+    def test_transport_is_reset_once_by_concurrent_threads_after_fork(self):
+        transport = mock.Mock(spec=InMemoryTransport)
+        transport.after_fork.side_effect = lambda: time.sleep(0.05)
+        event_client = EventClient(transport=transport)
+        lock = event_client._transport_lock
+
+        with mock.patch('zc_events.client.os.getpid', return_value=event_client._pid + 1):
+            threads = [threading.Thread(target=lambda: event_client.transport) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        assert transport.after_fork.call_count == 1
+        assert event_client._transport_lock is lock
+
+    def test_locks_are_replaced_by_the_fork_hook(self):
+        event_client = EventClient(transport=InMemoryTransport())
+        event_client._transport_lock.acquire()
+
+        warm_up_worker(event_client)
+
+        assert event_client._transport_lock.acquire(False)
+
+
+class TestEmitMicroserviceMessages:
+
+    def setup(self):
+        self.event_client = EventClient()
+        self.event_client.pika_pool = mock.MagicMock()
+        self.channel = self.event_client.pika_pool.acquire.return_value.__enter__.return_value.channel
+        self.channel.basic_publish.return_value = True
+
+    def test_emit_microservice_messages_uses_one_connection(self):
+        events_kwargs = [{'resource_id': str(i)} for i in range(3)]
+
+        task_ids = self.event_client.emit_microservice_messages('exchange', 'routing.key', 'event', events_kwargs)
+
+        assert self.event_client.pika_pool.acquire.call_count == 1
+        assert self.channel.queue_declare.call_count == 1
+        assert self.channel.basic_publish.call_count == 3
+        assert len(set(task_ids)) == 3
+
+        bodies = [ujson.loads(call[0][2]) for call in self.channel.basic_publish.call_args_list]
+        assert [body['kwargs']['task_id'] for body in bodies] == task_ids
+        assert [body['kwargs']['resource_id'] for body in bodies] == ['0', '1', '2']
+        assert all(body['task'] == 'microservice.notification' for body in bodies)
+
+    def test_emit_microservice_messages_keeps_given_task_ids(self):
+        task_ids = self.event_client.emit_microservice_messages('exchange', 'routing.key', 'event',
+                                                                [{'task_id': 'a'}, {'task_id': 'b'}])
+
+        assert task_ids == ['a', 'b']
+
+    def test_emit_microservice_messages_failure(self):
+        self.channel.basic_publish.return_value = False
+
+        with pytest.raises(EmitEventException):
+            self.event_client.emit_microservice_messages('exchange', 'routing.key', 'event', [{}])
+
+    @mock.patch('zc_events.client.logger')
+    def test_emit_is_not_logged_when_info_is_disabled(self, mock_logger):
+        mock_logger.isEnabledFor.return_value = False
+
+        self.event_client.emit_microservice_messages('exchange', 'routing.key', 'event', [{}])
+
+        assert mock_logger.info.call_count == 0
+
+    @mock.patch('zc_events.client.random.random', return_value=0.5)
+    @mock.patch('zc_events.client.logger')
+    def test_emit_logs_are_sampled(self, mock_logger, mock_random):
+        mock_logger.isEnabledFor.return_value = True
+
+        self.event_client.log_sample_rate = 0.25
+        self.event_client.emit_microservice_messages('exchange', 'routing.key', 'event', [{}])
+        assert mock_logger.info.call_count == 0
+
+        self.event_client.log_sample_rate = 0.75
+        self.event_client.emit_microservice_messages('exchange', 'routing.key', 'event', [{'resource_id': '1'}])
+        assert mock_logger.info.call_count == 1
+        assert mock_logger.info.call_args[0][1:4] == ('EXCHANGE', 'event', mock.ANY)
+
+    @mock.patch('zc_events.client.logger')
+    def test_emit_failures_are_never_sampled(self, mock_logger):
+        mock_logger.isEnabledFor.return_value = True
+        self.channel.basic_publish.return_value = False
+        self.event_client.log_sample_rate = 0
+
+        with pytest.raises(EmitEventException):
+            self.event_client.emit_microservice_messages('exchange', 'routing.key', 'event', [{}])
+
+        assert mock_logger.info.call_count == 1
+        assert 'EMIT_FAILURE' in mock_logger.info.call_args[0][0]
+
+    def test_publisher_confirms_are_waited_for_in_batches(self):
+        confirms = mock.Mock()
+        confirms.batch_ready.side_effect = [False, True, False]
+        confirms.wait.return_value = []
+        self.event_client._transport = mock.Mock()
+        self.event_client._transport.get_publisher_confirms.return_value = confirms
+        self.event_client.publisher_confirms = {'batch_size': 2}
+
+        task_ids = self.event_client.emit_microservice_messages('exchange', 'routing.key', 'event', [{}, {}, {}])
+
+        self.event_client._transport.get_publisher_confirms.assert_called_once_with(mock.ANY, batch_size=2)
+        assert [call[0][0] for call in confirms.add.call_args_list] == task_ids
+        assert confirms.wait.call_count == 2
+
+    def test_unconfirmed_events_raise(self):
+        confirms = mock.Mock()
+        confirms.wait.return_value = ['task-id']
+        self.event_client._transport = mock.Mock()
+        self.event_client._transport.get_publisher_confirms.return_value = confirms
+        self.event_client.publisher_confirms = True
+
+        with pytest.raises(EmitEventException):
+            self.event_client.emit_microservice_message('exchange', 'routing.key', 'event')
+
+        self.event_client._transport.get_publisher_confirms.assert_called_once_with(mock.ANY)
+
+    def test_replies_are_tracked_by_publisher_confirms(self):
+        confirms = PublisherConfirms(self.channel, timeout=1)
+        self.event_client._transport = mock.Mock()
+        self.event_client._transport.get_publisher_confirms.return_value = confirms
+        self.event_client.publisher_confirms = True
+        broker = {'confirmed': 0, 'nacked': {1}}
+
+        def flush_output(*waiters):
+            # The broker numbers every message published on the channel, replies included.
+            for delivery_tag in range(broker['confirmed'] + 1, self.channel.basic_publish.call_count + 1):
+                method_class = pika.spec.Basic.Nack if delivery_tag in broker['nacked'] else pika.spec.Basic.Ack
+                confirms._on_confirmation(mock.Mock(method=method_class(delivery_tag=delivery_tag)))
+            broker['confirmed'] = self.channel.basic_publish.call_count
+
+        self.channel._flush_output.side_effect = flush_output
+
+        with pytest.raises(EmitEventException):
+            self.event_client._publish_replies([('request-1', 'response', 10, 'amq.gen-1')])
+        assert self.event_client.emit_microservice_message('exchange', 'routing.key', 'event')
+
+
+    def test_failed_batch_is_not_reported_to_the_next_caller(self):
+        confirms = PublisherConfirms(self.channel, timeout=1)
+        self.event_client._transport = mock.Mock()
+        self.event_client._transport.get_publisher_confirms.return_value = confirms
+        self.event_client.publisher_confirms = True
+        self.channel.basic_publish.side_effect = [True, ValueError('Bad event'), True]
+
+        with pytest.raises(ValueError):
+            self.event_client.emit_microservice_messages('exchange', 'routing.key', 'event', [{}, {}])
+
+        # Only the last message is confirmed, the broker never answers for the first one.
+        self.channel._flush_output.side_effect = lambda *waiters: confirms._on_confirmation(
+            mock.Mock(method=pika.spec.Basic.Ack(delivery_tag=2)))
+        assert self.event_client.emit_microservice_message('exchange', 'routing.key', 'event')
+
+
+class TestRequestPriority:
+
+    def setup(self):
+        self.event_client = EventClient()
+        self.event_client.pika_pool = mock.MagicMock()
+        self.channel = self.event_client.pika_pool.acquire.return_value.__enter__.return_value.channel
+        self.channel.basic_publish.return_value = True
+
+    def _published_priorities(self):
+        return [call[0][3].priority for call in self.channel.basic_publish.call_args_list]
+
+    @mock.patch('zc_events.client.EventClient.wait_for_response', return_value=None)
+    def test_call_site_priorities(self, mock_wait):
+        self.event_client.async_resource_request('Order')
+        self.event_client.get_remote_resource_async('Order')
+        with pytest.raises(RequestTimeout):
+            self.event_client.get_remote_resource_data('Order')
+        self.event_client.emit_microservice_event('order_created')
+
+        assert self._published_priorities() == [5, 0, 9, 0]
+
+    def test_resource_type_priority(self):
+        self.event_client.priority_policy = PriorityPolicy(resource_types={'Order': 7})
+
+        self.event_client.get_remote_resource_async('Order')
+        self.event_client.get_remote_resource_async('User')
+        self.event_client.get_remote_resource_async('Order', priority=1)
+
+        assert self._published_priorities() == [7, 0, 1]
+
+    def test_request_event_carries_emit_time_and_priority(self):
+        event = self.event_client.async_resource_request('Order', priority=3)
+
+        body = ujson.loads(self.channel.basic_publish.call_args[0][2])
+        assert body['kwargs']['request_priority'] == 3
+        assert body['kwargs']['emitted_at'] == event.kwargs['emitted_at']
+
+    @mock.patch('zc_events.client.EventClient.wait_for_response')
+    def test_request_is_promoted_close_to_timeout(self, mock_wait):
+        mock_wait.side_effect = [None, ('key', structure_response(200, '{}'))]
+        self.event_client.priority_policy = PriorityPolicy(promotion_threshold=0.75)
+
+        event = self.event_client.get_remote_resource_async('Order', priority=5)
+        assert event.wait()['status'] == 200
+
+        assert self._published_priorities() == [5, 7]
+        assert [call[0][1] for call in mock_wait.call_args_list] == [45, 15]
+
+        bodies = [ujson.loads(call[0][2]) for call in self.channel.basic_publish.call_args_list]
+        assert bodies[1]['kwargs']['emitted_at'] == bodies[0]['kwargs']['emitted_at']
+        assert [body['kwargs']['attempt'] for body in bodies] == [1, 2]
+
+    @mock.patch('zc_events.client.EventClient.wait_for_response', return_value=None)
+    def test_unsafe_request_is_not_promoted(self, mock_wait):
+        self.event_client.priority_policy = PriorityPolicy(promotion_threshold=0.75)
+
+        event = self.event_client.async_resource_request('Order', method='POST')
+        with pytest.raises(RequestTimeout):
+            event.wait()
+
+        assert self._published_priorities() == [5]
+        mock_wait.assert_called_once_with(event.response_key, 60)
+
+
+class TestRequestTimeout:
+
+    def setup(self):
+        self.event_client = EventClient()
+        self.event_client.pika_pool = mock.MagicMock()
+        self.channel = self.event_client.pika_pool.acquire.return_value.__enter__.return_value.channel
+        self.channel.basic_publish.return_value = True
+
+    @mock.patch('zc_events.client.EventClient.wait_for_response')
+    def test_request_asks_for_and_reads_framed_response(self, mock_wait):
+        body = '{"data": {"type": "Order", "id": "1"}}'
+        mock_wait.return_value = ('key', structure_framed_response(200, body))
+
+        event = self.event_client.get_remote_resource_async('Order', pk='1')
+
+        published = ujson.loads(self.channel.basic_publish.call_args[0][2])
+        assert published['kwargs']['response_format'] == 'framed'
+        assert event.wait() == {'status': 200, 'body': body}
+        assert event.complete().id == '1'
+
+    @mock.patch('zc_events.client.EventClient.wait_for_response')
+    def test_latency_breakdown(self, mock_wait):
+        metrics = InMemoryMetrics()
+        self.event_client.metrics = metrics
+        event = self.event_client.get_remote_resource_async('Order', pk='1')
+        emitted_at = event.kwargs['emitted_at']
+        timings = {'received_at': emitted_at + 1, 'started_at': emitted_at + 1.5, 'finished_at': emitted_at + 3.5}
+        mock_wait.return_value = ('key', structure_framed_response(200, '{"data": {}}', timings=timings))
+
+        with mock.patch('zc_events.event.time.time', return_value=emitted_at + 4):
+            event.wait()
+
+        assert event.latency_breakdown == {'queue': 1, 'prepare': 0.5, 'service': 2, 'return': 0.5, 'total': 4}
+        assert metrics.get_timings('request_event.latency.service', tags={'event_type': 'order_request'}) == [2]
+
+    @mock.patch('zc_events.client.EventClient.wait_for_response')
+    def test_no_latency_breakdown_from_old_responders(self, mock_wait):
+        mock_wait.return_value = ('key', structure_response(200, '{"data": {}}'))
+
+        event = self.event_client.get_remote_resource_async('Order', pk='1')
+        event.wait()
+
+        assert event.latency_breakdown is None
+
+    def test_request_event_carries_deadline(self):
+        event = self.event_client.get_remote_resource_async('Order', timeout=5)
+
+        body = ujson.loads(self.channel.basic_publish.call_args[0][2])
+        assert body['kwargs']['deadline'] == event.deadline
+        assert event.deadline == pytest.approx(body['kwargs']['emitted_at'] + 5)
+        assert 'timeout' not in body['kwargs']
+
+    def test_default_timeout(self):
+        event = self.event_client.async_resource_request('Order')
+
+        assert event.deadline == pytest.approx(event.kwargs['emitted_at'] + 60)
+
+    @mock.patch('zc_events.client.EventClient.wait_for_response', return_value=None)
+    def test_wait_uses_call_timeout(self, mock_wait):
+        with pytest.raises(RequestTimeout):
+            self.event_client.get_remote_resource_data('Order', timeout=5)
+
+        assert mock_wait.call_args[0][1] == 5
+
+    @mock.patch('zc_events.client.EventClient.wait_for_response')
+    def test_wait_past_deadline_does_not_block(self, mock_wait):
+        event = self.event_client.async_resource_request('Order', timeout=5)
+        event.kwargs['deadline'] = time.time() - 1
+
+        with pytest.raises(RequestTimeout):
+            event.wait()
+
+        assert not mock_wait.called
+
+    @mock.patch('zc_events.client.EventClient.wait_for_response', return_value=None)
+    def test_wait_without_emit_times_out(self, mock_wait):
+        event = ResourceRequestEvent(self.event_client, 'order_request', timeout=5)
+
+        with pytest.raises(RequestTimeout):
+            event.wait()
+
+        mock_wait.assert_called_once_with(event.response_key, 5)
+
+    def test_deadline_is_reserved(self):
+        with pytest.raises(AttributeError):
+            ResourceRequestEvent(self.event_client, 'order_request', deadline=time.time())
+
+
 class TestHandleRequestEvent:
 
     def setup(self):
@@ -42,19 +413,174 @@ class TestHandleRequestEvent:
         self.list_actions = {'get': 'list', 'post': 'create'}
         self.object_actions = {'get': 'retrieve', 'put': 'update', 'patch': 'partial_update', 'delete': 'destroy'}
 
-    @mock.patch('zc_events.client.redis.client.StrictRedis.execute_command')
+    def _pipelined_commands(self, mock_execute):
+        pipeline = mock_execute.call_args[0][0]
+        return [args for args, options in pipeline.command_stack]
+
+    @mock.patch('zc_events.amqp.redis.client.BasePipeline.execute', autospec=True)
+    def test_records_queue_latency(self, mock_redis):
+        self.base_event['emitted_at'] = time.time() - 2
+        self.base_event['request_priority'] = 9
+        self.event_client.handle_request_event(self.base_event, viewset=self.mock_viewset)
+
+        stats = self.event_client.priority_policy.get_queue_latency_stats()
+        assert stats[9]['count'] == 1
+        assert stats[9]['max'] >= 2
+
+    @mock.patch('zc_events.amqp.redis.client.BasePipeline.execute', autospec=True)
+    def test_skips_request_past_deadline(self, mock_redis):
+        self.base_event['deadline'] = time.time() - 1
+        self.event_client.handle_request_event(self.base_event, viewset=self.mock_viewset)
+
+        assert not self.mock_viewset.as_view.called
+        assert not mock_redis.called
+
+    @mock.patch('zc_events.amqp.redis.client.BasePipeline.execute', autospec=True)
+    def test_skips_request_emitted_longer_than_timeout_ago(self, mock_redis):
+        self.base_event['emitted_at'] = time.time() - 61
+        self.event_client.handle_request_event(self.base_event, viewset=self.mock_viewset)
+
+        assert not self.mock_viewset.as_view.called
+
+    @mock.patch('zc_events.amqp.redis.client.BasePipeline.execute', autospec=True)
+    def test_skips_request_with_too_little_time_left(self, mock_redis):
+        self.event_client.request_min_remaining = 5
+        self.base_event['deadline'] = time.time() + 2
+        self.event_client.handle_request_event(self.base_event, viewset=self.mock_viewset)
+
+        assert not self.mock_viewset.as_view.called
+
+    @mock.patch('zc_events.client.create_django_request_object')
+    @mock.patch('zc_events.amqp.redis.client.BasePipeline.execute', autospec=True)
+    def test_shed_requests_are_counted(self, mock_redis, mock_create_request):
+        self.event_client.metrics = InMemoryMetrics()
+        self.base_event['deadline'] = time.time() - 1
+        self.event_client.handle_request_event(self.base_event, viewset=self.mock_viewset)
+        self.event_client.handle_request_event(self.base_event, viewset=self.mock_viewset)
+
+        assert not mock_create_request.called
+        assert self.event_client.metrics.get_counter('request_event.shed', tags={'method': 'GET'}) == 2
+
+    @mock.patch('zc_events.amqp.redis.client.BasePipeline.execute', autospec=True)
+    def test_response_expires_after_deadline(self, mock_redis):
+        self.base_event['deadline'] = time.time() + 10
+        self.event_client.handle_request_event(self.base_event, viewset=self.mock_viewset)
+
+        commands = self._pipelined_commands(mock_redis)
+        assert commands[1] == ('EXPIRE', self.base_event['response_key'], 11)
+
+    @mock.patch('zc_events.amqp.redis.client.BasePipeline.execute', autospec=True)
+    def test_response_is_stored_in_one_pipeline(self, mock_redis):
+        self.event_client.handle_request_event(self.base_event, viewset=self.mock_viewset)
+
+        assert mock_redis.call_count == 1
+        commands = self._pipelined_commands(mock_redis)
+        assert [command[:2] for command in commands] == [
+            ('RPUSH', self.base_event['response_key']), ('EXPIRE', self.base_event['response_key'])]
+
+    @mock.patch('zc_events.amqp.redis.client.BasePipeline.execute', autospec=True)
+    def test_handle_request_events_flushes_responses_once(self, mock_redis):
+        events = [dict(self.base_event, response_key='request-{}'.format(i)) for i in range(3)]
+        events.append(dict(self.base_event, response_key='request-expired', deadline=time.time() - 1))
+        self.event_client.handle_request_events(events, viewset=self.mock_viewset)
+
+        assert mock_redis.call_count == 1
+        commands = self._pipelined_commands(mock_redis)
+        assert [command[:2] for command in commands if command[0] == 'RPUSH'] == [
+            ('RPUSH', 'request-0'), ('RPUSH', 'request-1'), ('RPUSH', 'request-2')]
+
+    @mock.patch('zc_events.amqp.redis.client.BasePipeline.execute', autospec=True)
+    def test_handle_request_events_stores_responses_before_failure(self, mock_redis):
+        handler = self.mock_viewset.as_view.return_value
+        handler.side_effect = [handler.return_value, ValueError]
+        events = [dict(self.base_event, response_key='request-{}'.format(i)) for i in range(2)]
+
+        with pytest.raises(ValueError):
+            self.event_client.handle_request_events(events, viewset=self.mock_viewset)
+
+        commands = self._pipelined_commands(mock_redis)
+        assert [command[:2] for command in commands if command[0] == 'RPUSH'] == [('RPUSH', 'request-0')]
+
+    @mock.patch('zc_events.amqp.redis.client.BasePipeline.execute', autospec=True)
+    def test_response_format(self, mock_redis):
+        handler = self.mock_viewset.as_view.return_value
+        handler.return_value.status_code = 200
+        handler.return_value.rendered_content = '{"data": []}'
+
+        self.event_client.handle_request_event(self.base_event, viewset=self.mock_viewset)
+        json_response = self._pipelined_commands(mock_redis)[0][2]
+        self.base_event['response_format'] = 'framed'
+        self.event_client.handle_request_event(self.base_event, viewset=self.mock_viewset)
+        framed_response = self._pipelined_commands(mock_redis)[0][2]
+
+        assert zlib.decompress(json_response).startswith('{')
+        assert zlib.decompress(framed_response).startswith('\x00zcf')
+        for response in (json_response, framed_response):
+            parsed = parse_response(response)
+            assert parsed['status'] == 200
+            assert parsed['body'] == '{"data": []}'
+            assert parsed['timings']['received_at'] <= parsed['timings']['started_at']
+            assert parsed['timings']['started_at'] <= parsed['timings']['finished_at']
+
+    @mock.patch('zc_events.amqp.redis.client.BasePipeline.execute', autospec=True)
+    def test_handlers_are_cached(self, mock_redis):
+        self.event_client.handle_request_event(self.base_event, viewset=self.mock_viewset)
+        self.event_client.handle_request_event(self.base_event, viewset=self.mock_viewset)
+        self.base_event['pk'] = '115'
+        self.event_client.handle_request_event(self.base_event, viewset=self.mock_viewset)
+        self.event_client.handle_request_event(self.base_event, viewset=self.mock_viewset)
+
+        assert self.mock_viewset.as_view.call_args_list == [mock.call(self.list_actions),
+                                                            mock.call(self.object_actions)]
+
+    @mock.patch('zc_events.amqp.redis.client.BasePipeline.execute', autospec=True)
+    def test_related_resource_handlers_are_cached_per_resource(self, mock_redis):
+        self.base_event['pk'] = '115'
+        for related_resource in ['user', 'order', 'user']:
+            self.base_event['related_resource'] = related_resource
+            self.event_client.handle_request_event(self.base_event, viewset=self.mock_viewset)
+
+        assert self.mock_viewset.as_view.call_args_list == [mock.call({'get': 'user'}), mock.call({'get': 'order'})]
+        handler_kwargs = self.mock_viewset.as_view.return_value.call_args[1]
+        assert handler_kwargs == {'pk': '115', 'related_resource': 'user'}
+
+    @mock.patch('zc_events.amqp.redis.client.BasePipeline.execute', autospec=True)
+    def test_unknown_related_resource_handlers_are_not_cached(self, mock_redis):
+        del self.mock_viewset.unknown
+        self.base_event['pk'] = '115'
+        self.base_event['related_resource'] = 'unknown'
+        self.event_client.handle_request_event(self.base_event, viewset=self.mock_viewset)
+        self.event_client.handle_request_event(self.base_event, viewset=self.mock_viewset)
+
+        assert self.mock_viewset.as_view.call_count == 2
+        assert self.event_client._handler_cache == {}
+
+    @mock.patch('zc_events.amqp.redis.client.BasePipeline.execute', autospec=True)
+    def test_warm_handler_cache(self, mock_redis):
+        self.event_client.warm_handler_cache(viewset=self.mock_viewset, related_resources=['user'])
+        assert self.mock_viewset.as_view.call_count == 3
+
+        self.event_client.handle_request_event(self.base_event, viewset=self.mock_viewset)
+        self.base_event['pk'] = '115'
+        self.event_client.handle_request_event(self.base_event, viewset=self.mock_viewset)
+        self.base_event['related_resource'] = 'user'
+        self.event_client.handle_request_event(self.base_event, viewset=self.mock_viewset)
+
+        assert self.mock_viewset.as_view.call_count == 3
+
+    @mock.patch('zc_events.amqp.redis.client.BasePipeline.execute', autospec=True)
     def test_get_list(self, mock_redis):
         self.event_client.handle_request_event(self.base_event, viewset=self.mock_viewset)
         self.mock_viewset.as_view.assert_called_with(self.list_actions)
 
-    @mock.patch('zc_events.client.redis.client.StrictRedis.execute_command')
+    @mock.patch('zc_events.amqp.redis.client.BasePipeline.execute', autospec=True)
     def test_relationship_view(self, mock_redis):
         self.base_event['pk'] = '115'
         self.base_event['relationship'] = 'user'
         self.event_client.handle_request_event(self.base_event, relationship_viewset=self.mock_viewset)
         assert self.mock_viewset.as_view.called
 
-    @mock.patch('zc_events.client.redis.client.StrictRedis.execute_command')
+    @mock.patch('zc_events.amqp.redis.client.BasePipeline.execute', autospec=True)
     def test_related_resource_get(self, mock_redis):
         self.base_event['pk'] = '115'
         self.base_event['related_resource'] = 'user'
@@ -62,14 +588,14 @@ class TestHandleRequestEvent:
 
         self.mock_viewset.as_view.assert_called_with({'get': self.base_event['related_resource']})
 
-    @mock.patch('zc_events.client.redis.client.StrictRedis.execute_command')
+    @mock.patch('zc_events.amqp.redis.client.BasePipeline.execute', autospec=True)
     def test_get_detail(self, mock_redis):
         self.base_event['pk'] = '115'
         self.event_client.handle_request_event(self.base_event, viewset=self.mock_viewset)
 
         self.mock_viewset.as_view.assert_called_with(self.object_actions)
 
-    @mock.patch('zc_events.client.redis.client.StrictRedis.execute_command')
+    @mock.patch('zc_events.amqp.redis.client.BasePipeline.execute', autospec=True)
     def test_put(self, mock_redis):
         self.base_event['method'] = 'PUT'
         self.base_event['pk'] = '115'
@@ -77,7 +603,7 @@ class TestHandleRequestEvent:
 
         self.mock_viewset.as_view.assert_called_with(self.object_actions)
 
-    @mock.patch('zc_events.client.redis.client.StrictRedis.execute_command')
+    @mock.patch('zc_events.amqp.redis.client.BasePipeline.execute', autospec=True)
     def test_patch(self, mock_redis):
         self.base_event['method'] = 'PATCH'
         self.base_event['pk'] = '115'
@@ -85,7 +611,7 @@ class TestHandleRequestEvent:
 
         self.mock_viewset.as_view.assert_called_with(self.object_actions)
 
-    @mock.patch('zc_events.client.redis.client.StrictRedis.execute_command')
+    @mock.patch('zc_events.amqp.redis.client.BasePipeline.execute', autospec=True)
     def test_delete(self, mock_redis):
         self.base_event['method'] = 'DELETE'
         self.base_event['pk'] = '115'
@@ -93,14 +619,14 @@ class TestHandleRequestEvent:
 
         self.mock_viewset.as_view.assert_called_with(self.object_actions)
 
-    @mock.patch('zc_events.client.redis.client.StrictRedis.execute_command')
+    @mock.patch('zc_events.amqp.redis.client.BasePipeline.execute', autospec=True)
     def test_post(self, mock_redis):
         self.base_event['method'] = 'POST'
         self.event_client.handle_request_event(self.base_event, viewset=self.mock_viewset)
 
         self.mock_viewset.as_view.assert_called_with(self.list_actions)
 
-    @mock.patch('zc_events.client.redis.client.StrictRedis.execute_command')
+    @mock.patch('zc_events.amqp.redis.client.BasePipeline.execute', autospec=True)
     def test_options_detail(self, mock_redis):
         self.base_event['method'] = 'OPTIONS'
         self.base_event['pk'] = '115'
@@ -108,7 +634,7 @@ class TestHandleRequestEvent:
 
         self.mock_viewset.as_view.assert_called_with(self.object_actions)
 
-    @mock.patch('zc_events.client.redis.client.StrictRedis.execute_command')
+    @mock.patch('zc_events.amqp.redis.client.BasePipeline.execute', autospec=True)
     def test_options_list(self, mock_redis):
         self.base_event['method'] = 'OPTIONS'
         self.event_client.handle_request_event(self.base_event, viewset=self.mock_viewset)
@@ -0,0 +1,91 @@
+import mock
+import ujson
+from django.test import override_settings
+from rest_framework.request import Request
+from rest_framework.parsers import JSONParser
+
+from zc_events.django_request import clear_jwt_cache, create_django_request_object, get_internal_jwt
+
+
+class TestCreateDjangoRequestObject:
+
+    def setup(self):
+        clear_jwt_cache()
+
+    def teardown(self):
+        clear_jwt_cache()
+
+    def test_request_attributes(self):
+        request = create_django_request_object(['service'], 'include=order_items', 'get', user_id='1234')
+
+        assert request.method == 'GET'
+        assert request.GET['include'] == 'order_items'
+        assert request.META['HTTP_AUTHORIZATION'] == 'JWT {}'.format(get_internal_jwt(['service'], '1234'))
+        assert request.META['CONTENT_LENGTH'] == '0'
+
+    def test_dict_body_is_encoded_once(self):
+        body = {'data': {'type': 'Order', 'attributes': {'name': 'Lunch'}}}
+        request = create_django_request_object(['service'], '', 'POST', body=body)
+
+        assert ujson.loads(request.body) == body
+        assert request.META['CONTENT_LENGTH'] == str(len(request.body))
+
+    def test_string_body_is_passed_through(self):
+        body = '{"data": {"type": "Order"}}'
+        request = create_django_request_object(['service'], '', 'POST', body=body)
+
+        assert request.body == body
+
+    def test_body_is_parsed_by_rest_framework(self):
+        body = {'data': {'type': 'Order'}}
+        request = Request(create_django_request_object(['service'], '', 'POST', body=body),
+                          parsers=[JSONParser()])
+        request.META['CONTENT_TYPE'] = 'application/json'
+
+        assert request.data == body
+
+    @mock.patch('zc_events.django_request.jwt_encode_handler', return_value='token')
+    def test_jwt_is_cached_per_roles_and_user(self, mock_encode):
+        for _ in range(3):
+            create_django_request_object(['service'], '', 'GET', user_id='1')
+        create_django_request_object(['service'], '', 'GET', user_id='2')
+        create_django_request_object(['anonymous'], '', 'GET', user_id='1')
+
+        assert mock_encode.call_args_list == [
+            mock.call({'roles': ['service'], 'id': '1'}),
+            mock.call({'roles': ['service'], 'id': '2'}),
+            mock.call({'roles': ['anonymous'], 'id': '1'}),
+        ]
+
+    @mock.patch('zc_events.django_request.time.time')
+    @mock.patch('zc_events.django_request.jwt_encode_handler', return_value='token')
+    def test_cached_jwt_expires(self, mock_encode, mock_time):
+        mock_time.return_value = 1000
+        get_internal_jwt(['service'])
+        mock_time.return_value = 1000 + 299
+        get_internal_jwt(['service'])
+        assert mock_encode.call_count == 1
+
+        mock_time.return_value = 1000 + 301
+        get_internal_jwt(['service'])
+        assert mock_encode.call_count == 2
+
+    @override_settings(EVENTS_JWT_CACHE_TTL=0)
+    @mock.patch('zc_events.django_request.jwt_encode_handler', return_value='token')
+    def test_jwt_cache_disabled(self, mock_encode):
+        get_internal_jwt(['service'])
+        get_internal_jwt(['service'])
+
+        assert mock_encode.call_count == 2
+
+    @override_settings(EVENTS_TRUSTED_INTERNAL_REQUESTS=True)
+    @mock.patch('zc_events.django_request.jwt_encode_handler')
+    def test_trusted_request_skips_jwt(self, mock_encode):
+        request = create_django_request_object(['service'], '', 'GET', user_id='1234')
+
+        assert not mock_encode.called
+        assert 'HTTP_AUTHORIZATION' not in request.META
+
+        drf_request = Request(request)
+        assert drf_request.user.pk == '1234'
+        assert drf_request.user.roles == ['service']
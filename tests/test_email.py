@@ -1,7 +1,9 @@
+import hashlib
 import mock
 from unittest import TestCase
 
 from zc_events.client import EventClient
+from zc_events.email import clear_content_digest_cache
 
 
 class EmailTests(TestCase):
@@ -159,3 +161,126 @@ class EmailTests(TestCase):
             self.event_client.send_email(**self.send_email_kwargs)
 
         mock_emit_event.assert_not_called()
+
+
+class ContentAddressedEmailTests(TestCase):
+
+    def setUp(self):
+        self.send_email_kwargs = {
+            'from_email': 'from@test.com',
+            'to': ['to@test.com'],
+            'subject': 'email subject',
+            'html_body': '<p><strong>HTML</strong> email content</p>',
+            'plaintext_body': 'Plaintext email content',
+            'attachments': [('menu.pdf', 'application/pdf', 'menu contents')],
+            'files': ['tests/file1.pdf'],
+            'content_addressed': True,
+        }
+        self.event_client = EventClient()
+        clear_content_digest_cache()
+
+    def tearDown(self):
+        clear_content_digest_cache()
+
+    @mock.patch('zc_events.email.s3_key_exists', return_value=False)
+    @mock.patch('zc_events.email.save_file_contents_to_s3')
+    @mock.patch('zc_events.email.save_string_contents_to_s3')
+    @mock.patch('zc_events.client.EventClient.emit_microservice_email_notification')
+    def test_send_email_uses_digest_keys(self, mock_emit_event, mock_save_string_contents_to_s3,
+                                         mock_save_file_contents_to_s3, mock_key_exists):
+        self.event_client.send_email(**self.send_email_kwargs)
+
+        event_args = mock_emit_event.call_args_list[0][1]
+        html_digest = hashlib.sha256(self.send_email_kwargs['html_body']).hexdigest()
+        self.assertEqual(event_args['html_body_key'], 'sha256/{}/html'.format(html_digest))
+        self.assertEqual(event_args['attachments_keys'], [
+            'sha256/{}/attachment_menu.pdf'.format(hashlib.sha256('menu contents').hexdigest()),
+            'sha256/{}/attachment_file1.pdf'.format(hashlib.sha256(open('tests/file1.pdf', 'rb').read()).hexdigest()),
+        ])
+        self.assertEqual(mock_save_string_contents_to_s3.call_count, 3)
+        self.assertEqual(mock_save_file_contents_to_s3.call_count, 1)
+
+    @mock.patch('zc_events.email.s3_key_exists', return_value=False)
+    @mock.patch('zc_events.email.save_file_contents_to_s3')
+    @mock.patch('zc_events.email.save_string_contents_to_s3')
+    @mock.patch('zc_events.client.EventClient.emit_microservice_email_notification')
+    def test_send_email_repeat_content_is_uploaded_once(self, mock_emit_event, mock_save_string_contents_to_s3,
+                                                        mock_save_file_contents_to_s3, mock_key_exists):
+        for recipient in ['one@test.com', 'two@test.com', 'three@test.com']:
+            self.send_email_kwargs['to'] = [recipient]
+            self.event_client.send_email(**self.send_email_kwargs)
+
+        self.assertEqual(mock_emit_event.call_count, 3)
+        self.assertEqual(mock_key_exists.call_count, 4)
+        self.assertEqual(mock_save_string_contents_to_s3.call_count, 3)
+        self.assertEqual(mock_save_file_contents_to_s3.call_count, 1)
+
+        keys = [call[1]['attachments_keys'] for call in mock_emit_event.call_args_list]
+        self.assertEqual(keys[0], keys[1])
+        self.assertEqual(keys[0], keys[2])
+
+    @mock.patch('zc_events.email.s3_key_exists', return_value=True)
+    @mock.patch('zc_events.email.save_file_contents_to_s3')
+    @mock.patch('zc_events.email.save_string_contents_to_s3')
+    @mock.patch('zc_events.client.EventClient.emit_microservice_email_notification')
+    def test_send_email_skips_content_already_on_s3(self, mock_emit_event, mock_save_string_contents_to_s3,
+                                                    mock_save_file_contents_to_s3, mock_key_exists):
+        self.event_client.send_email(**self.send_email_kwargs)
+
+        mock_emit_event.assert_called_once()
+        mock_save_string_contents_to_s3.assert_not_called()
+        mock_save_file_contents_to_s3.assert_not_called()
+
+
+class BulkEmailTests(TestCase):
+
+    def setUp(self):
+        self.send_bulk_email_kwargs = {
+            'from_email': 'from@test.com',
+            'subject': 'email subject',
+            'html_body': '<p><strong>HTML</strong> email content</p>',
+            'plaintext_body': 'Plaintext email content',
+            'attachments': [('menu.pdf', 'application/pdf', 'menu contents')],
+        }
+        self.recipients = [
+            'one@test.com',
+            {'to': ['two@test.com'], 'cc': 'cc@test.com', 'user_id': '2'},
+            {'bcc': ['three@test.com'], 'resource_id': '3'},
+        ]
+        self.event_client = EventClient()
+
+    @mock.patch('zc_events.email.save_string_contents_to_s3')
+    @mock.patch('zc_events.client.EventClient.emit_microservice_email_notifications')
+    def test_send_bulk_email(self, mock_emit_events, mock_save_string_contents_to_s3):
+        mock_emit_events.side_effect = lambda event_type, events: [event['task_id'] for event in events]
+
+        task_ids = self.event_client.send_bulk_email(self.recipients, **self.send_bulk_email_kwargs)
+
+        self.assertEqual(mock_save_string_contents_to_s3.call_count, 3)
+        mock_emit_events.assert_called_once()
+        event_type, events = mock_emit_events.call_args[0]
+        self.assertEqual(event_type, 'send_email')
+        self.assertEqual(len(events), 3)
+        self.assertEqual(task_ids, [event['task_id'] for event in events])
+        self.assertEqual(len(set(task_ids)), 3)
+
+        self.assertEqual(events[0]['to'], ['one@test.com'])
+        self.assertEqual(events[1]['cc'], ['cc@test.com'])
+        self.assertEqual(events[1]['user_id'], '2')
+        self.assertEqual(events[2]['bcc'], ['three@test.com'])
+        self.assertEqual(events[2]['resource_id'], '3')
+        for event in events:
+            self.assertEqual(event['html_body_key'], events[0]['html_body_key'])
+            self.assertEqual(event['attachments_keys'], events[0]['attachments_keys'])
+            self.assertEqual(event['subject'], 'email subject')
+
+    @mock.patch('zc_events.email.save_string_contents_to_s3')
+    @mock.patch('zc_events.client.EventClient.emit_microservice_email_notifications')
+    def test_send_bulk_email_invalid_recipient__fail(self, mock_emit_events, mock_save_string_contents_to_s3):
+        self.recipients.append({'to': None})
+
+        with self.assertRaises(TypeError):
+            self.event_client.send_bulk_email(self.recipients, **self.send_bulk_email_kwargs)
+
+        mock_save_string_contents_to_s3.assert_not_called()
+        mock_emit_events.assert_not_called()
@@ -0,0 +1,119 @@
+import socket
+import time
+
+import mock
+import prometheus_client
+from django.test import override_settings
+
+from zc_events.client import EventClient
+from zc_events.django_request import structure_framed_response
+from zc_events.metrics import (
+    InMemoryMetrics, NullMetrics, PrometheusMetrics, StatsDMetrics, get_metrics, set_metrics
+)
+
+
+class TestMetricsBackends:
+
+    def test_null_metrics(self):
+        null_metrics = NullMetrics()
+
+        assert not null_metrics.enabled
+        assert null_metrics.timer('name') is null_metrics.timer('other')
+        with null_metrics.timer('name'):
+            null_metrics.incr('name')
+
+    def test_in_memory_metrics(self):
+        in_memory = InMemoryMetrics()
+        in_memory.incr('counter', tags={'a': 1})
+        in_memory.incr('counter', 2, tags={'a': 1})
+        with in_memory.timer('timer'):
+            pass
+
+        assert in_memory.get_counter('counter', tags={'a': 1}) == 3
+        assert in_memory.get_counter('counter') == 0
+        assert len(in_memory.get_timings('timer')) == 1
+
+    def test_statsd_metrics(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        server.bind(('127.0.0.1', 0))
+        server.settimeout(1)
+        statsd = StatsDMetrics(host='127.0.0.1', port=server.getsockname()[1], prefix='svc')
+
+        statsd.incr('request_event.shed', tags={'method': 'GET'})
+        statsd.timing('event.publish', 0.012)
+
+        assert server.recv(1024) == 'svc.request_event.shed:1|c|#method:GET'
+        assert server.recv(1024) == 'svc.event.publish:12|ms'
+
+    def test_prometheus_metrics(self):
+        registry = prometheus_client.CollectorRegistry()
+        prometheus = PrometheusMetrics(registry=registry)
+
+        prometheus.incr('request_event.shed', tags={'method': 'GET'})
+        prometheus.incr('request_event.shed', tags={'method': 'GET'})
+        prometheus.timing('event.publish', 0.2)
+
+        assert registry.get_sample_value('zc_events_request_event_shed_total', {'method': 'GET'}) == 2
+        assert registry.get_sample_value('zc_events_event_publish_count') == 1
+        assert registry.get_sample_value('zc_events_event_publish_sum') == 0.2
+
+
+class TestSharedMetrics:
+
+    def teardown(self):
+        set_metrics(None)
+
+    @override_settings(EVENTS_METRICS_BACKEND='zc_events.metrics.InMemoryMetrics')
+    def test_get_metrics_from_settings(self):
+        set_metrics(None)
+
+        assert isinstance(get_metrics(), InMemoryMetrics)
+        assert get_metrics() is get_metrics()
+
+    def test_get_metrics_defaults_to_null(self):
+        set_metrics(None)
+
+        assert isinstance(get_metrics(), NullMetrics)
+
+
+class TestClientInstrumentation:
+
+    def setup(self):
+        self.metrics = InMemoryMetrics()
+        set_metrics(self.metrics)
+        self.event_client = EventClient()
+        self.event_client.pika_pool = mock.MagicMock()
+        channel = self.event_client.pika_pool.acquire.return_value.channel
+        channel.basic_publish.return_value = True
+
+    def teardown(self):
+        set_metrics(None)
+
+    def _timed(self):
+        return set(name for name, tags in self.metrics.timings)
+
+    def test_emit_is_timed(self):
+        self.event_client.emit_microservice_event('order_created')
+
+        assert self._timed() == {'pika_pool.acquire', 'event.queue_declare', 'event.publish'}
+        assert len(self.metrics.get_timings('event.publish', tags={'exchange': 'test-exchange'})) == 1
+
+    @mock.patch('zc_events.amqp.redis.client.StrictRedis.execute_command')
+    def test_request_round_trip_is_timed(self, mock_redis):
+        mock_redis.return_value = ('key', structure_framed_response(200, '{"data": []}'))
+
+        self.event_client.get_remote_resource_data('Order')
+
+        assert {'request_event.wait', 'request_event.parse'} <= self._timed()
+
+    @mock.patch('zc_events.amqp.redis.client.BasePipeline.execute')
+    def test_handle_request_event_is_timed(self, mock_execute):
+        viewset = mock.Mock()
+        event = {'method': 'GET', 'roles': ['service'], 'query_string': '', 'response_key': 'request-1',
+                 'emitted_at': time.time(), 'request_priority': 9}
+        self.event_client.handle_request_event(event, viewset=viewset)
+
+        assert self._timed() == {'request_event.queue_latency', 'request_event.view',
+                                 'request_event.store_responses'}
+        assert len(self.metrics.get_timings('request_event.view', tags={'method': 'GET'})) == 1
+        assert len(self.metrics.get_timings('request_event.queue_latency', tags={'priority': 9})) == 1
@@ -0,0 +1,310 @@
+import time
+
+import mock
+import pytest
+from django.core.management import CommandError, call_command
+from django.db import transaction
+
+from zc_events.client import EventClient
+from zc_events.outbox import DatabaseOutbox, OutboxRelay, SQLiteOutbox
+from zc_events.transport import InMemoryTransport
+
+
+def wait_until(condition, timeout=2):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+class TestSQLiteOutbox:
+
+    @pytest.fixture(autouse=True)
+    def outbox(self, tmpdir):
+        self.path = str(tmpdir.join('outbox.db'))
+        self.outbox = SQLiteOutbox(self.path)
+
+    def append(self, *names, **kwargs):
+        self.outbox.append([('events', '', {'id': name}, kwargs.get('priority', 0)) for name in names])
+
+    def test_claim_in_order(self):
+        self.append('a', 'b', 'c', priority=3)
+
+        events = self.outbox.claim(2)
+
+        assert [event.message['id'] for event in events] == ['a', 'b']
+        assert events[0].exchange == 'events'
+        assert events[0].priority == 3
+        assert self.outbox.claim(2)[-1].message['id'] == 'c'
+
+    def test_claimed_events_are_not_claimed_by_another_process(self):
+        self.append('a', 'b')
+        self.outbox.claim(1)
+
+        other_outbox = SQLiteOutbox(self.path)
+        assert [event.message['id'] for event in other_outbox.claim(10)] == ['b']
+
+        with mock.patch('zc_events.outbox.time.time', return_value=time.time() + 61):
+            assert [event.message['id'] for event in other_outbox.claim(10)] == ['a', 'b']
+
+    def test_delete_and_release(self):
+        self.append('a', 'b')
+        events = self.outbox.claim(10)
+
+        self.outbox.delete([events[0].id])
+        self.outbox.release([events[1].id])
+
+        assert self.outbox.count() == 1
+        assert [event.message['id'] for event in SQLiteOutbox(self.path).claim(10)] == ['b']
+
+    def test_events_survive_reopening(self):
+        self.append('a')
+
+        assert SQLiteOutbox(self.path).count() == 1
+
+
+class TestOutboxRelay:
+
+    @pytest.fixture(autouse=True)
+    def outbox(self, tmpdir):
+        self.outbox = SQLiteOutbox(str(tmpdir.join('outbox.db')))
+        self.outbox.append([('events', '', {'id': name}, 0) for name in 'abc'])
+        self.publish = mock.Mock()
+        self.relay = OutboxRelay(self.outbox, self.publish, batch_size=2)
+
+    def test_relay_once_publishes_a_batch(self):
+        assert self.relay.relay_once() == 2
+        assert self.relay.relay_once() == 1
+        assert self.relay.relay_once() == 0
+
+        batches = [[event.message['id'] for event in call[0][0]] for call in self.publish.call_args_list]
+        assert batches == [['a', 'b'], ['c']]
+        assert self.outbox.count() == 0
+
+    def test_failed_batch_is_retried(self):
+        self.publish.side_effect = [Exception('Broker unreachable'), None]
+
+        with pytest.raises(Exception):
+            self.relay.relay_once()
+        assert self.outbox.count() == 3
+
+        self.relay.relay_once()
+        assert [event.message['id'] for event in self.publish.call_args[0][0]] == ['a', 'b']
+
+    def test_thread_drains_outbox(self):
+        self.relay.start()
+        try:
+            assert wait_until(lambda: self.outbox.count() == 0)
+        finally:
+            self.relay.stop(timeout=1)
+
+
+class TestEventClientOutbox:
+
+    @pytest.fixture(autouse=True)
+    def event_client(self, settings, tmpdir):
+        settings.EVENTS_OUTBOX = {'path': str(tmpdir.join('outbox.db')), 'interval': 0.05}
+        self.transport = InMemoryTransport()
+        # Tests start the relay themselves.
+        with mock.patch.object(EventClient, 'start_outbox_relay'):
+            self.event_client = EventClient(transport=self.transport)
+        yield
+        if self.event_client._outbox_relay:
+            self.event_client._outbox_relay.stop(timeout=1)
+
+    def test_events_are_published_through_the_outbox(self):
+        with mock.patch.object(self.event_client, 'start_outbox_relay') as mock_start_relay:
+            assert self.event_client.emit_microservice_event('order_created', resource_id='1')
+            task_ids = self.event_client.emit_microservice_email_notifications('order_shipped', [{}, {}])
+
+        assert mock_start_relay.return_value.wake.call_count == 2
+        assert self.transport.get_messages('order_created') == []
+        assert self.event_client.outbox.count() == 3
+
+        self.event_client.start_outbox_relay()
+
+        assert wait_until(lambda: len(self.transport.get_messages('order_shipped')) == 2)
+        assert self.transport.get_messages('order_created')[0]['kwargs']['resource_id'] == '1'
+        assert [message['id'] for message in self.transport.get_messages('order_shipped')] == task_ids
+
+    def test_relay_publishes_leftover_events_when_the_client_is_created(self):
+        with mock.patch.object(self.event_client, 'start_outbox_relay'):
+            self.event_client.emit_microservice_event('order_created', resource_id='1')
+
+        # A restarted service, the journal is on disk.
+        self.event_client = EventClient(transport=self.transport)
+
+        assert self.event_client._outbox_relay is not None
+        assert wait_until(lambda: len(self.transport.get_messages('order_created')) == 1)
+
+    def test_request_events_skip_the_outbox(self):
+        self.event_client.emit_microservice_event('order_request', response_key='request-1')
+
+        assert len(self.transport.get_messages('order_request')) == 1
+        assert self.event_client._outbox is None
+
+    def test_relay_is_replaced_in_a_forked_process(self):
+        relay = self.event_client.start_outbox_relay()
+        assert self.event_client.start_outbox_relay() is relay
+
+        with mock.patch('zc_events.client.os.getpid', return_value=relay.pid + 1):
+            assert self.event_client.start_outbox_relay() is not relay
+        relay.stop(timeout=1)
+
+    def test_relay_is_not_started_without_an_outbox(self, settings):
+        settings.EVENTS_OUTBOX = None
+
+        assert EventClient(transport=self.transport).start_outbox_relay() is None
+
+    def test_outbox_lock_is_replaced_after_fork(self):
+        outbox = self.event_client.outbox
+        outbox._lock.acquire()
+
+        self.event_client.reset_locks_after_fork()
+
+        assert outbox.count() == 0
+
+
+class TestOnCommit:
+
+    @pytest.fixture(autouse=True)
+    def event_client(self, settings):
+        settings.EVENTS_ON_COMMIT = True
+        self.transport = InMemoryTransport()
+        self.event_client = EventClient(transport=self.transport)
+
+    def get_resource_ids(self):
+        return [message['kwargs']['resource_id'] for message in self.transport.get_messages('order_created')]
+
+    @pytest.mark.django_db(transaction=True)
+    def test_events_are_published_in_one_batch_on_commit(self):
+        with mock.patch.object(self.event_client, '_publish_messages',
+                               wraps=self.event_client._publish_messages) as mock_publish:
+            with transaction.atomic():
+                self.event_client.emit_microservice_event('order_created', resource_id='1')
+                self.event_client.emit_microservice_messages('test-exchange', '', 'order_created',
+                                                             [{'resource_id': '2'}, {'resource_id': '3'}])
+                assert self.get_resource_ids() == []
+
+        assert mock_publish.call_count == 1
+        assert self.get_resource_ids() == ['1', '2', '3']
+
+    @pytest.mark.django_db(transaction=True)
+    def test_events_of_rolled_back_transactions_are_dropped(self):
+        with pytest.raises(ValueError):
+            with transaction.atomic():
+                self.event_client.emit_microservice_event('order_created', resource_id='1')
+                raise ValueError
+
+        with transaction.atomic():
+            self.event_client.emit_microservice_event('order_created', resource_id='2')
+            try:
+                with transaction.atomic():
+                    self.event_client.emit_microservice_event('order_created', resource_id='3')
+                    raise ValueError
+            except ValueError:
+                pass
+            self.event_client.emit_microservice_event('order_created', resource_id='4')
+
+        assert self.get_resource_ids() == ['2', '4']
+
+        with transaction.atomic():
+            self.event_client.emit_microservice_event('order_created', resource_id='5')
+        assert self.get_resource_ids() == ['2', '4', '5']
+
+    @pytest.mark.django_db(transaction=True)
+    def test_events_of_committed_savepoints_keep_their_order(self):
+        with mock.patch.object(self.event_client, '_publish_messages',
+                               wraps=self.event_client._publish_messages) as mock_publish:
+            with transaction.atomic():
+                self.event_client.emit_microservice_event('order_created', resource_id='1')
+                with transaction.atomic():
+                    self.event_client.emit_microservice_event('order_created', resource_id='2')
+                self.event_client.emit_microservice_event('order_created', resource_id='3')
+
+        assert mock_publish.call_count == 1
+        assert self.get_resource_ids() == ['1', '2', '3']
+
+    @pytest.mark.django_db(transaction=True)
+    def test_events_outside_transactions_and_requests_are_published_right_away(self):
+        self.event_client.emit_microservice_event('order_created', resource_id='1')
+
+        with transaction.atomic():
+            self.event_client.emit_microservice_event('order_request', response_key='request-1')
+            assert len(self.transport.get_messages('order_request')) == 1
+
+        assert self.get_resource_ids() == ['1']
+
+
+class TestDatabaseOutbox:
+
+    @pytest.fixture(autouse=True)
+    def event_client(self, settings):
+        settings.EVENTS_OUTBOX = {'backend': 'zc_events.outbox.DatabaseOutbox', 'relay': False}
+        self.transport = InMemoryTransport()
+        self.event_client = EventClient(transport=self.transport)
+        self.outbox = self.event_client.outbox
+
+    @pytest.mark.django_db(transaction=True)
+    def test_events_are_written_in_the_transaction(self):
+        with pytest.raises(ValueError):
+            with transaction.atomic():
+                self.event_client.emit_microservice_event('order_created', resource_id='1')
+                raise ValueError
+
+        with transaction.atomic():
+            self.event_client.emit_microservice_event('order_created', resource_id='2')
+            self.event_client.emit_microservice_event('order_created', resource_id='3')
+
+        assert isinstance(self.outbox, DatabaseOutbox)
+        assert self.event_client._outbox_relay is None
+        assert self.outbox.count() == 2
+
+        assert self.event_client.create_outbox_relay().relay_once() == 2
+        resource_ids = [message['kwargs']['resource_id'] for message in self.transport.get_messages('order_created')]
+        assert resource_ids == ['2', '3']
+        assert self.outbox.count() == 0
+
+    @pytest.mark.django_db(transaction=True)
+    def test_events_are_not_held_back_on_commit(self, settings):
+        settings.EVENTS_ON_COMMIT = True
+        event_client = EventClient(transport=self.transport)
+
+        with transaction.atomic():
+            event_client.emit_microservice_event('order_created', resource_id='1')
+            assert event_client.outbox.count() == 1
+
+    @pytest.mark.django_db(transaction=True)
+    def test_relay_is_woken_up_on_commit(self):
+        # The relay claims from its own connection, it only sees the rows once the transaction committed.
+        with mock.patch.object(self.event_client, 'start_outbox_relay') as mock_start_relay:
+            with transaction.atomic():
+                self.event_client.emit_microservice_event('order_created', resource_id='1')
+                self.event_client.emit_microservice_event('order_created', resource_id='2')
+                assert not mock_start_relay.return_value.wake.called
+
+            assert mock_start_relay.return_value.wake.call_count == 2
+
+            self.event_client.emit_microservice_event('order_created', resource_id='3')
+            assert mock_start_relay.return_value.wake.call_count == 3
+
+    @pytest.mark.django_db
+    def test_claim(self):
+        self.outbox.append([('events', '', {'id': name}, 0) for name in 'abc'])
+        other_outbox = DatabaseOutbox()
+
+        events = self.outbox.claim(2)
+        assert [event.message['id'] for event in events] == ['a', 'b']
+        assert [event.message['id'] for event in other_outbox.claim(2)] == ['c']
+
+        self.outbox.release([events[1].id])
+        self.outbox.delete([events[0].id])
+        assert [event.message['id'] for event in self.outbox.claim(2)] == ['b']
+        assert self.outbox.count() == 2
+
+
+def test_relay_command_requires_an_outbox(settings):
+    settings.EVENTS_OUTBOX = None
+
+    with pytest.raises(CommandError):
+        call_command('relay_events_outbox')
@@ -0,0 +1,66 @@
+from django.test import override_settings
+
+from zc_events.priority import PriorityPolicy
+
+
+class TestPriorityPolicy:
+
+    def test_call_site_defaults(self):
+        policy = PriorityPolicy()
+
+        assert policy.get_priority(call_site='emit_microservice_event') == 0
+        assert policy.get_priority(call_site='async_resource_request') == 5
+        assert policy.get_priority(call_site='get_remote_resource_data') == 9
+        assert policy.get_priority(call_site='unknown') == 0
+
+    def test_explicit_priority_wins(self):
+        policy = PriorityPolicy(resource_types={'Order': 7})
+
+        assert policy.get_priority('Order', 'get_remote_resource_data', priority=1) == 1
+
+    def test_resource_type_before_call_site(self):
+        policy = PriorityPolicy(resource_types={'Order': 7}, call_sites={'get_remote_resource': 3})
+
+        assert policy.get_priority('Order', 'get_remote_resource') == 7
+        assert policy.get_priority('User', 'get_remote_resource') == 3
+
+    def test_resource_type_does_not_lower_call_site(self):
+        policy = PriorityPolicy(resource_types={'Order': 3})
+
+        assert policy.get_priority('Order', 'get_remote_resource_data') == 9
+        assert policy.get_priority('Order', 'get_remote_resource') == 3
+
+    def test_priority_is_capped(self):
+        policy = PriorityPolicy(max_priority=5)
+
+        assert policy.get_priority(priority=9) == 5
+        assert policy.promote(4) == 5
+
+    @override_settings(EVENTS_PRIORITY_POLICY={'resource_types': {'Order': 8}, 'promotion_threshold': 0.5})
+    def test_from_settings(self):
+        policy = PriorityPolicy.from_settings()
+
+        assert policy.get_priority('Order') == 8
+        assert policy.promotion_threshold == 0.5
+
+    def test_promotion_delay(self):
+        policy = PriorityPolicy(promotion_threshold=0.5)
+
+        assert policy.get_promotion_delay(60, method='GET', priority=5) == 30
+        assert policy.get_promotion_delay(60, method='POST', priority=5) is None
+        assert policy.get_promotion_delay(60, method='GET', priority=10) is None
+        assert PriorityPolicy().get_promotion_delay(60, method='GET') is None
+
+    def test_queue_latency_stats(self):
+        policy = PriorityPolicy()
+        policy.record_queue_latency(9, 0.5)
+        policy.record_queue_latency(9, 1.5)
+        policy.record_queue_latency(None, 2.0)
+
+        assert policy.get_queue_latency_stats() == {
+            0: {'count': 1, 'mean': 2.0, 'max': 2.0},
+            9: {'count': 2, 'mean': 1.0, 'max': 1.5},
+        }
+
+        policy.reset_queue_latency_stats()
+        assert policy.get_queue_latency_stats() == {}
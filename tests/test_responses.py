@@ -0,0 +1,44 @@
+from zc_events.responses import EventRequestsMock
+
+
+class TestEventRequestsMockMatching:
+
+    def setup(self):
+        self.events_mock = EventRequestsMock()
+
+    def test_match_on_method_resource_type_pk_and_related_resource(self):
+        self.events_mock.add('GET', 'Order', pk=1, related_resource='items', json={'data': []})
+        self.events_mock.add('GET', 'Order', pk=1, json={'data': {}})
+
+        match = self.events_mock._find_match('Order', method='GET', id='1')
+        assert match['related_resource'] is None
+
+        assert self.events_mock._find_match('Order', method='GET', id='1') is None
+        assert self.events_mock._find_match('Order', method='POST', id='1', related_resource='items') is None
+        assert self.events_mock._find_match('Order', method='GET', id='1', related_resource='items')
+
+    def test_query_string_filters_matches(self):
+        self.events_mock.add('GET', 'Order', query_string='include=items', status=201)
+        self.events_mock.add('GET', 'Order', status=202)
+
+        assert self.events_mock._find_match('Order', method='GET', query_string='include=customer')['status'] == 202
+        assert self.events_mock._find_match('Order', method='GET', query_string='include%3Ditems')['status'] == 201
+
+    def test_first_added_match_wins_and_is_removed(self):
+        for status in (200, 201, 202):
+            self.events_mock.add('GET', 'Order', status=status)
+
+        statuses = [self.events_mock._find_match('Order', method='GET')['status'] for _ in range(3)]
+
+        assert statuses == [200, 201, 202]
+        assert not self.events_mock._events
+        assert not self.events_mock._event_index
+
+    def test_matches_are_kept_unless_all_requests_must_fire(self):
+        events_mock = EventRequestsMock(assert_all_requests_are_fired=False)
+        events_mock.add('GET', 'Order', status=200)
+        events_mock.add('GET', 'Order', status=201)
+
+        assert events_mock._find_match('Order', method='GET')['status'] == 200
+        assert events_mock._find_match('Order', method='GET')['status'] == 200
+        assert len(events_mock._events) == 2
@@ -0,0 +1,96 @@
+import pytest
+from django.test import override_settings
+
+from zc_events.routers import FrozenRoute, ServiceRegistry, TaskRouter
+
+
+class TestTaskRouter:
+
+    def setup(self):
+        self.router = TaskRouter()
+
+    def test_event_route(self):
+        assert self.router.route_for_task('microservice.event') == {
+            'exchange': 'test-exchange', 'exchange_type': 'fanout', 'routing_key': ''}
+
+    def test_notification_route(self):
+        assert self.router.route_for_task('microservice.notification') == {
+            'exchange': 'test-notification-exchange', 'exchange_type': 'topic',
+            'routing_key': 'microservice.notification.*'}
+
+    def test_default_route(self):
+        assert self.router.route_for_task('some.other.task') == {
+            'exchange': 'default', 'exchange_type': 'direct', 'routing_key': 'zc-events-test-default'}
+
+    def test_routes_are_cached_and_immutable(self):
+        route = self.router.lookup_route('microservice.event')
+
+        assert self.router.lookup_route('microservice.event') is route
+        assert isinstance(route, FrozenRoute)
+        with pytest.raises(TypeError):
+            route['routing_key'] = 'changed'
+
+    def test_route_for_task_returns_a_copy(self):
+        route = self.router.route_for_task('microservice.event')
+        route.pop('routing_key')
+        route['priority'] = 9
+
+        assert self.router.route_for_task('microservice.event')['routing_key'] == ''
+        assert 'priority' not in self.router.route_for_task('microservice.event')
+
+    @override_settings(EVENTS_TASK_ROUTES={
+        'microservice.event.priority': {'exchange': 'priority-exchange', 'exchange_type': 'direct',
+                                        'routing_key': 'priority'},
+        'billing.': {'exchange': 'billing', 'exchange_type': 'direct', 'routing_key': 'billing'},
+    })
+    def test_extra_routes_from_settings(self):
+        router = TaskRouter()
+
+        assert router.route_for_task('microservice.event.priority')['exchange'] == 'priority-exchange'
+        assert router.route_for_task('microservice.event')['exchange'] == 'test-exchange'
+        assert router.route_for_task('billing.charge')['exchange'] == 'billing'
+
+    def test_extra_routes_override_defaults(self):
+        router = TaskRouter(routes={'microservice.event': {'exchange': 'other', 'exchange_type': 'fanout',
+                                                           'routing_key': ''}})
+
+        assert router.route_for_task('microservice.event')['exchange'] == 'other'
+
+
+class TestServiceRegistry:
+
+    def test_services_by_resource_type(self):
+        registry = ServiceRegistry({'OrderItem': 'slots-and-orders'})
+        registry.register('Menu', 'menus')
+
+        assert registry.get_service('OrderItem') == 'slots-and-orders'
+        assert registry.get_request_service('order_item_request') == 'slots-and-orders'
+        assert registry.get_request_service('menu_request') == 'menus'
+        assert registry.get_request_service('user_request') is None
+
+
+class TestRequestRoutes:
+
+    @pytest.fixture(autouse=True)
+    def router(self, settings):
+        settings.EVENTS_REQUEST_EXCHANGE = 'test-requests'
+        settings.EVENTS_RESOURCE_SERVICES = {'Order': 'orders'}
+        self.router = TaskRouter()
+
+    def test_requests_go_to_the_owning_service(self):
+        route = self.router.route_for_task('microservice.event', ['order_request'], {'response_key': 'request-1'})
+
+        assert route == {'exchange': 'test-requests', 'exchange_type': 'direct', 'routing_key': 'orders'}
+        assert self.router.lookup_request_route('order_request') is self.router.lookup_request_route('order_request')
+
+    def test_other_events_are_broadcast(self):
+        assert self.router.route_for_task('microservice.event', ['user_request'],
+                                          {'response_key': 'request-1'})['exchange'] == 'test-exchange'
+        assert self.router.route_for_task('microservice.event', ['order_request'], {})['exchange'] == 'test-exchange'
+        assert self.router.route_for_task('microservice.event')['exchange'] == 'test-exchange'
+
+    def test_requests_are_broadcast_without_request_exchange(self, settings):
+        settings.EVENTS_REQUEST_EXCHANGE = None
+        route = TaskRouter().route_for_task('microservice.event', ['order_request'], {'response_key': 'request-1'})
+
+        assert route['exchange'] == 'test-exchange'
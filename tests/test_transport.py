@@ -0,0 +1,212 @@
+import time
+
+import mock
+import pytest
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework import viewsets
+from rest_framework.response import Response
+from zc_common.jwt_auth.authentication import JWTAuthentication
+
+from zc_events.client import EventClient
+from zc_events.event import ResourceRequestEvent
+from zc_events.exceptions import RequestTimeout, ServiceRequestException
+from zc_events.priority import PriorityPolicy
+from zc_events.amqp import AMQPRedisTransport
+from zc_events.transport import InMemoryKeyValueStore, InMemoryTransport, get_transport
+
+
+class OrderViewSet(viewsets.ViewSet):
+    authentication_classes = (JWTAuthentication,)
+    permission_classes = ()
+
+    def list(self, request):
+        return Response({'data': [{'type': 'Order', 'id': '1', 'attributes': {'name': 'Order 1'}}]})
+
+    def retrieve(self, request, pk=None):
+        if pk == '404':
+            return Response({'errors': [{'detail': 'Not found.'}]}, status=404)
+        return Response({'data': {'type': 'Order', 'id': pk, 'attributes': {'userId': request.user.id}}})
+
+
+def test_get_transport(settings):
+    assert isinstance(get_transport(), AMQPRedisTransport)
+
+    settings.EVENTS_TRANSPORT = 'zc_events.transport.InMemoryTransport'
+    assert isinstance(get_transport(), InMemoryTransport)
+
+
+class TestInMemoryKeyValueStore:
+
+    def setup(self):
+        self.store = InMemoryKeyValueStore()
+
+    def test_blpop(self):
+        self.store.rpush('key', 'a', 'b')
+
+        assert self.store.blpop('key', 1) == ('key', 'a')
+        assert self.store.blpop('key', 1) == ('key', 'b')
+        assert self.store.llen('key') == 0
+
+    def test_blpop_times_out(self):
+        started_at = time.time()
+
+        assert self.store.blpop('key', 0.05) is None
+        assert time.time() - started_at >= 0.05
+
+    def test_set_nx(self):
+        assert self.store.set('key', 1, ex=10, nx=True)
+        assert self.store.set('key', 2, ex=10, nx=True) is None
+
+        with mock.patch('zc_events.transport.time.time', return_value=time.time() + 11):
+            assert self.store.set('key', 2, ex=10, nx=True)
+
+    def test_expire(self):
+        assert not self.store.expire('key', 10)
+
+        pipeline = self.store.pipeline()
+        pipeline.rpush('key', 'a')
+        pipeline.expire('key', 10)
+        assert pipeline.execute() == [1, True]
+
+        with mock.patch('zc_events.transport.time.time', return_value=time.time() + 11):
+            assert self.store.llen('key') == 0
+
+
+class TestInMemoryTransport:
+
+    def setup(self):
+        self.transport = InMemoryTransport()
+        self.event_client = EventClient(transport=self.transport)
+
+    def test_events_are_recorded(self):
+        self.event_client.emit_microservice_event('order_created', resource_type='Order', resource_id='1')
+
+        messages = self.transport.get_messages('order_created')
+        assert len(messages) == 1
+        assert messages[0]['kwargs']['resource_id'] == '1'
+        assert self.transport.get_messages('order_updated') == []
+
+        self.transport.reset()
+        assert self.transport.get_messages('order_created') == []
+
+    def test_registered_handler(self):
+        handler = mock.Mock()
+        self.transport.register_handler('order_created', handler)
+
+        self.event_client.emit_microservice_event('order_created', resource_id='1')
+
+        assert handler.call_args[0][0]['resource_id'] == '1'
+
+    def test_request_is_handled_by_registered_viewset(self):
+        self.transport.register_view('Order', viewset=OrderViewSet)
+
+        order = self.event_client.get_remote_resource('Order', pk='1', user_id='42')
+        orders = self.event_client.get_remote_resource('Order')
+
+        assert order.id == '1'
+        assert order.user_id == '42'
+        assert [o.id for o in orders] == ['1']
+
+    def test_promoted_request_is_handled_once(self):
+        self.event_client.priority_policy = PriorityPolicy(promotion_threshold=0.5)
+        event = self.event_client.get_remote_resource_async('Order', pk='1')
+        event.promote()
+
+        copies = self.transport.get_messages(event.event_type)
+        assert [copy['kwargs']['attempt'] for copy in copies] == [1, 2]
+
+        for copy in reversed(copies):
+            self.event_client.handle_request_event(copy['kwargs'], viewset=OrderViewSet)
+
+        assert self.transport.redis_client.llen(event.response_key) == 1
+
+    def test_error_response(self):
+        self.transport.register_view('Order', viewset=OrderViewSet)
+
+        with pytest.raises(ServiceRequestException):
+            self.event_client.get_remote_resource('Order', pk='404')
+
+    def test_unhandled_request_times_out(self):
+        with pytest.raises(RequestTimeout):
+            self.event_client.get_remote_resource('Order', pk='1', timeout=1)
+
+        assert len(self.transport.get_messages('order_request')) == 1
+
+
+class TestAMQPResponseMode:
+
+    def setup(self):
+        self.transport = InMemoryTransport()
+        self.event_client = EventClient(transport=self.transport, response_mode='amqp')
+        self.transport.register_view('Order', viewset=OrderViewSet)
+
+    def test_responses_come_back_through_the_reply_queue(self):
+        order = self.event_client.get_remote_resource('Order', pk='1', user_id='42')
+
+        assert order.user_id == '42'
+        request = self.transport.get_messages('order_request')[0]['kwargs']
+        assert request['reply_to'] == 'in-memory-reply'
+        assert self.transport.redis_client.lists == {}
+
+    def test_mixed_response_modes(self):
+        redis_client = EventClient(transport=self.transport)
+        requests = [redis_client.get_remote_resource_async('Order', pk='1'),
+                    self.event_client.get_remote_resource_async('Order', pk='2')]
+        self.transport.pika_pool.handlers.clear()
+        self.transport.redis_client.flushall()
+
+        events = [message['kwargs'] for message in self.transport.get_messages('order_request')]
+        self.event_client.handle_request_events(events, viewset=OrderViewSet)
+
+        assert [request.complete().id for request in requests] == ['1', '2']
+        assert self.transport.redis_client.lists == {}
+
+    def test_reply_to_is_reserved(self):
+        with pytest.raises(AttributeError):
+            ResourceRequestEvent(self.event_client, 'order_request', reply_to='queue')
+
+    def test_unsupported_response_mode(self):
+        with pytest.raises(ImproperlyConfigured):
+            EventClient(transport=self.transport, response_mode='http')
+
+        with mock.patch.object(self.transport, 'get_reply_queue', return_value=None):
+            with pytest.raises(ImproperlyConfigured):
+                self.event_client.get_remote_resource('Order', pk='1')
+
+
+class TestRequestRouting:
+
+    @pytest.fixture(autouse=True)
+    def event_client(self, settings):
+        settings.EVENTS_REQUEST_EXCHANGE = 'test-requests'
+        settings.EVENTS_RESOURCE_SERVICES = {'Order': 'orders'}
+        self.transport = InMemoryTransport()
+        self.event_client = EventClient(transport=self.transport)
+        self.transport.register_view('Order', viewset=OrderViewSet)
+
+    def test_requests_are_sent_to_the_owning_service(self):
+        assert self.event_client.get_remote_resource('Order', pk='1').id == '1'
+        self.event_client.get_remote_resource('Order', pk='2')
+
+        message = self.transport.pika_pool.messages['order_request'][0]
+        assert (message.exchange, message.routing_key) == ('test-requests', 'orders')
+        assert self.transport.get_messages('order_request')[0]['task'] == 'microservice.event'
+        assert self.transport.pika_pool.exchanges == {'test-requests': 'direct'}
+
+    def test_other_events_are_broadcast(self):
+        self.transport.pika_pool.handlers.clear()
+        self.event_client.emit_microservice_event('order_request', resource_id='1')
+        with pytest.raises(RequestTimeout):
+            self.event_client.get_remote_resource('User', pk='1', timeout=1)
+
+        for event_type in ('order_request', 'user_request'):
+            message = self.transport.pika_pool.messages[event_type][0]
+            assert (message.exchange, message.routing_key) == ('test-exchange', '')
+
+    def test_request_exchange_is_declared_once_per_channel(self):
+        channel = self.transport.pika_pool.acquire().channel
+        with mock.patch.object(channel, 'exchange_declare') as mock_declare:
+            self.event_client.get_remote_resource('Order', pk='1')
+            self.event_client.get_remote_resource('Order', pk='2')
+
+        assert mock_declare.call_count == 1
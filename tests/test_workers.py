@@ -0,0 +1,26 @@
+import mock
+from celery.signals import worker_process_init
+
+from zc_events.workers import connect_worker_warm_up, warm_up_worker
+
+
+def test_connect_worker_warm_up():
+    event_client = mock.Mock()
+    receiver = connect_worker_warm_up(event_client, connections=2)
+
+    try:
+        worker_process_init.send(sender=None)
+    finally:
+        worker_process_init.disconnect(receiver)
+
+    event_client.warm_up.assert_called_once_with(2)
+
+
+@mock.patch('zc_events.workers.logger')
+def test_warm_up_failures_are_logged(mock_logger):
+    event_client = mock.Mock()
+    event_client.warm_up.side_effect = IOError
+
+    warm_up_worker(event_client)
+
+    assert mock_logger.exception.call_count == 1
@@ -0,0 +1,379 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import pika
+import pika_pool
+import redis
+from django.conf import settings
+from pika.adapters.blocking_connection import _IoloopTimerContext
+
+from zc_events.transport import Transport
+
+logger = logging.getLogger('django')
+
+# Defaults for the EVENTS_PIKA_POOL setting, `socket_timeout` is for the broker connections, the rest are
+# pika_pool.QueuedPool arguments.
+PIKA_POOL_DEFAULTS = {
+    'max_size': 10,
+    'max_overflow': 10,
+    'timeout': 10,
+    'recycle': 3600,
+    'stale': 45,
+    'socket_timeout': 5,
+}
+
+
+class InstrumentedQueuedPool(pika_pool.QueuedPool):
+    """
+    pika_pool.QueuedPool keeping track of how its connections are used, see `get_stats`.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(InstrumentedQueuedPool, self).__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self._acquires = 0
+        self._acquire_wait = 0.0
+        self._acquire_wait_max = 0.0
+        self._timeouts = 0
+        self._created = 0
+        self._recycled = 0
+
+    def acquire(self, timeout=None):
+        timeout = timeout or self.timeout
+        started_at = time.time()
+
+        try:
+            while True:
+                try:
+                    fairy = self._queue.get(False)
+                except queue.Empty:
+                    try:
+                        fairy = self._create()
+                    except pika_pool.Overflow:
+                        try:
+                            fairy = self._queue.get(timeout=timeout)
+                        except queue.Empty:
+                            fairy = self._create()
+
+                if not self.is_expired(fairy) and not self.is_stale(fairy):
+                    break
+
+                pika_pool.logger.info('closing expired or stale connection - %s', fairy)
+                with self._stats_lock:
+                    self._recycled += 1
+                self.close(fairy)
+        except pika_pool.Overflow:
+            with self._stats_lock:
+                self._timeouts += 1
+            raise pika_pool.Timeout()
+        finally:
+            wait = time.time() - started_at
+            with self._stats_lock:
+                self._acquires += 1
+                self._acquire_wait += wait
+                self._acquire_wait_max = max(self._acquire_wait_max, wait)
+
+        return self.Connection(self, fairy)
+
+    def _create(self):
+        fairy = super(InstrumentedQueuedPool, self)._create()
+        with self._stats_lock:
+            self._created += 1
+        return fairy
+
+    def get_stats(self):
+        """
+        Return the number of connections in use, idle in the pool and open above `max_size`, along with how many
+        connections were acquired, created and recycled, how many acquires timed out, and the total and maximum
+        seconds spent waiting in `acquire` since the pool was created.
+        """
+        with self._avail_lock:
+            open_connections = self.max_size + self.max_overflow - self._avail
+        idle = self._queue.qsize()
+
+        with self._stats_lock:
+            return {
+                'in_use': open_connections - idle,
+                'idle': idle,
+                'overflow': max(open_connections - self.max_size, 0),
+                'acquires': self._acquires,
+                'acquire_wait': self._acquire_wait,
+                'acquire_wait_max': self._acquire_wait_max,
+                'timeouts': self._timeouts,
+                'created': self._created,
+                'recycled': self._recycled,
+            }
+
+    def warm_up(self, connections):
+        """
+        Open connections until `connections` of them, at most `max_size`, are idle in the pool. They are all held
+        at once, so idle connections are counted instead of being acquired again.
+        """
+        acquired = []
+        try:
+            for _ in range(min(connections, self.max_size)):
+                acquired.append(self.acquire())
+        finally:
+            for connection in acquired:
+                connection.release()
+
+
+class PublisherConfirms(object):
+    """
+    Tracks the publisher confirms of a channel, so they can be waited for in batches instead of after every message.
+
+    BlockingChannel.confirm_delivery makes every publish wait for its own confirm, so confirm mode is enabled on the
+    underlying channel instead, and the acks and nacks are matched to the delivery tags of the published messages.
+    This goes through private pika APIs of pika 0.10.0, the version setup.py pins; check them when upgrading pika.
+
+    batch_size: how many messages may be unconfirmed before `batch_ready` asks to wait for them
+    batch_timeout: how many seconds the oldest message may be unconfirmed before `batch_ready` does
+    timeout: how many seconds `wait` waits for confirms at most
+    """
+
+    def __init__(self, channel, batch_size=100, batch_timeout=0.05, timeout=10):
+        self.channel = channel
+        self.batch_size = batch_size
+        self.batch_timeout = batch_timeout
+        self.timeout = timeout
+
+        # {delivery tag: message id} of the messages not confirmed yet, oldest first.
+        self._pending = OrderedDict()
+        self._nacked = []
+        self._delivery_tag = 0
+        self._oldest_pending_at = None
+
+        channel._impl.confirm_delivery(callback=self._on_confirmation, nowait=True)
+
+    def _on_confirmation(self, method_frame):
+        method = method_frame.method
+        if method.multiple:
+            delivery_tags = []
+            for delivery_tag in self._pending:
+                if delivery_tag > method.delivery_tag:
+                    break
+                delivery_tags.append(delivery_tag)
+        else:
+            delivery_tags = [method.delivery_tag]
+
+        nacked = isinstance(method, pika.spec.Basic.Nack)
+        for delivery_tag in delivery_tags:
+            message_id = self._pending.pop(delivery_tag, None)
+            if nacked and message_id is not None:
+                self._nacked.append(message_id)
+
+    def _is_confirmed(self):
+        return not self._pending
+
+    def add(self, message_id):
+        """Track a message that was just published on the channel."""
+        self._delivery_tag += 1
+        if not self._pending:
+            self._oldest_pending_at = time.time()
+        self._pending[self._delivery_tag] = message_id
+
+    def batch_ready(self):
+        return bool(self._pending) and (len(self._pending) >= self.batch_size or
+                                        time.time() - self._oldest_pending_at >= self.batch_timeout)
+
+    def reset(self):
+        """
+        Stop tracking the messages published so far, when their batch failed before waiting for them, so they
+        aren't reported to the next user of the channel. Their confirms are ignored when they arrive.
+        """
+        self._pending = OrderedDict()
+        self._nacked = []
+
+    def wait(self):
+        """
+        Wait for the confirms of all the tracked messages, and return the ids of the messages that were rejected
+        or not confirmed in time. Those are not tracked anymore.
+        """
+        if self._pending:
+            # Reading frames until the confirms arrived relies on private pika APIs, _IoloopTimerContext and
+            # BlockingChannel._flush_output, which is why setup.py pins the exact pika version.
+            with _IoloopTimerContext(self.timeout, self.channel.connection._impl) as timer:
+                self.channel._flush_output(timer.is_ready, self._is_confirmed)
+
+        failed = self._nacked + list(self._pending.values())
+        self._pending = OrderedDict()
+        self._nacked = []
+        return failed
+
+
+class AMQPReplyQueue(object):
+    """
+    Exclusive, server-named queue consumed by this process, which responses to its requests are published to when
+    the client's response mode is 'amqp'. Responses are matched to the requests waiting for them by
+    `correlation_id`.
+
+    The queue is consumed through its own connection. BlockingConnection isn't thread-safe, so the waiting threads
+    take turns reading from it and hand each other the responses they read. Responses nobody picked up within
+    `response_ttl` seconds, e.g. for requests that timed out, are dropped.
+    """
+
+    def __init__(self, parameters, response_ttl=60):
+        self.parameters = parameters
+        self.response_ttl = response_ttl
+        self._connection = None
+        self._name = None
+        self._responses = OrderedDict()
+        self._condition = threading.Condition()
+        self._reading = False
+
+    @property
+    def name(self):
+        with self._condition:
+            # Nothing reads from an idle connection, so it misses the broker's heartbeats and may have been closed.
+            # Servicing it before handing out the name also answers the heartbeats, unless another thread is
+            # reading from it right now.
+            if self._connection is not None and not self._reading:
+                if not self._connection.is_open or not self._read(0):
+                    self._connection = None
+            if self._connection is None:
+                self._connect()
+            return self._name
+
+    def _connect(self):
+        connection = pika.BlockingConnection(parameters=self.parameters)
+        channel = connection.channel()
+        result = channel.queue_declare(queue='', exclusive=True, auto_delete=True)
+        channel.basic_consume(self._on_response, queue=result.method.queue, no_ack=True)
+        self._connection = connection
+        self._name = result.method.queue
+
+    def _on_response(self, channel, method, properties, body):
+        now = time.time()
+        with self._condition:
+            self._responses[properties.correlation_id] = (body, now)
+            while self._responses:
+                correlation_id, (_, received_at) = next(iter(self._responses.items()))
+                if received_at > now - self.response_ttl:
+                    break
+                del self._responses[correlation_id]
+
+    def _read(self, time_limit):
+        connection = self._connection
+        self._reading = True
+        self._condition.release()
+        try:
+            connection.process_data_events(time_limit=time_limit)
+        except Exception:
+            # Requests sent with the old queue name as reply_to won't get their responses.
+            logger.exception('EVENT_CLIENT::REPLY_QUEUE_FAILURE: Lost the connection of reply queue %s', self._name)
+            self._condition.acquire()
+            self._connection = None
+            return False
+        else:
+            self._condition.acquire()
+            return True
+        finally:
+            self._reading = False
+            self._condition.notify_all()
+
+    def get(self, correlation_id, timeout):
+        """Wait up to `timeout` seconds for the response to a request, and return its body or None."""
+        deadline = time.time() + timeout
+
+        with self._condition:
+            while True:
+                response = self._responses.pop(correlation_id, None)
+                if response is not None:
+                    return response[0]
+
+                remaining = deadline - time.time()
+                if remaining <= 0 or self._connection is None:
+                    return None
+
+                if self._reading:
+                    self._condition.wait(remaining)
+                elif not self._read(remaining):
+                    return None
+
+
+def _get_redis_pool_stats(pool):
+    in_use = len(pool._in_use_connections)
+    idle = len(pool._available_connections)
+    return {'in_use': in_use, 'idle': idle, 'max_connections': pool.max_connections}
+
+
+class AMQPRedisTransport(Transport):
+    """
+    Publishes to RabbitMQ through a pool of pika connections, and passes responses through Redis, or through the
+    `AMQPReplyQueue` of the process in the 'amqp' response mode.
+
+    The pika pool is configured with the EVENTS_PIKA_POOL setting, a dict overriding PIKA_POOL_DEFAULTS. The
+    EVENTS_REDIS_POOL setting is a dict of extra `redis.ConnectionPool` arguments, e.g. `max_connections`.
+    When EVENTS_POOL_PREWARM is set, that many connections are opened in each pool right away.
+    """
+
+    def __init__(self):
+        redis_pool_settings = getattr(settings, 'EVENTS_REDIS_POOL', {})
+        self.redis_pool = redis.ConnectionPool.from_url(settings.REDIS_URL, db=0, **redis_pool_settings)
+        self.redis_client = redis.Redis(connection_pool=self.redis_pool)
+
+        self.pika_pool_settings = dict(PIKA_POOL_DEFAULTS, **getattr(settings, 'EVENTS_PIKA_POOL', {}))
+        self.pika_params = pika.URLParameters(settings.BROKER_URL)
+        self.pika_params.socket_timeout = self.pika_pool_settings.pop('socket_timeout')
+        self.pika_pool = self._create_pika_pool()
+        self._reply_queue = None
+        self._reply_queue_lock = threading.Lock()
+
+        prewarm = getattr(settings, 'EVENTS_POOL_PREWARM', 0)
+        if prewarm:
+            self.warm_up(prewarm)
+
+    def _create_pika_pool(self):
+        return InstrumentedQueuedPool(
+            create=lambda: pika.BlockingConnection(parameters=self.pika_params),
+            **self.pika_pool_settings
+        )
+
+    def after_fork(self):
+        # The parent process keeps using the connections it opened: closing them here would send a Close frame on
+        # its sockets, so they are dropped instead. The Redis pool already checks its pid and reconnects by itself.
+        self.pika_pool = self._create_pika_pool()
+        self._reply_queue = None
+        self._reply_queue_lock = threading.Lock()
+
+    def get_reply_queue(self):
+        if self._reply_queue is None:
+            with self._reply_queue_lock:
+                if self._reply_queue is None:
+                    self._reply_queue = AMQPReplyQueue(self.pika_params)
+        return self._reply_queue
+
+    def get_publisher_confirms(self, connection, **kwargs):
+        # Confirm mode stays enabled on the pooled channel, so its tracker is kept along with it.
+        fairy = connection.fairy
+        confirms = getattr(fairy, 'publisher_confirms', None)
+        if confirms is None or confirms.channel is not connection.channel:
+            confirms = fairy.publisher_confirms = PublisherConfirms(connection.channel, **kwargs)
+        return confirms
+
+    def get_stats(self):
+        return {
+            'pika': self.pika_pool.get_stats(),
+            'redis': _get_redis_pool_stats(self.redis_pool),
+        }
+
+    def warm_up(self, connections=1):
+        self.pika_pool.warm_up(connections)
+
+        acquired = []
+        try:
+            # Held at once, like the pika connections, so idle connections are reused rather than opened again.
+            for _ in range(min(connections, self.redis_pool.max_connections)):
+                connection = self.redis_pool.get_connection('PING')
+                acquired.append(connection)
+                connection.connect()
+        finally:
+            for connection in acquired:
+                self.redis_pool.release(connection)
@@ -1,32 +1,141 @@
+import os
 import sys
 import uuid
+from io import BytesIO
+from multiprocessing.pool import ThreadPool
+
 import boto
 from boto.s3.key import Key
+from boto.s3.multipart import MultiPartUpload
 from six import reraise as raise_
 
 from django.conf import settings
 
+from zc_events.metrics import get_metrics
+
+# S3 rejects multipart parts smaller than 5MB (except for the last one).
+MIN_MULTIPART_PART_SIZE = 5 * 1024 * 1024
+
+DEFAULT_MULTIPART_THRESHOLD = 16 * 1024 * 1024
+DEFAULT_MULTIPART_PART_SIZE = 8 * 1024 * 1024
+DEFAULT_MULTIPART_CONCURRENCY = 4
+DEFAULT_STREAM_CHUNK_SIZE = 1024 * 1024
+
 
 class S3IOException(Exception):
     pass
 
 
+def _get_bucket(aws_bucket_name, aws_access_key_id, aws_secret_access_key, validate=True):
+    connection = boto.connect_s3(aws_access_key_id, aws_secret_access_key)
+    return connection.get_bucket(aws_bucket_name, validate=validate)
+
+
+def _get_multipart_settings(multipart_threshold, part_size, concurrency):
+    multipart_threshold = multipart_threshold or getattr(settings, 'AWS_S3_MULTIPART_THRESHOLD',
+                                                         DEFAULT_MULTIPART_THRESHOLD)
+    part_size = part_size or getattr(settings, 'AWS_S3_MULTIPART_PART_SIZE', DEFAULT_MULTIPART_PART_SIZE)
+    concurrency = concurrency or getattr(settings, 'AWS_S3_MULTIPART_CONCURRENCY', DEFAULT_MULTIPART_CONCURRENCY)
+
+    return multipart_threshold, max(part_size, MIN_MULTIPART_PART_SIZE), max(concurrency, 1)
+
+
+def _multipart_upload(bucket, content_key, read_part, total_size, part_size, concurrency,
+                      aws_access_key_id, aws_secret_access_key):
+    """
+    Upload `total_size` bytes to S3 as a multipart upload with up to `concurrency` parts in flight.
+
+    `read_part(offset, length)` must return the bytes of the object in that range. Each part is only
+    held in memory while it is being uploaded.
+    """
+    multipart = bucket.initiate_multipart_upload(content_key)
+    upload_id = multipart.id
+    bucket_name = bucket.name
+
+    def upload_part(part):
+        part_number, offset, length = part
+        # boto connections are not shared between threads, every part gets its own.
+        part_bucket = _get_bucket(bucket_name, aws_access_key_id, aws_secret_access_key, validate=False)
+        part_upload = MultiPartUpload(part_bucket)
+        part_upload.key_name = content_key
+        part_upload.id = upload_id
+        part_upload.upload_part_from_file(BytesIO(read_part(offset, length)), part_number, size=length)
+
+    parts = []
+    for part_number, offset in enumerate(xrange(0, total_size, part_size), start=1):
+        parts.append((part_number, offset, min(part_size, total_size - offset)))
+
+    try:
+        if concurrency > 1 and len(parts) > 1:
+            pool = ThreadPool(min(concurrency, len(parts)))
+            try:
+                pool.map(upload_part, parts)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for part in parts:
+                upload_part(part)
+
+        multipart.complete_upload()
+    except Exception:
+        exc_info = sys.exc_info()
+        try:
+            multipart.cancel_upload()
+        except Exception:
+            pass
+        raise_(exc_info[0], exc_info[1], exc_info[2])
+
+
+def s3_key_exists(aws_bucket_name, content_key, aws_access_key_id=None, aws_secret_access_key=None):
+    """Check whether a key exists in an S3 bucket without downloading it."""
+
+    aws_access_key_id = aws_access_key_id or settings.AWS_ACCESS_KEY_ID
+    aws_secret_access_key = aws_secret_access_key or settings.AWS_SECRET_ACCESS_KEY
+
+    try:
+        bucket = _get_bucket(aws_bucket_name, aws_access_key_id, aws_secret_access_key)
+        return bucket.get_key(content_key) is not None
+    except StandardError as error:
+        msg = 'Failed to check key on S3. aws_bucket_name: {}, content_key: {}, ' \
+              'error_message: {}'.format(aws_bucket_name, content_key, error.message)
+        raise_(S3IOException(msg), None, sys.exc_info()[2])
+
+
 def save_string_contents_to_s3(stringified_data, aws_bucket_name, content_key=None,
-                               aws_access_key_id=None, aws_secret_access_key=None):
-    """Save data (provided in string format) to S3 bucket and return s3 key."""
+                               aws_access_key_id=None, aws_secret_access_key=None,
+                               multipart_threshold=None, part_size=None, concurrency=None):
+    """
+    Save data (provided in string format) to S3 bucket and return s3 key.
+
+    Data larger than `multipart_threshold` bytes is uploaded in parallel parts of `part_size` bytes
+    using `concurrency` threads.
+    """
 
     aws_access_key_id = aws_access_key_id or settings.AWS_ACCESS_KEY_ID
     aws_secret_access_key = aws_secret_access_key or settings.AWS_SECRET_ACCESS_KEY
+    multipart_threshold, part_size, concurrency = _get_multipart_settings(multipart_threshold, part_size,
+                                                                          concurrency)
 
     try:
         if not content_key:
             content_key = str(uuid.uuid4())
 
-        connection = boto.connect_s3(aws_access_key_id, aws_secret_access_key)
-        bucket = connection.get_bucket(aws_bucket_name)
+        bucket = _get_bucket(aws_bucket_name, aws_access_key_id, aws_secret_access_key)
 
-        key = Key(bucket, content_key)
-        key.set_contents_from_string(stringified_data)
+        with get_metrics().timer('s3.upload', tags={'bucket': aws_bucket_name}):
+            if stringified_data is not None and len(stringified_data) > multipart_threshold:
+                if isinstance(stringified_data, unicode):
+                    stringified_data = stringified_data.encode('utf-8')
+
+                def read_part(offset, length):
+                    return stringified_data[offset:offset + length]
+
+                _multipart_upload(bucket, content_key, read_part, len(stringified_data), part_size, concurrency,
+                                  aws_access_key_id, aws_secret_access_key)
+            else:
+                key = Key(bucket, content_key)
+                key.set_contents_from_string(stringified_data)
         return content_key
     except StandardError as error:
         msg = 'Failed to save contents to S3. aws_bucket_name: {}, content_key: {}, ' \
@@ -35,21 +144,39 @@ def save_string_contents_to_s3(stringified_data, aws_bucket_name, content_key=No
 
 
 def save_file_contents_to_s3(filepath, aws_bucket_name, content_key=None,
-                             aws_access_key_id=None, aws_secret_access_key=None):
-    """Upload a local file to S3 bucket and return S3 key."""
+                             aws_access_key_id=None, aws_secret_access_key=None,
+                             multipart_threshold=None, part_size=None, concurrency=None):
+    """
+    Upload a local file to S3 bucket and return S3 key.
+
+    Files larger than `multipart_threshold` bytes are uploaded in parallel parts of `part_size` bytes
+    using `concurrency` threads, reading only the parts in flight from disk.
+    """
 
     aws_access_key_id = aws_access_key_id or settings.AWS_ACCESS_KEY_ID
     aws_secret_access_key = aws_secret_access_key or settings.AWS_SECRET_ACCESS_KEY
+    multipart_threshold, part_size, concurrency = _get_multipart_settings(multipart_threshold, part_size,
+                                                                          concurrency)
 
     try:
         if not content_key:
             content_key = str(uuid.uuid4())
 
-        connection = boto.connect_s3(aws_access_key_id, aws_secret_access_key)
-        bucket = connection.get_bucket(aws_bucket_name)
-
-        k = Key(bucket, content_key)
-        k.set_contents_from_filename(filepath)
+        bucket = _get_bucket(aws_bucket_name, aws_access_key_id, aws_secret_access_key)
+
+        with get_metrics().timer('s3.upload', tags={'bucket': aws_bucket_name}):
+            file_size = os.path.getsize(filepath)
+            if file_size > multipart_threshold:
+                def read_part(offset, length):
+                    with open(filepath, 'rb') as f:
+                        f.seek(offset)
+                        return f.read(length)
+
+                _multipart_upload(bucket, content_key, read_part, file_size, part_size, concurrency,
+                                  aws_access_key_id, aws_secret_access_key)
+            else:
+                k = Key(bucket, content_key)
+                k.set_contents_from_filename(filepath)
         return content_key
     except StandardError as error:
         msg = 'Failed to save contents to S3. filepath: {}, aws_bucket_name: {}, content_key: {}, ' \
@@ -65,8 +192,7 @@ def read_s3_file_as_string(aws_bucket_name, content_key, delete=False,
     aws_secret_access_key = aws_secret_access_key or settings.AWS_SECRET_ACCESS_KEY
 
     try:
-        connection = boto.connect_s3(aws_access_key_id, aws_secret_access_key)
-        bucket = connection.get_bucket(aws_bucket_name)
+        bucket = _get_bucket(aws_bucket_name, aws_access_key_id, aws_secret_access_key)
 
         key = Key(bucket, content_key)
         output = key.get_contents_as_string()
@@ -79,3 +205,47 @@ def read_s3_file_as_string(aws_bucket_name, content_key, delete=False,
         msg = 'Failed to save contents to S3. aws_bucket_name: {}, content_key: {}, delete: {}, ' \
               'error_message: {}'.format(aws_bucket_name, content_key, delete, error.message)
         raise_(S3IOException(msg), None, sys.exc_info()[2])
+
+
+def iter_s3_file_chunks(aws_bucket_name, content_key, chunk_size=None,
+                        aws_access_key_id=None, aws_secret_access_key=None):
+    """
+    Yield the contents of an S3 file in chunks of at most `chunk_size` bytes.
+
+    Unlike `read_s3_file_as_string`, the object is never held in memory as a whole.
+    """
+
+    aws_access_key_id = aws_access_key_id or settings.AWS_ACCESS_KEY_ID
+    aws_secret_access_key = aws_secret_access_key or settings.AWS_SECRET_ACCESS_KEY
+    chunk_size = chunk_size or getattr(settings, 'AWS_S3_STREAM_CHUNK_SIZE', DEFAULT_STREAM_CHUNK_SIZE)
+
+    try:
+        bucket = _get_bucket(aws_bucket_name, aws_access_key_id, aws_secret_access_key)
+
+        key = Key(bucket, content_key)
+        key.open_read()
+        try:
+            while True:
+                chunk = key.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            key.close()
+    except StandardError as error:
+        msg = 'Failed to read contents from S3. aws_bucket_name: {}, content_key: {}, ' \
+              'error_message: {}'.format(aws_bucket_name, content_key, error.message)
+        raise_(S3IOException(msg), None, sys.exc_info()[2])
+
+
+def save_s3_file_to_path(aws_bucket_name, content_key, filepath, chunk_size=None,
+                         aws_access_key_id=None, aws_secret_access_key=None):
+    """Stream the contents of an S3 file to a local file and return the local file path."""
+
+    with open(filepath, 'wb') as f:
+        for chunk in iter_s3_file_chunks(aws_bucket_name, content_key, chunk_size=chunk_size,
+                                         aws_access_key_id=aws_access_key_id,
+                                         aws_secret_access_key=aws_secret_access_key):
+            f.write(chunk)
+
+    return filepath
@@ -2,22 +2,31 @@ from __future__ import division
 
 import logging
 import math
+import os
+import random
+import threading
+import time
 import ujson
 import urllib
 import uuid
+import weakref
+from importlib import import_module
 
-import pika
-import pika_pool
-import redis
 from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
+from django.utils.functional import SimpleLazyObject
+from django.utils.module_loading import import_string
 from inflection import underscore
 
-from zc_events.aws import save_string_contents_to_s3
-from zc_events.django_request import structure_response, create_django_request_object
-from zc_events.email import generate_email_data
+from zc_events.django_request import (
+    RESPONSE_FORMAT_FRAMED, structure_framed_response, structure_response, create_django_request_object
+)
 from zc_events.event import ResourceRequestEvent
 from zc_events.exceptions import EmitEventException
+from zc_events.metrics import get_metrics
+from zc_events.priority import PriorityPolicy
+from zc_events.routers import ServiceRegistry
+from zc_events.transport import get_transport
 from zc_events.utils import notification_event_payload
 
 SERVICE_ACTOR = 'service'
@@ -26,8 +35,40 @@ ANONYMOUS_ACTOR = 'anonymous'
 SERVICE_ROLES = [SERVICE_ACTOR]
 ANONYMOUS_ROLES = [ANONYMOUS_ACTOR]
 
+RESPONSE_TIMEOUT = 60
+
+RESPONSE_MODE_REDIS = 'redis'
+RESPONSE_MODE_AMQP = 'amqp'
+RESPONSE_MODES = (RESPONSE_MODE_REDIS, RESPONSE_MODE_AMQP)
+
+OUTBOX_RELAY_OPTIONS = ('batch_size', 'interval', 'relay')
+
 logger = logging.getLogger('django')
 
+# Imported once, on first use, so importing zc_events stays cheap. The names can still be imported and patched.
+pika = SimpleLazyObject(lambda: import_module('pika'))
+redis = SimpleLazyObject(lambda: import_module('redis'))
+_aws = SimpleLazyObject(lambda: import_module('zc_events.aws'))
+_email = SimpleLazyObject(lambda: import_module('zc_events.email'))
+
+
+def save_string_contents_to_s3(*args, **kwargs):
+    """See `zc_events.aws.save_string_contents_to_s3`."""
+    return _aws.save_string_contents_to_s3(*args, **kwargs)
+
+
+# Clients of this process, whose locks are replaced in a forked child.
+_event_clients = weakref.WeakSet()
+
+
+def _reset_locks_after_fork():
+    for event_client in list(_event_clients):
+        event_client.reset_locks_after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_locks_after_fork)
+
 
 class MethodNotAllowed(Exception):
     status_code = 405
@@ -43,33 +84,312 @@ class MethodNotAllowed(Exception):
         return self.detail
 
 
+class CommitHook(object):
+    """
+    Transaction commit hook of events emitted with EVENTS_ON_COMMIT, owning the messages of one dispatch. Django runs
+    the hooks of a transaction in order once it commits, and drops those of rolled back transactions and savepoints.
+    Each hook adds its messages to the batch of the transaction, and the last one sends the whole batch in one go.
+    """
+
+    def __init__(self, event_client, alias, messages):
+        self.event_client = event_client
+        self.alias = alias
+        self.messages = messages
+
+    def __call__(self):
+        self.event_client._run_commit_hook(self)
+
+
 class EventClient(object):
 
-    def __init__(self):
-        pool = redis.ConnectionPool().from_url(settings.REDIS_URL, db=0)
-        self.redis_client = redis.Redis(connection_pool=pool)
-
-        pika_params = pika.URLParameters(settings.BROKER_URL)
-        pika_params.socket_timeout = 5
-        self.pika_pool = pika_pool.QueuedPool(
-            create=lambda: pika.BlockingConnection(parameters=pika_params),
-            max_size=10,
-            max_overflow=10,
-            timeout=10,
-            recycle=3600,
-            stale=45,
-        )
+    def __init__(self, transport=None, response_mode=None):
+        """
+        `transport` holds the connections to the broker and to Redis. It defaults to the one named by the
+        EVENTS_TRANSPORT setting, see `zc_events.transport`, which is only created when the client is first
+        used, or right away when EVENTS_POOL_PREWARM is set.
+
+        `response_mode` is how responses to the requests of this client come back, by default the
+        EVENTS_RESPONSE_MODE setting: 'redis' through a Redis list per request, or 'amqp' through the reply queue
+        of the process on the broker.
+
+        When EVENTS_OUTBOX is set, the outbox relay starts right away, so events left over by a previous run are
+        published without waiting for the next one.
+        """
+        self._transport = None
+        self._transport_lock = threading.Lock()
+        self._pid = os.getpid()
+        self._pika_pool = None
+        self._redis_client = None
 
         self.events_exchange = settings.EVENTS_EXCHANGE
         self.notifications_exchange = getattr(settings, 'NOTIFICATIONS_EXCHANGE', None)
+        self.request_exchange = getattr(settings, 'EVENTS_REQUEST_EXCHANGE', None)
+        self.service_registry = ServiceRegistry.from_settings()
+        self._request_exchange_channels = weakref.WeakKeyDictionary()
+        self.response_timeout = getattr(settings, 'EVENTS_RESPONSE_TIMEOUT', RESPONSE_TIMEOUT)
+        self.request_min_remaining = getattr(settings, 'EVENTS_REQUEST_MIN_REMAINING', 0)
+        self.response_mode = response_mode or getattr(settings, 'EVENTS_RESPONSE_MODE', RESPONSE_MODE_REDIS)
+        if self.response_mode not in RESPONSE_MODES:
+            raise ImproperlyConfigured('Unknown response mode {}, use one of {}'.format(
+                self.response_mode, ', '.join(RESPONSE_MODES)))
+        self.priority_policy = PriorityPolicy.from_settings()
+        self.metrics = get_metrics()
+        self.log_sample_rate = getattr(settings, 'EVENTS_LOG_SAMPLE_RATE', 1.0)
+        self.publisher_confirms = getattr(settings, 'EVENTS_PUBLISHER_CONFIRMS', None)
+        self.outbox_settings = getattr(settings, 'EVENTS_OUTBOX', None)
+        self.on_commit = getattr(settings, 'EVENTS_ON_COMMIT', False)
+        self._commit_batches = threading.local()
+        self._outbox = None
+        self._outbox_relay = None
+        self._outbox_lock = threading.Lock()
+        self._handler_cache = {}
+
+        _event_clients.add(self)
+
+        if transport:
+            self._set_transport(transport)
+        elif getattr(settings, 'EVENTS_POOL_PREWARM', 0):
+            # Creating the transport opens the pre-warmed connections.
+            self._set_transport(get_transport())
+
+        if self.outbox_settings:
+            self.start_outbox_relay()
+
+    def _set_transport(self, transport):
+        self._transport = transport
+        transport.bind(self)
+
+    def reset_locks_after_fork(self):
+        """
+        Replace the locks of the client in a forked child, where a lock another thread of the parent held while
+        forking would never be released. Called by `os.register_at_fork` where available, and by
+        `zc_events.workers.warm_up_worker`. Only call it before the child starts other threads.
+        """
+        self._transport_lock = threading.Lock()
+        self._outbox_lock = threading.Lock()
+        if self._outbox is not None and hasattr(self._outbox, 'reset_locks_after_fork'):
+            self._outbox.reset_locks_after_fork()
 
-    def emit_microservice_message(self, exchange, routing_key, event_type, priority=0, *args, **kwargs):
+    def _check_fork(self):
+        """
+        Give the transport a chance to replace connections inherited from a parent process, e.g. by prefork
+        Celery workers or gunicorn, before they are used in the child.
+        """
+        with self._transport_lock:
+            pid = os.getpid()
+            if self._pid != pid:
+                if self._transport is not None:
+                    self._transport.after_fork()
+                self._pid = pid
+
+    @property
+    def transport(self):
+        if self._pid != os.getpid():
+            self._check_fork()
+        if self._transport is None:
+            with self._transport_lock:
+                if self._transport is None:
+                    self._set_transport(get_transport())
+        return self._transport
+
+    @property
+    def pika_pool(self):
+        return self._pika_pool or self.transport.pika_pool
+
+    @pika_pool.setter
+    def pika_pool(self, pika_pool):
+        self._pika_pool = pika_pool
+
+    @property
+    def redis_client(self):
+        return self._redis_client or self.transport.redis_client
+
+    @redis_client.setter
+    def redis_client(self, redis_client):
+        self._redis_client = redis_client
+
+    def get_pool_stats(self):
+        """Return live stats of the broker and Redis connection pools, see `zc_events.transport`."""
+        return self.transport.get_stats()
+
+    def warm_up(self, connections=1):
+        """
+        Open `connections` connections in each pool ahead of time, so the first events don't wait for them, and
+        start the outbox relay when EVENTS_OUTBOX is set.
+        """
+        self.transport.warm_up(connections)
+        if self.outbox_settings:
+            self.start_outbox_relay()
+
+    @property
+    def outbox(self):
+        """
+        The outbox events are written to when EVENTS_OUTBOX is set, else None. Its `backend` is a dotted path to a
+        class, by default `zc_events.outbox.SQLiteOutbox`, created with the other arguments of the setting.
+        """
+        if self._outbox is None and self.outbox_settings:
+            options = dict(self.outbox_settings)
+            for key in OUTBOX_RELAY_OPTIONS:
+                options.pop(key, None)
+            backend = import_string(options.pop('backend', 'zc_events.outbox.SQLiteOutbox'))
+            self._outbox = backend(**options)
+        return self._outbox
+
+    def create_outbox_relay(self, **kwargs):
+        """
+        Return a `zc_events.outbox.OutboxRelay` publishing the events in the outbox through this client, with the
+        `batch_size` and `interval` of EVENTS_OUTBOX unless given.
+        """
+        from zc_events.outbox import OutboxRelay
+
+        relay_options = {key: self.outbox_settings[key] for key in ('batch_size', 'interval')
+                         if key in self.outbox_settings}
+        relay_options.update(kwargs)
+        return OutboxRelay(self.outbox, self._publish_outbox_events, **relay_options)
+
+    def start_outbox_relay(self):
+        """
+        Start the background relay publishing the events in the outbox, if it isn't running in this process yet,
+        and return it. Call it when the service starts, to publish the events left over by a previous run
+        without waiting for the next event. It is otherwise started when the first event is written.
+
+        Returns None when EVENTS_OUTBOX is not set, or when its `relay` is False because events are relayed by
+        another process.
+        """
+        if not self.outbox_settings or not self.outbox_settings.get('relay', True):
+            return None
+
+        relay = self._outbox_relay
+        if relay is not None and relay.pid == os.getpid():
+            return relay
+
+        with self._outbox_lock:
+            # Threads don't survive a fork, a child process needs its own relay.
+            if self._outbox_relay is None or self._outbox_relay.pid != os.getpid():
+                relay = self.create_outbox_relay()
+                relay.start()
+                self._outbox_relay = relay
+        return self._outbox_relay
+
+    def _append_to_outbox(self, messages):
+        with self.metrics.timer('outbox.append'):
+            self.outbox.append(messages)
+        relay = self.start_outbox_relay()
+        if not relay:
+            return
+
+        if getattr(self.outbox, 'transactional', False):
+            from django.db import connections, transaction
+
+            # The relay can't see the rows before the transaction commits, waking it earlier would make it sleep.
+            if connections[self.outbox.using].in_atomic_block:
+                transaction.on_commit(relay.wake, using=self.outbox.using)
+                return
+        relay.wake()
+
+    def _publish_outbox_events(self, events):
+        """Publish `zc_events.outbox.OutboxEvent`s, for the outbox relay."""
+        self._publish_messages([(event.exchange, event.routing_key, event.message, event.priority)
+                                for event in events])
+
+    def _publish_messages(self, messages):
+        """
+        Publish a list of (exchange, routing key, message, priority) through a single pooled connection, and return
+        the broker's response to the last one.
+        """
+        response = None
+        with self._acquire_connection() as cxn:
+            confirms = self._get_publisher_confirms(cxn)
+            published = False
+            try:
+                self._declare_event_queue(cxn.channel)
+                for exchange, routing_key, message, priority in messages:
+                    if self.request_exchange and exchange == self.request_exchange:
+                        self._declare_request_exchange(cxn.channel)
+                    response = self._publish_message(cxn.channel, exchange, routing_key, message, priority=priority,
+                                                     confirms=confirms)
+                published = True
+            finally:
+                # The tracker goes back to the pool with the connection.
+                if confirms and not published:
+                    confirms.reset()
+            if confirms and messages:
+                self._wait_for_confirms(exchange, confirms)
+
+        return response
+
+    def _get_commit_connection(self):
+        """
+        Return the database connection whose transaction emitted events wait for when EVENTS_ON_COMMIT is set, either
+        to True for the default database or to a database alias. None when no transaction is open.
+        """
+        if not self.on_commit:
+            return None
+
+        from django.db import DEFAULT_DB_ALIAS, connections
+
+        connection = connections[DEFAULT_DB_ALIAS if self.on_commit is True else self.on_commit]
+        return connection if connection.in_atomic_block else None
+
+    def _get_commit_batch(self, alias):
+        """
+        Return the messages of the committed hooks run so far and weak references to the hooks still to run, in
+        the order they were registered, for the current thread.
+        """
+        return self._commit_batches.__dict__.setdefault(alias, ([], []))
+
+    def _buffer_until_commit(self, connection, messages):
+        hook = CommitHook(self, connection.alias, messages)
+        _, pending_hooks = self._get_commit_batch(connection.alias)
+        # Django lets go of the hooks it drops on rollback, which makes their references dead.
+        pending_hooks[:] = [ref for ref in pending_hooks if ref() is not None]
+        pending_hooks.append(weakref.ref(hook))
+        connection.on_commit(hook)
+
+    def _run_commit_hook(self, hook):
+        batch, pending_hooks = self._get_commit_batch(hook.alias)
+        batch.extend(hook.messages)
+        pending_hooks[:] = [ref for ref in pending_hooks if ref() is not None and ref() is not hook]
+        if pending_hooks:
+            return
+
+        messages = list(batch)
+        del batch[:]
+        self._dispatch_messages(messages)
+
+    def _dispatch_messages(self, messages):
+        """
+        Send a list of (exchange, routing key, message, priority) on its way: buffered until the current transaction
+        commits with EVENTS_ON_COMMIT, written to the outbox with EVENTS_OUTBOX, else published right away. Events
+        are written to a transactional outbox, e.g. `DatabaseOutbox`, straight away even with EVENTS_ON_COMMIT.
+        """
+        # An outbox writing to the database already follows the transaction.
+        if self.outbox_settings and getattr(self.outbox, 'transactional', False):
+            self._append_to_outbox(messages)
+            return True
+
+        connection = self._get_commit_connection()
+        if connection is not None:
+            self._buffer_until_commit(connection, messages)
+            return True
+
+        if self.outbox_settings:
+            self._append_to_outbox(messages)
+            return True
+
+        return self._publish_messages(messages)
+
+    def _build_message(self, exchange, routing_key, event_type, *args, **kwargs):
         task_id = str(uuid.uuid4())
 
         keyword_args = {'task_id': task_id}
         keyword_args.update(kwargs)
 
-        task = 'microservice.notification' if routing_key else 'microservice.event'
+        # Requests routed to the service owning their resource are events all the same.
+        if routing_key and not (self.request_exchange and exchange == self.request_exchange):
+            task = 'microservice.notification'
+        else:
+            task = 'microservice.event'
 
         message = {
             'task': task,
@@ -78,19 +398,69 @@ class EventClient(object):
             'kwargs': keyword_args
         }
 
-        event_queue_name = '{}-events'.format(settings.SERVICE_NAME)
-        event_body = ujson.dumps(message)
+        return message
 
-        logger.info('{}::EMIT: Emitting [{}:{}] event for object ({}:{}) and user {}'.format(
-            exchange.upper(), event_type, task_id, kwargs.get('resource_type'), kwargs.get('resource_id'),
-            kwargs.get('user_id')))
+    def _acquire_connection(self):
+        with self.metrics.timer('pika_pool.acquire'):
+            return self.pika_pool.acquire()
 
+    def _declare_event_queue(self, channel):
+        event_queue_name = '{}-events'.format(settings.SERVICE_NAME)
         queue_arguments = {
-            'x-max-priority': 10
+            'x-max-priority': self.priority_policy.max_priority
         }
-        with self.pika_pool.acquire() as cxn:
-            cxn.channel.queue_declare(queue=event_queue_name, durable=True, arguments=queue_arguments)
-            response = cxn.channel.basic_publish(
+        with self.metrics.timer('event.queue_declare'):
+            channel.queue_declare(queue=event_queue_name, durable=True, arguments=queue_arguments)
+
+    def _declare_request_exchange(self, channel):
+        """
+        Make sure EVENTS_REQUEST_EXCHANGE exists before publishing to it, since publishing to a missing exchange
+        closes the channel. It is only declared once per pooled channel.
+        """
+        if channel in self._request_exchange_channels:
+            return
+        channel.exchange_declare(exchange=self.request_exchange, exchange_type='direct', durable=True)
+        self._request_exchange_channels[channel] = True
+
+    def _should_log_emit(self):
+        """
+        Check whether an EMIT log line should be written, which only a fraction EVENTS_LOG_SAMPLE_RATE of them are.
+        """
+        if not logger.isEnabledFor(logging.INFO):
+            return False
+        return self.log_sample_rate >= 1 or random.random() < self.log_sample_rate
+
+    def _log_emit(self, log_format, exchange, message):
+        kwargs = message['kwargs']
+        logger.info(log_format, exchange.upper(), message['args'][0], message['id'], kwargs.get('resource_type'),
+                    kwargs.get('resource_id'), kwargs.get('user_id'))
+
+    def _get_publisher_confirms(self, connection):
+        """
+        Return the publisher confirms tracker of a pooled connection when EVENTS_PUBLISHER_CONFIRMS is set, either to
+        True or to a dict of `zc_events.amqp.PublisherConfirms` arguments.
+        """
+        if not self.publisher_confirms:
+            return None
+        options = self.publisher_confirms if isinstance(self.publisher_confirms, dict) else {}
+        return self.transport.get_publisher_confirms(connection, **options)
+
+    def _wait_for_confirms(self, exchange, confirms):
+        with self.metrics.timer('event.confirm', tags={'exchange': exchange}):
+            failed = confirms.wait()
+
+        if failed:
+            logger.info('%s::EMIT_FAILURE: Broker did not confirm events %s', exchange.upper(), failed)
+            raise EmitEventException('Messages may have failed to deliver: {}'.format(', '.join(failed)))
+
+    def _publish_message(self, channel, exchange, routing_key, message, priority=0, confirms=None):
+        event_body = ujson.dumps(message)
+
+        if self._should_log_emit():
+            self._log_emit('%s::EMIT: Emitting [%s:%s] event for object (%s:%s) and user %s', exchange, message)
+
+        with self.metrics.timer('event.publish', tags={'exchange': exchange}):
+            response = channel.basic_publish(
                 exchange,
                 routing_key,
                 event_body,
@@ -102,16 +472,62 @@ class EventClient(object):
             )
 
         if not response:
-            logger.info(
-                '''{}::EMIT_FAILURE: Failure emitting [{}:{}] event for object ({}:{}) and user {}'''.format(
-                    exchange.upper(), event_type, task_id, kwargs.get('resource_type'),
-                    kwargs.get('resource_id'), kwargs.get('user_id')))
+            self._log_emit('%s::EMIT_FAILURE: Failure emitting [%s:%s] event for object (%s:%s) and user %s',
+                           exchange, message)
             raise EmitEventException("Message may have failed to deliver")
 
+        if confirms:
+            confirms.add(message['id'])
+            if confirms.batch_ready():
+                self._wait_for_confirms(exchange, confirms)
+
         return response
 
+    def emit_microservice_message(self, exchange, routing_key, event_type, priority=0, *args, **kwargs):
+        """
+        Publish an event. With EVENTS_ON_COMMIT or EVENTS_OUTBOX set, see `_dispatch_messages`, the event is
+        published later, except for request events: their caller is waiting for the response right away.
+        """
+        message = self._build_message(exchange, routing_key, event_type, *args, **kwargs)
+
+        if kwargs.get('response_key'):
+            return self._publish_messages([(exchange, routing_key, message, priority)])
+        return self._dispatch_messages([(exchange, routing_key, message, priority)])
+
+    def emit_microservice_messages(self, exchange, routing_key, event_type, events_kwargs, priority=0):
+        """
+        Emit one message per item of `events_kwargs` through a single pooled connection.
+
+        With EVENTS_PUBLISHER_CONFIRMS, confirms are waited for in batches while publishing, and for the last batch
+        before returning.
+
+        With EVENTS_ON_COMMIT or EVENTS_OUTBOX set, the messages are published later, see `_dispatch_messages`.
+
+        Returns the task ids of the emitted messages, in order.
+        """
+        messages = [self._build_message(exchange, routing_key, event_type, **kwargs) for kwargs in events_kwargs]
+
+        self._dispatch_messages([(exchange, routing_key, message, priority) for message in messages])
+
+        return [message['kwargs']['task_id'] for message in messages]
+
+    def get_event_route(self, event_type, is_request=False):
+        """
+        Return the exchange and routing key of an event. Requests for a resource type owned by a service in
+        EVENTS_RESOURCE_SERVICES go to EVENTS_REQUEST_EXCHANGE, with the name of the service as routing key, when it
+        is set. Everything else is broadcast on EVENTS_EXCHANGE.
+        """
+        if is_request and self.request_exchange:
+            service = self.service_registry.get_request_service(event_type)
+            if service:
+                return self.request_exchange, service
+        return self.events_exchange, ''
+
     def emit_microservice_event(self, event_type, *args, **kwargs):
-        return self.emit_microservice_message(self.events_exchange, '', event_type, *args, **kwargs)
+        if not args and 'priority' not in kwargs:
+            kwargs['priority'] = self.priority_policy.get_priority(call_site='emit_microservice_event')
+        exchange, routing_key = self.get_event_route(event_type, is_request=bool(kwargs.get('response_key')))
+        return self.emit_microservice_message(exchange, routing_key, event_type, *args, **kwargs)
 
     def emit_microservice_email_notification(self, event_type, *args, **kwargs):
         return self.emit_microservice_message(
@@ -121,8 +537,36 @@ class EventClient(object):
         return self.emit_microservice_message(
             self.notifications_exchange, 'microservice.notification.text', event_type, *args, **kwargs)
 
-    def wait_for_response(self, response_key):
-        response = self.redis_client.blpop(response_key, 60)
+    def emit_microservice_email_notifications(self, event_type, events_kwargs):
+        return self.emit_microservice_messages(
+            self.notifications_exchange, 'microservice.notification.email', event_type, events_kwargs)
+
+    @property
+    def reply_queue(self):
+        reply_queue = self.transport.get_reply_queue()
+        if reply_queue is None:
+            raise ImproperlyConfigured('{} does not support the amqp response mode'.format(
+                type(self.transport).__name__))
+        return reply_queue
+
+    def get_reply_to(self):
+        """Return the queue responses to this client's requests should be published to, None to use Redis."""
+        if self.response_mode == RESPONSE_MODE_AMQP:
+            return self.reply_queue.name
+        return None
+
+    def wait_for_response(self, response_key, timeout=None):
+        """
+        Wait for the response to a request, and return (response key, response) like BLPOP, or None when it didn't
+        arrive within `timeout` seconds.
+        """
+        timeout = timeout or self.response_timeout
+        with self.metrics.timer('request_event.wait'):
+            if self.response_mode == RESPONSE_MODE_AMQP:
+                response = self.reply_queue.get(response_key, timeout)
+                return (response_key, response) if response is not None else None
+
+            response = self.redis_client.blpop(response_key, timeout)
         return response
 
     def _get_handler_for_viewset(self, viewset, is_detail):
@@ -145,11 +589,105 @@ class EventClient(object):
 
         return viewset.as_view(actions)
 
-    def handle_request_event(self, event, view=None, viewset=None, relationship_viewset=None):
+    def _build_handler(self, view=None, viewset=None, relationship_viewset=None, is_detail=False,
+                       relationship=False, related_resource=None):
+        if view:
+            return view.as_view()
+        if is_detail:
+            if relationship:
+                return relationship_viewset.as_view()
+            if related_resource:
+                return viewset.as_view({'get': related_resource})
+            return self._get_handler_for_viewset(viewset, is_detail=True)
+        return self._get_handler_for_viewset(viewset, is_detail=False)
+
+    def get_handler(self, view=None, viewset=None, relationship_viewset=None, is_detail=False,
+                    relationship=False, related_resource=None):
         """
-        Method to handle routing request event to appropriate view by constructing
-        a request object based on the parameters of the event.
+        Return the view function handling a request event, building it on first use and caching it per
+        view class and kind of request. Related resources come from the event, so only those the viewset has an
+        action for are cached.
+        """
+        if view:
+            key = (view,)
+        elif is_detail and relationship:
+            key = (relationship_viewset, 'relationship')
+        elif is_detail and related_resource:
+            if not hasattr(viewset, related_resource):
+                return self._build_handler(viewset=viewset, is_detail=is_detail, related_resource=related_resource)
+            key = (viewset, 'related', related_resource)
+        else:
+            key = (viewset, 'detail' if is_detail else 'list')
+
+        try:
+            return self._handler_cache[key]
+        except KeyError:
+            handler = self._build_handler(view=view, viewset=viewset, relationship_viewset=relationship_viewset,
+                                          is_detail=is_detail, relationship=relationship,
+                                          related_resource=related_resource)
+            self._handler_cache[key] = handler
+            return handler
+
+    def warm_handler_cache(self, view=None, viewset=None, relationship_viewset=None, related_resources=()):
         """
+        Build the handlers for a view or viewset ahead of time, e.g. when a worker starts, so the first
+        requests don't pay for it.
+        """
+        if view:
+            self.get_handler(view=view)
+        if viewset:
+            self.get_handler(viewset=viewset, is_detail=False)
+            self.get_handler(viewset=viewset, is_detail=True)
+            for related_resource in related_resources:
+                self.get_handler(viewset=viewset, is_detail=True, related_resource=related_resource)
+        if relationship_viewset:
+            self.get_handler(relationship_viewset=relationship_viewset, is_detail=True, relationship=True)
+
+    def _get_request_deadline(self, event):
+        deadline = event.get('deadline')
+        if not deadline and event.get('emitted_at'):
+            deadline = event['emitted_at'] + self.response_timeout
+        return deadline
+
+    def _should_shed_request(self, event, deadline):
+        """
+        Check whether the caller of a request event stopped waiting, or will have before the response is ready.
+        """
+        if not deadline or deadline - time.time() > self.request_min_remaining:
+            return False
+
+        logger.info('REQUEST_EVENT::EXPIRED: Skipping [%s] %s request for object %s past its deadline',
+                    event.get('task_id'), event.get('method'), event.get('pk'))
+        self.metrics.incr('request_event.shed', tags={'method': event.get('method')})
+        return True
+
+    def _claim_request(self, event, deadline):
+        """
+        Claim a request that may be published more than once, see `RequestEvent.promote`, so only the first of its
+        copies to arrive is handled. Return False if another copy was claimed already.
+        """
+        expire = int(math.ceil(deadline - time.time())) + 1 if deadline else self.response_timeout
+        claim_key = '{}:claimed'.format(event.get('response_key'))
+        if self.redis_client.set(claim_key, event['attempt'], ex=max(expire, 1), nx=True):
+            return True
+
+        logger.info('REQUEST_EVENT::DUPLICATE: Skipping attempt %s of [%s] %s request for object %s, another copy '
+                    'was handled', event['attempt'], event.get('task_id'), event.get('method'), event.get('pk'))
+        self.metrics.incr('request_event.duplicate', tags={'method': event.get('method')})
+        return False
+
+    def _process_request_event(self, event, view=None, viewset=None, relationship_viewset=None):
+        """
+        Run the view for a request event and return the response key, structured response, expiry of the
+        response and the queue to reply to, or None if the request was skipped.
+        """
+        received_at = time.time()
+        deadline = self._get_request_deadline(event)
+        if self._should_shed_request(event, deadline):
+            return None
+        if event.get('attempt') and not self._claim_request(event, deadline):
+            return None
+
         request = create_django_request_object(
             roles=event.get('roles'),
             query_string=event.get('query_string'),
@@ -168,32 +706,121 @@ class EventClient(object):
         related_resource = event.get('related_resource', None)
 
         handler_kwargs = {}
-        if view:
-            handler = view.as_view()
-        elif pk:
+        if pk and not view:
             handler_kwargs['pk'] = pk
             if relationship:
                 # Relationship views expect this kwarg as 'related_field'. See https://goo.gl/WW4ePd
                 handler_kwargs['related_field'] = relationship
-                handler = relationship_viewset.as_view()
             elif related_resource:
-                handler = viewset.as_view({'get': related_resource})
                 handler_kwargs['related_resource'] = related_resource
-            else:
-                handler = self._get_handler_for_viewset(viewset, is_detail=True)
-        else:
-            handler = self._get_handler_for_viewset(viewset, is_detail=False)
 
+        handler = self.get_handler(view=view, viewset=viewset, relationship_viewset=relationship_viewset,
+                                   is_detail=bool(pk), relationship=bool(relationship),
+                                   related_resource=related_resource)
+
+        emitted_at = event.get('emitted_at')
+        if emitted_at:
+            queue_latency = received_at - emitted_at
+            self.priority_policy.record_queue_latency(event.get('request_priority'), queue_latency)
+            self.metrics.timing('request_event.queue_latency', queue_latency,
+                                tags={'priority': event.get('request_priority') or 0})
+
+        started_at = time.time()
         result = handler(request, **handler_kwargs)
+        finished_at = time.time()
+        self.metrics.timing('request_event.view', finished_at - started_at, tags={'method': event.get('method')})
+
+        timings = {'received_at': received_at, 'started_at': started_at, 'finished_at': finished_at}
+        if event.get('response_format') == RESPONSE_FORMAT_FRAMED:
+            response = structure_framed_response(result.status_code, result.rendered_content, timings=timings)
+        else:
+            response = structure_response(result.status_code, result.rendered_content, timings=timings)
 
-        # Takes result and drops it into Redis with the key passed in the event
-        self.redis_client.rpush(response_key, structure_response(result.status_code, result.rendered_content))
-        self.redis_client.expire(response_key, 60)
+        # Nobody reads the response past the deadline.
+        expire = int(math.ceil(deadline - time.time())) + 1 if deadline else self.response_timeout
+
+        return response_key, response, max(expire, 1), event.get('reply_to')
+
+    def _store_responses(self, responses):
+        """
+        Drop responses into Redis under the keys passed in their events, in a single round-trip, and publish those
+        of requests sent with a `reply_to` queue to it, with their response key as correlation id.
+        """
+        with self.metrics.timer('request_event.store_responses'):
+            replies = [response for response in responses if response[3]]
+            if replies:
+                self._publish_replies(replies)
+            if len(replies) == len(responses):
+                return
+
+            pipeline = self.redis_client.pipeline()
+            for response_key, response, expire, reply_to in responses:
+                if not reply_to:
+                    pipeline.rpush(response_key, response)
+                    pipeline.expire(response_key, expire)
+            pipeline.execute()
+
+    def _publish_replies(self, replies):
+        with self._acquire_connection() as cxn:
+            # Replies take up delivery tags on a channel in confirm mode, so they are tracked like events.
+            confirms = self._get_publisher_confirms(cxn)
+            published = False
+            try:
+                for response_key, response, expire, reply_to in replies:
+                    # Through the default exchange, straight to the requester's queue.
+                    cxn.channel.basic_publish('', reply_to, response, pika.BasicProperties(
+                        correlation_id=response_key,
+                        expiration=str(expire * 1000)
+                    ))
+                    if confirms:
+                        confirms.add(response_key)
+                        if confirms.batch_ready():
+                            self._wait_for_confirms('reply', confirms)
+                published = True
+            finally:
+                if confirms and not published:
+                    confirms.reset()
+            if confirms:
+                self._wait_for_confirms('reply', confirms)
+
+    def handle_request_event(self, event, view=None, viewset=None, relationship_viewset=None):
+        """
+        Method to handle routing request event to appropriate view by constructing
+        a request object based on the parameters of the event.
+
+        Requests are skipped when their deadline has passed, or when less than EVENTS_REQUEST_MIN_REMAINING
+        seconds are left, since their caller stopped waiting for the response. Requests without a deadline
+        expire EVENTS_RESPONSE_TIMEOUT seconds after they were emitted.
+        """
+        response = self._process_request_event(event, view=view, viewset=viewset,
+                                               relationship_viewset=relationship_viewset)
+        if response:
+            self._store_responses([response])
+
+    def handle_request_events(self, events, view=None, viewset=None, relationship_viewset=None):
+        """
+        Handle many request events for the same view or viewset, see `handle_request_event`.
+
+        All responses are stored in Redis in a single pipeline, or published to the reply queues of their requests,
+        once every event has been handled. If a view raises, the responses of the events handled before it are
+        still stored.
+        """
+        responses = []
+        try:
+            for event in events:
+                response = self._process_request_event(event, view=view, viewset=viewset,
+                                                       relationship_viewset=relationship_viewset)
+                if response:
+                    responses.append(response)
+        finally:
+            if responses:
+                self._store_responses(responses)
 
     def async_resource_request(self, resource_type, resource_id=None, user_id=None, query_string=None, method=None,
-                               data=None, related_resource=None, roles=None, priority=5):
+                               data=None, related_resource=None, roles=None, priority=None, timeout=None):
 
         roles = roles or ANONYMOUS_ROLES
+        priority = self.priority_policy.get_priority(resource_type, 'async_resource_request', priority)
 
         event = ResourceRequestEvent(
             self,
@@ -205,7 +832,8 @@ class EventClient(object):
             query_string=query_string,
             related_resource=related_resource,
             body=data,
-            priority=priority
+            priority=priority,
+            timeout=timeout
         )
 
         event.emit()
@@ -213,22 +841,28 @@ class EventClient(object):
         return event
 
     def make_service_request(self, resource_type, resource_id=None, user_id=None, query_string=None, method=None,
-                             data=None, related_resource=None):
+                             data=None, related_resource=None, priority=None, timeout=None):
 
         roles = SERVICE_ROLES
+        priority = self.priority_policy.get_priority(resource_type, 'make_service_request', priority)
         event = self.async_resource_request(resource_type, resource_id=resource_id, user_id=user_id,
                                             query_string=query_string, method=method,
-                                            data=data, related_resource=related_resource, roles=roles)
+                                            data=data, related_resource=related_resource, roles=roles,
+                                            priority=priority, timeout=timeout)
         return event.wait()
 
     def get_remote_resource_async(self, resource_type, pk=None, user_id=None, include=None, page_size=None,
-                                  related_resource=None, query_params=None, roles=None, priority=None):
+                                  related_resource=None, query_params=None, roles=None, priority=None,
+                                  timeout=None):
         """
         Function called by services to make a request to another service for a resource.
+
+        `timeout` is how many seconds to wait for the response, it defaults to EVENTS_RESPONSE_TIMEOUT.
         """
         query_string = None
         params = query_params or {}
         method = 'GET'
+        priority = self.priority_policy.get_priority(resource_type, 'get_remote_resource_async', priority)
 
         if pk and isinstance(pk, (list, set)):
             params['filter[id__in]'] = ','.join([str(_) for _ in pk])
@@ -244,27 +878,33 @@ class EventClient(object):
 
         event = self.async_resource_request(resource_type, resource_id=pk, user_id=user_id,
                                             query_string=query_string, method=method,
-                                            related_resource=related_resource, roles=roles, priority=priority)
+                                            related_resource=related_resource, roles=roles, priority=priority,
+                                            timeout=timeout)
 
         return event
 
     def get_remote_resource(self, resource_type, pk=None, user_id=None, include=None, page_size=None,
-                            related_resource=None, query_params=None, roles=None):
+                            related_resource=None, query_params=None, roles=None, priority=None,
+                            timeout=None):
 
+        priority = self.priority_policy.get_priority(resource_type, 'get_remote_resource', priority)
         event = self.get_remote_resource_async(resource_type, pk=pk, user_id=user_id, include=include,
                                                page_size=page_size, related_resource=related_resource,
-                                               query_params=query_params, roles=roles)
+                                               query_params=query_params, roles=roles, priority=priority,
+                                               timeout=timeout)
 
         wrapped_resource = event.complete()
         return wrapped_resource
 
     def get_remote_resource_data(self, resource_type, pk=None, user_id=None, include=None, page_size=None,
-                                 related_resource=None, query_params=None, roles=None):
+                                 related_resource=None, query_params=None, roles=None, priority=None,
+                                 timeout=None):
 
-        priority = 9
+        priority = self.priority_policy.get_priority(resource_type, 'get_remote_resource_data', priority)
         event = self.get_remote_resource_async(resource_type, pk=pk, user_id=user_id, include=include,
                                                page_size=page_size, related_resource=related_resource,
-                                               query_params=query_params, roles=roles, priority=priority)
+                                               query_params=query_params, roles=roles, priority=priority,
+                                               timeout=timeout)
         data = event.wait()
         return data
 
@@ -277,20 +917,43 @@ class EventClient(object):
         attachments = kwargs.get('attachments')
         files = kwargs.get('files')
 
-        if logger:
-            msg = '''MICROSERVICE_SEND_EMAIL: Upload email with UUID {}, to {}, from {},
-            with attachments {} and files {}'''
-            logger.info(msg.format(email_uuid, to, from_email, attachments, files))
+        logger.info('MICROSERVICE_SEND_EMAIL: Upload email with UUID %s, to %s, from %s, '
+                    'with attachments %s and files %s', email_uuid, to, from_email, attachments, files)
 
-        event_data = generate_email_data(email_uuid, *args, **kwargs)
+        event_data = _email.generate_email_data(email_uuid, *args, **kwargs)
 
-        if logger:
-            logger.info('MICROSERVICE_SEND_EMAIL: Sent email with UUID {} and data {}'.format(
-                email_uuid, event_data
-            ))
+        # The event data holds whole recipient lists and content keys, only render it at DEBUG.
+        logger.info('MICROSERVICE_SEND_EMAIL: Sent email with UUID %s', email_uuid)
+        logger.debug('MICROSERVICE_SEND_EMAIL: Email with UUID %s has data %s', email_uuid, event_data)
 
         self.emit_microservice_email_notification('send_email', **event_data)
 
+    def send_bulk_email(self, recipients, *args, **kwargs):
+        """
+        Send the same email to many recipients.
+
+        Bodies and attachments are uploaded once and shared by one notification per recipient, all
+        published through a single pooled connection. `recipients` is a list of email addresses or of
+        dicts with per-recipient values for `to`, `cc`, `bcc`, `reply_to`, `headers`, `user_id`,
+        `resource_type` and `resource_id`. The remaining arguments are the same as `send_email`.
+
+        Returns the task ids of the notifications, in the order of `recipients`.
+        """
+
+        email_uuid = uuid.uuid4()
+
+        logger.info('MICROSERVICE_SEND_BULK_EMAIL: Upload email with UUID %s, to %s recipients, from %s, '
+                    'with attachments %s and files %s', email_uuid, len(recipients), kwargs.get('from_email'),
+                    kwargs.get('attachments'), kwargs.get('files'))
+
+        events_data = _email.generate_bulk_email_data(email_uuid, recipients, *args, **kwargs)
+        task_ids = self.emit_microservice_email_notifications('send_email', events_data)
+
+        logger.info('MICROSERVICE_SEND_BULK_EMAIL: Sent email with UUID %s to %s recipients', email_uuid,
+                    len(task_ids))
+
+        return task_ids
+
     def emit_index_rebuild_event(self, event_name, resource_type, model, batch_size, serializer, queryset=None):
         """
         A special helper method to emit events related to index_rebuilding.
@@ -1,50 +1,176 @@
+import struct
+import time
 import ujson
 import zlib
+from importlib import import_module
+from io import BytesIO
 
-try:
-    from zc_common.jwt_auth.utils import jwt_encode_handler
-except ImportError:
-    pass
+import six
 
-from django.http import HttpRequest, QueryDict
+from django.conf import settings
+from django.utils.functional import SimpleLazyObject
 
+# Framed responses are the magic bytes, a header and the raw body. JSON responses always start with '{', so
+# both formats can be told apart. The header of version 1 frames is the status as an unsigned short, version 2
+# frames add the times the responder received, started and finished handling the request.
+RESPONSE_FORMAT_FRAMED = 'framed'
+FRAME_MAGIC_PREFIX = b'\x00zcf'
+FRAME_HEADERS = {
+    b'1': struct.Struct('>H'),
+    b'2': struct.Struct('>Hddd'),
+}
+FRAME_VERSION_OFFSET = len(FRAME_MAGIC_PREFIX)
+FRAME_HEADER_OFFSET = FRAME_VERSION_OFFSET + 1
 
-def structure_response(status, data):
+RESPONSE_TIMINGS = ('received_at', 'started_at', 'finished_at')
+
+JWT_CACHE_TTL = 300
+JWT_CACHE_SIZE = 1000
+
+# {(roles, user_id): (token, expires_at)} of the tokens signed for internal requests by this process.
+_jwt_cache = {}
+
+
+def structure_response(status, data, timings=None):
     """
     Compress a JSON object with zlib for inserting into redis.
+
+    `timings` optionally holds the `received_at`, `started_at` and `finished_at` timestamps of the responder.
     """
-    return zlib.compress(ujson.dumps({
+    response = {
         'status': status,
         'body': data
-    }))
+    }
+    if timings:
+        response['timings'] = timings
+    return zlib.compress(ujson.dumps(response))
+
+
+def structure_framed_response(status, data, timings=None):
+    """
+    Compress a response for inserting into redis without wrapping the already encoded body in JSON.
+    """
+    if isinstance(data, six.text_type):
+        data = data.encode('utf-8')
+
+    if timings:
+        header = b'2' + FRAME_HEADERS[b'2'].pack(status, *[timings[timing] for timing in RESPONSE_TIMINGS])
+    else:
+        header = b'1' + FRAME_HEADERS[b'1'].pack(status)
+
+    return zlib.compress(FRAME_MAGIC_PREFIX + header + (data or b''))
+
+
+def parse_response(response):
+    """
+    Decompress a response read from redis, in either the JSON or the framed format, into a dict with
+    the status, body and, when the responder sent them, timings.
+    """
+    response = zlib.decompress(response)
+    if not response.startswith(FRAME_MAGIC_PREFIX):
+        return ujson.loads(response)
+
+    header = FRAME_HEADERS[response[FRAME_VERSION_OFFSET:FRAME_HEADER_OFFSET]]
+    values = header.unpack_from(response, FRAME_HEADER_OFFSET)
+
+    parsed = {
+        'status': values[0],
+        'body': response[FRAME_HEADER_OFFSET + header.size:]
+    }
+    if len(values) > 1:
+        parsed['timings'] = dict(zip(RESPONSE_TIMINGS, values[1:]))
+    return parsed
+
+
+def clear_jwt_cache():
+    _jwt_cache.clear()
+
+
+# zc_common pulls in Django REST framework and the JWT libraries, only import them once a request is handled.
+http = SimpleLazyObject(lambda: import_module('django.http'))
+_jwt_utils = SimpleLazyObject(lambda: import_module('zc_common.jwt_auth.utils'))
+_jwt_authentication = SimpleLazyObject(lambda: import_module('zc_common.jwt_auth.authentication'))
 
 
-def create_django_request_object(roles, query_string, method, user_id=None, body=None, http_host=None):
+def jwt_encode_handler(payload):
+    return _jwt_utils.jwt_encode_handler(payload)
+
+
+def _get_jwt_payload(roles, user_id=None):
+    jwt_payload = {'roles': roles}
+    if user_id:
+        jwt_payload['id'] = user_id
+    return jwt_payload
+
+
+def get_internal_jwt(roles, user_id=None):
+    """
+    Return a signed JWT for an internal request. Tokens are cached per roles and user for EVENTS_JWT_CACHE_TTL
+    seconds, since signing them is one of the most expensive parts of handling a request event.
+    """
+    ttl = getattr(settings, 'EVENTS_JWT_CACHE_TTL', JWT_CACHE_TTL)
+    if not ttl:
+        return jwt_encode_handler(_get_jwt_payload(roles, user_id))
+
+    key = (tuple(roles or ()), user_id)
+    now = time.time()
+
+    cached = _jwt_cache.get(key)
+    if cached and cached[1] > now:
+        return cached[0]
+
+    token = jwt_encode_handler(_get_jwt_payload(roles, user_id))
+
+    if len(_jwt_cache) >= JWT_CACHE_SIZE:
+        _jwt_cache.clear()
+    _jwt_cache[key] = (token, now + ttl)
+
+    return token
+
+
+def _encode_body(body):
+    if isinstance(body, six.binary_type):
+        return body
+    if isinstance(body, six.text_type):
+        return body.encode('utf-8')
+    return ujson.dumps(body)
+
+
+def create_django_request_object(roles, query_string, method, user_id=None, body=None, http_host=None,
+                                 trusted=None):
     """
     Create a Django HTTPRequest object with the appropriate attributes pulled
     from the event.
+
+    The body is passed through as is when it is already a string. Trusted requests, enabled with the
+    EVENTS_TRUSTED_INTERNAL_REQUESTS setting, skip the JWT altogether: the user it would carry is
+    handed to Django REST framework's authentication directly.
     """
     if not http_host:
         http_host = 'local.zerocater.com'
 
-    jwt_payload = {'roles': roles}
-    if user_id:
-        jwt_payload['id'] = user_id
+    if trusted is None:
+        trusted = getattr(settings, 'EVENTS_TRUSTED_INTERNAL_REQUESTS', False)
 
-    request = HttpRequest()
-    request.GET = QueryDict(query_string)
+    request = http.HttpRequest()
+    request.GET = http.QueryDict(query_string)
 
-    if body:
-        request.read = lambda: ujson.dumps(body)
+    body = _encode_body(body) if body else b''
+    request._stream = BytesIO(body)
+    request._read_started = False
 
     request.encoding = 'utf-8'
     request.method = method.upper()
     request.META = {
-        'HTTP_AUTHORIZATION': 'JWT {}'.format(jwt_encode_handler(jwt_payload)),
         'QUERY_STRING': query_string,
         'HTTP_HOST': http_host,
         'CONTENT_TYPE': 'application/vnd.api+json',
-        'CONTENT_LENGTH': '99999',
+        'CONTENT_LENGTH': str(len(body)),
     }
 
+    if trusted:
+        request._force_auth_user = _jwt_authentication.User(**_get_jwt_payload(roles, user_id))
+    else:
+        request.META['HTTP_AUTHORIZATION'] = 'JWT {}'.format(get_internal_jwt(roles, user_id))
+
     return request
@@ -1,10 +1,20 @@
+import hashlib
 import six
+import uuid
 from datetime import date
 import time
 
-from zc_events.aws import save_string_contents_to_s3, save_file_contents_to_s3
+from django.conf import settings
+
+from zc_events.aws import save_string_contents_to_s3, save_file_contents_to_s3, s3_key_exists
 
 S3_BUCKET_NAME = 'zc-mp-email'
+CONTENT_ADDRESSED_FOLDER_NAME = 'sha256'
+CONTENT_DIGEST_CACHE_SIZE = 10000
+FILE_DIGEST_CHUNK_SIZE = 1024 * 1024
+
+# Keys of content-addressed objects this process has already uploaded or seen on S3.
+_uploaded_content_keys = set()
 
 
 def generate_s3_folder_name(email_uuid):
@@ -20,16 +30,71 @@ def generate_s3_content_key(s3_folder_name, content_type, content_name=''):
     return content_key
 
 
-def generate_email_data(email_uuid, from_email=None, to=None, cc=None, bcc=None, reply_to=None, subject=None,
-                        plaintext_body=None, html_body=None, headers=None, files=None, attachments=None,
-                        user_id=None, resource_type=None, resource_id=None, unsubscribe_group=None, **kwargs):
+def clear_content_digest_cache():
+    _uploaded_content_keys.clear()
+
+
+def generate_content_digest(content):
+    if isinstance(content, six.text_type):
+        content = content.encode('utf-8')
+    return hashlib.sha256(content or b'').hexdigest()
+
+
+def generate_file_digest(filepath):
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(FILE_DIGEST_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def generate_content_addressed_key(digest, content_type, content_name=''):
+    s3_folder_name = "{}/{}".format(CONTENT_ADDRESSED_FOLDER_NAME, digest)
+    return generate_s3_content_key(s3_folder_name, content_type, content_name=content_name)
+
+
+def _save_content_addressed(content_key, save):
     """
-    files:       A list of file paths
-    attachments: A list of tuples of the format (filename, content_type, content)
+    Call `save` only if `content_key` was not uploaded before, checking the local cache then S3.
     """
+    if content_key in _uploaded_content_keys:
+        return content_key
+
+    if not s3_key_exists(S3_BUCKET_NAME, content_key):
+        save()
+
+    if len(_uploaded_content_keys) >= CONTENT_DIGEST_CACHE_SIZE:
+        _uploaded_content_keys.clear()
+    _uploaded_content_keys.add(content_key)
+
+    return content_key
+
+
+def save_email_string_content(s3_folder_name, content, content_type, content_name='', content_addressed=False):
+    if content_addressed:
+        content_key = generate_content_addressed_key(generate_content_digest(content), content_type,
+                                                     content_name=content_name)
+        return _save_content_addressed(
+            content_key, lambda: save_string_contents_to_s3(content, S3_BUCKET_NAME, content_key))
+
+    content_key = generate_s3_content_key(s3_folder_name, content_type, content_name=content_name)
+    save_string_contents_to_s3(content, S3_BUCKET_NAME, content_key)
+    return content_key
 
-    s3_folder_name = generate_s3_folder_name(email_uuid)
 
+def save_email_file_content(s3_folder_name, filepath, content_type, content_name='', content_addressed=False):
+    if content_addressed:
+        content_key = generate_content_addressed_key(generate_file_digest(filepath), content_type,
+                                                     content_name=content_name)
+        return _save_content_addressed(
+            content_key, lambda: save_file_contents_to_s3(filepath, S3_BUCKET_NAME, content_key))
+
+    content_key = generate_s3_content_key(s3_folder_name, content_type, content_name=content_name)
+    save_file_contents_to_s3(filepath, S3_BUCKET_NAME, content_key)
+    return content_key
+
+
+def _normalize_recipients(to=None, cc=None, bcc=None, reply_to=None):
     to = to.split(',') if isinstance(to, six.string_types) else to
     cc = cc.split(',') if isinstance(cc, six.string_types) else cc
     bcc = bcc.split(',') if isinstance(bcc, six.string_types) else bcc
@@ -43,31 +108,66 @@ def generate_email_data(email_uuid, from_email=None, to=None, cc=None, bcc=None,
         msg = "Keyword arguments 'to', 'cc', 'bcc', and 'reply_to' can't all be empty"
         raise TypeError(msg)
 
+    return to, cc, bcc, reply_to
+
+
+def upload_email_content(s3_folder_name, plaintext_body=None, html_body=None, files=None, attachments=None,
+                         content_addressed=False):
+    """
+    Upload the bodies and attachments of an email to S3 and return their keys.
+    """
     html_body_key = None
     if html_body:
-        html_body_key = generate_s3_content_key(s3_folder_name, 'html')
-        save_string_contents_to_s3(html_body, S3_BUCKET_NAME, html_body_key)
+        html_body_key = save_email_string_content(s3_folder_name, html_body, 'html',
+                                                  content_addressed=content_addressed)
 
     plaintext_body_key = None
     if plaintext_body:
-        plaintext_body_key = generate_s3_content_key(s3_folder_name, 'plaintext')
-        save_string_contents_to_s3(plaintext_body, S3_BUCKET_NAME, plaintext_body_key)
+        plaintext_body_key = save_email_string_content(s3_folder_name, plaintext_body, 'plaintext',
+                                                       content_addressed=content_addressed)
 
     attachments_keys = []
     if attachments:
         for filename, mimetype, attachment in attachments:
-            attachment_key = generate_s3_content_key(s3_folder_name, 'attachment',
-                                                     content_name=filename)
-            save_string_contents_to_s3(attachment, S3_BUCKET_NAME, attachment_key)
+            attachment_key = save_email_string_content(s3_folder_name, attachment, 'attachment',
+                                                       content_name=filename, content_addressed=content_addressed)
             attachments_keys.append(attachment_key)
     if files:
         for filepath in files:
             filename = filepath.split('/')[-1]
-            attachment_key = generate_s3_content_key(s3_folder_name, 'attachment',
-                                                     content_name=filename)
-            save_file_contents_to_s3(filepath, S3_BUCKET_NAME, attachment_key)
+            attachment_key = save_email_file_content(s3_folder_name, filepath, 'attachment',
+                                                     content_name=filename, content_addressed=content_addressed)
             attachments_keys.append(attachment_key)
 
+    return {
+        'plaintext_body_key': plaintext_body_key,
+        'html_body_key': html_body_key,
+        'attachments_keys': attachments_keys,
+    }
+
+
+def generate_email_data(email_uuid, from_email=None, to=None, cc=None, bcc=None, reply_to=None, subject=None,
+                        plaintext_body=None, html_body=None, headers=None, files=None, attachments=None,
+                        user_id=None, resource_type=None, resource_id=None, unsubscribe_group=None,
+                        content_addressed=None, **kwargs):
+    """
+    files:             A list of file paths
+    attachments:       A list of tuples of the format (filename, content_type, content)
+    content_addressed: Store bodies and attachments under a digest of their content, so identical
+                       content is uploaded once and shared between emails. Defaults to the
+                       EMAIL_CONTENT_ADDRESSED_STORAGE setting.
+    """
+
+    if content_addressed is None:
+        content_addressed = getattr(settings, 'EMAIL_CONTENT_ADDRESSED_STORAGE', False)
+
+    s3_folder_name = generate_s3_folder_name(email_uuid)
+
+    to, cc, bcc, reply_to = _normalize_recipients(to, cc, bcc, reply_to)
+
+    content_keys = upload_email_content(s3_folder_name, plaintext_body=plaintext_body, html_body=html_body,
+                                        files=files, attachments=attachments, content_addressed=content_addressed)
+
     event_data = {
         'from_email': from_email,
         'to': to,
@@ -75,17 +175,72 @@ def generate_email_data(email_uuid, from_email=None, to=None, cc=None, bcc=None,
         'bcc': bcc,
         'reply_to': reply_to,
         'subject': subject,
-        'plaintext_body_key': plaintext_body_key,
-        'html_body_key': html_body_key,
-        'attachments_keys': attachments_keys,
         'headers': headers,
         'user_id': user_id,
         'resource_type': resource_type,
         'resource_id': resource_id,
         'task_id': str(email_uuid)
     }
+    event_data.update(content_keys)
 
     if unsubscribe_group:
         event_data['unsubscribe_group'] = unsubscribe_group
 
     return event_data
+
+
+def generate_bulk_email_data(email_uuid, recipients, from_email=None, subject=None, plaintext_body=None,
+                             html_body=None, headers=None, files=None, attachments=None, resource_type=None,
+                             unsubscribe_group=None, content_addressed=None, **kwargs):
+    """
+    recipients: A list of email addresses, or of dicts with per-recipient values for
+                'to', 'cc', 'bcc', 'reply_to', 'headers', 'user_id', 'resource_type' and 'resource_id'
+
+    Bodies and attachments are uploaded once and every recipient's event data refers to the same keys.
+    See `generate_email_data` for the other arguments.
+    """
+
+    if content_addressed is None:
+        content_addressed = getattr(settings, 'EMAIL_CONTENT_ADDRESSED_STORAGE', False)
+
+    if not recipients:
+        raise TypeError("Argument 'recipients' can't be empty")
+
+    recipients_data = []
+    for recipient in recipients:
+        if not isinstance(recipient, dict):
+            recipient = {'to': recipient}
+
+        to, cc, bcc, reply_to = _normalize_recipients(recipient.get('to'), recipient.get('cc'),
+                                                      recipient.get('bcc'), recipient.get('reply_to'))
+        recipients_data.append({
+            'to': to,
+            'cc': cc,
+            'bcc': bcc,
+            'reply_to': reply_to,
+            'headers': recipient.get('headers', headers),
+            'user_id': recipient.get('user_id'),
+            'resource_type': recipient.get('resource_type', resource_type),
+            'resource_id': recipient.get('resource_id'),
+        })
+
+    s3_folder_name = generate_s3_folder_name(email_uuid)
+    content_keys = upload_email_content(s3_folder_name, plaintext_body=plaintext_body, html_body=html_body,
+                                        files=files, attachments=attachments, content_addressed=content_addressed)
+
+    events_data = []
+    for recipient_data in recipients_data:
+        event_data = {
+            'from_email': from_email,
+            'subject': subject,
+            'task_id': str(uuid.uuid4())
+        }
+        event_data.update(recipient_data)
+        event_data.update(content_keys)
+
+        if unsubscribe_group:
+            event_data['unsubscribe_group'] = unsubscribe_group
+
+        events_data.append(event_data)
+
+    return events_data
@@ -1,8 +1,9 @@
 import logging
+import math
+import time
 import uuid
-import zlib
-import ujson
 
+from zc_events.django_request import RESPONSE_FORMAT_FRAMED, parse_response
 from zc_events.exceptions import RequestTimeout, ServiceRequestException
 from zc_events.request import wrap_resource_from_response
 
@@ -34,29 +35,130 @@ class Event(object):
 
 
 class RequestEvent(Event):
+    """
+    An event expecting a response from the service handling it.
+
+    The response is waited for up to `timeout` seconds, which defaults to the client's response timeout.
+    The absolute deadline is sent along with the request, so the responder can skip requests nobody is
+    waiting for anymore.
+
+    Once the response arrived, `latency_breakdown` holds how many seconds the request spent waiting in the
+    queue, being prepared and served by the responder, and coming back through Redis or the reply queue. These
+    compare clocks of different hosts, so they are only as accurate as their synchronisation.
+    """
 
     def __init__(self, *args, **kwargs):
         self.response_key = 'request-{}'.format(uuid.uuid4())
         if kwargs.get('response_key'):
             raise AttributeError("kwargs should not include reserved key 'response_key'")
+        if kwargs.get('deadline'):
+            raise AttributeError("kwargs should not include reserved key 'deadline'")
+        if kwargs.get('reply_to'):
+            raise AttributeError("kwargs should not include reserved key 'reply_to'")
 
         kwargs['response_key'] = self.response_key
+        kwargs['response_format'] = RESPONSE_FORMAT_FRAMED
+        self.timeout = kwargs.pop('timeout', None)
 
         super(RequestEvent, self).__init__(*args, **kwargs)
 
+        self.timeout = self.timeout or self.event_client.response_timeout
+        self.latency_breakdown = None
+
+        reply_to = self.event_client.get_reply_to()
+        if reply_to:
+            self.kwargs['reply_to'] = reply_to
+
+    @property
+    def deadline(self):
+        return self.kwargs.get('deadline')
+
+    def emit(self):
+        # A promoted request keeps the time it was first emitted at, so its latency covers the whole wait.
+        emitted_at = self.kwargs.setdefault('emitted_at', time.time())
+
+        # The priority itself is consumed by the broker, these let the responder measure queueing per priority.
+        self.kwargs['request_priority'] = self.kwargs.get('priority')
+        if not self.deadline:
+            self.kwargs['deadline'] = emitted_at + self.timeout
+
+        # Requests that may be promoted are numbered, so the responder only handles the first copy to arrive.
+        if 'attempt' not in self.kwargs and self.event_client.priority_policy.get_promotion_delay(
+                self.timeout, method=self.kwargs.get('method'), priority=self.kwargs.get('priority')):
+            self.kwargs['attempt'] = 1
+
+        return super(RequestEvent, self).emit()
+
+    def promote(self):
+        """
+        Republish the request with a higher priority. The original is still queued, whichever copy reaches a
+        responder first is handled and the other one is skipped.
+        """
+        policy = self.event_client.priority_policy
+        self.kwargs['priority'] = policy.promote(self.kwargs.get('priority'))
+        self.kwargs['attempt'] = self.kwargs.get('attempt', 1) + 1
+
+        return self.emit()
+
+    def _wait_for_response(self):
+        # A request that was never emitted has no deadline, it is waited for up to its timeout like before.
+        deadline = self.deadline or time.time() + self.timeout
+        # A BLPOP timeout of 0 blocks forever, never wait for less than a second.
+        timeout = int(math.ceil(deadline - time.time()))
+        if timeout < 1:
+            return None
+
+        promotion_delay = self.event_client.priority_policy.get_promotion_delay(
+            timeout, method=self.kwargs.get('method'), priority=self.kwargs.get('priority'))
+
+        # Only requests numbered when they were emitted, the responder would handle an unnumbered original too.
+        if promotion_delay and self.kwargs.get('attempt'):
+            result = self.event_client.wait_for_response(self.response_key, promotion_delay)
+            if result:
+                return result
+
+            self.promote()
+            timeout -= promotion_delay
+
+        return self.event_client.wait_for_response(self.response_key, timeout)
+
     def wait(self):
         if self._wait:
             return self._reponse
 
-        result = self.event_client.wait_for_response(self.response_key)
+        result = self._wait_for_response()
+        received_at = time.time()
         if not result:
             raise RequestTimeout
 
-        self._response = ujson.loads(zlib.decompress(result[1]))
+        with self.event_client.metrics.timer('request_event.parse'):
+            self._response = parse_response(result[1])
         self._wait = True
 
+        self._record_latency_breakdown(received_at)
+
         return self._response
 
+    def _record_latency_breakdown(self, received_at):
+        timings = self._response.get('timings')
+        emitted_at = self.kwargs.get('emitted_at')
+        if not timings or not emitted_at:
+            return
+
+        self.latency_breakdown = {
+            'queue': timings['received_at'] - emitted_at,
+            'prepare': timings['started_at'] - timings['received_at'],
+            'service': timings['finished_at'] - timings['started_at'],
+            'return': received_at - timings['finished_at'],
+            'total': received_at - emitted_at,
+        }
+
+        metrics = self.event_client.metrics
+        if metrics.enabled:
+            for name, seconds in self.latency_breakdown.items():
+                metrics.timing('request_event.latency.{}'.format(name), seconds,
+                               tags={'event_type': self.event_type})
+
     def complete(self):
         if not self._wait:
             self._response = self.wait()
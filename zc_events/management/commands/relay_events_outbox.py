@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from zc_events.client import EventClient
+
+
+class Command(BaseCommand):
+    help = 'Publish the events in the outbox of EVENTS_OUTBOX to the broker, until interrupted.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, help='Number of events published per batch.')
+        parser.add_argument('--interval', type=float, help='Seconds to wait for new events when the outbox is empty.')
+
+    def handle(self, *args, **options):
+        if not getattr(settings, 'EVENTS_OUTBOX', None):
+            raise CommandError('EVENTS_OUTBOX is not set.')
+
+        relay_options = {key: options[key] for key in ('batch_size', 'interval') if options.get(key) is not None}
+        relay = EventClient().create_outbox_relay(**relay_options)
+
+        self.stdout.write('Relaying events from {}'.format(type(relay.outbox).__name__))
+        try:
+            relay.run()
+        except KeyboardInterrupt:
+            pass
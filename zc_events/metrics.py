@@ -0,0 +1,207 @@
+import re
+import socket
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+
+def _metric_key(name, tags):
+    return name, tuple(sorted((tags or {}).items()))
+
+
+class Timer(object):
+    """Context manager reporting the time spent in its block, in seconds, to a metrics backend."""
+
+    def __init__(self, metrics, name, tags=None):
+        self.metrics = metrics
+        self.name = name
+        self.tags = tags
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.metrics.timing(self.name, time.time() - self.start, tags=self.tags)
+
+
+class NullTimer(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        pass
+
+
+_null_timer = NullTimer()
+
+
+class NullMetrics(object):
+    """
+    Metrics backend that drops everything. Used when no EVENTS_METRICS_BACKEND is configured.
+
+    Backends implement `incr` and `timing`. Call sites that would have to do extra work to report a metric
+    should check `enabled` first.
+    """
+
+    enabled = False
+
+    def incr(self, name, value=1, tags=None):
+        pass
+
+    def timing(self, name, seconds, tags=None):
+        pass
+
+    def timer(self, name, tags=None):
+        return _null_timer
+
+
+class Metrics(NullMetrics):
+    """Base class for backends actually reporting metrics."""
+
+    enabled = True
+
+    def incr(self, name, value=1, tags=None):
+        raise NotImplementedError
+
+    def timing(self, name, seconds, tags=None):
+        raise NotImplementedError
+
+    def timer(self, name, tags=None):
+        return Timer(self, name, tags=tags)
+
+
+class InMemoryMetrics(Metrics):
+    """Metrics backend keeping counters and timings in process memory, mostly useful in tests."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = defaultdict(int)
+        self.timings = defaultdict(list)
+
+    def incr(self, name, value=1, tags=None):
+        key = _metric_key(name, tags)
+        with self._lock:
+            self.counters[key] += value
+
+    def timing(self, name, seconds, tags=None):
+        key = _metric_key(name, tags)
+        with self._lock:
+            self.timings[key].append(seconds)
+
+    def get_counter(self, name, tags=None):
+        return self.counters.get(_metric_key(name, tags), 0)
+
+    def get_timings(self, name, tags=None):
+        return self.timings.get(_metric_key(name, tags), [])
+
+    def reset(self):
+        with self._lock:
+            self.counters = defaultdict(int)
+            self.timings = defaultdict(list)
+
+
+class StatsDMetrics(Metrics):
+    """
+    Metrics backend sending metrics over UDP to a StatsD agent, with tags in the DogStatsD format.
+
+    Configured with the EVENTS_STATSD_HOST, EVENTS_STATSD_PORT and EVENTS_STATSD_PREFIX settings.
+    """
+
+    def __init__(self, host=None, port=None, prefix=None):
+        self.address = (host or getattr(settings, 'EVENTS_STATSD_HOST', 'localhost'),
+                        port or getattr(settings, 'EVENTS_STATSD_PORT', 8125))
+        prefix = prefix if prefix is not None else getattr(settings, 'EVENTS_STATSD_PREFIX', 'zc_events')
+        self.prefix = '{}.'.format(prefix) if prefix else ''
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def _send(self, name, value, metric_type, tags):
+        data = '{}{}:{}|{}'.format(self.prefix, name, value, metric_type)
+        if tags:
+            data += '|#' + ','.join('{}:{}'.format(key, tags[key]) for key in sorted(tags))
+        try:
+            self.socket.sendto(data.encode('utf-8'), self.address)
+        except socket.error:
+            # Metrics must never take the service down.
+            pass
+
+    def incr(self, name, value=1, tags=None):
+        self._send(name, value, 'c', tags)
+
+    def timing(self, name, seconds, tags=None):
+        self._send(name, int(round(seconds * 1000)), 'ms', tags)
+
+
+class PrometheusMetrics(Metrics):
+    """
+    Metrics backend recording counters and histograms with `prometheus_client`, for the service to expose.
+
+    Metric names have dots replaced by underscores, and the tags of a metric become its labels, so a given
+    metric must always be reported with the same tag names.
+    """
+
+    def __init__(self, registry=None, namespace='zc_events'):
+        try:
+            import prometheus_client
+        except ImportError:
+            raise ImproperlyConfigured('PrometheusMetrics requires the prometheus_client package')
+
+        self.prometheus_client = prometheus_client
+        self.registry = registry or prometheus_client.REGISTRY
+        self.namespace = namespace
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def _get_metric(self, metric_class, name, tags):
+        key = (metric_class, name)
+        metric = self._metrics.get(key)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.get(key)
+                if metric is None:
+                    metric = metric_class(re.sub(r'\W', '_', name), name, sorted(tags or ()),
+                                          namespace=self.namespace, registry=self.registry)
+                    self._metrics[key] = metric
+
+        if tags:
+            return metric.labels(**{key: str(value) for key, value in tags.items()})
+        return metric
+
+    def incr(self, name, value=1, tags=None):
+        self._get_metric(self.prometheus_client.Counter, name, tags).inc(value)
+
+    def timing(self, name, seconds, tags=None):
+        self._get_metric(self.prometheus_client.Histogram, name, tags).observe(seconds)
+
+
+def get_metrics_backend():
+    """Instantiate the backend named by the EVENTS_METRICS_BACKEND setting, a dotted path to a class."""
+    backend_path = getattr(settings, 'EVENTS_METRICS_BACKEND', None)
+    if not backend_path:
+        return NullMetrics()
+    return import_string(backend_path)()
+
+
+def get_metrics():
+    """Return the metrics backend shared by the whole process."""
+    global _metrics
+
+    if _metrics is None:
+        with _metrics_lock:
+            if _metrics is None:
+                _metrics = get_metrics_backend()
+    return _metrics
+
+
+def set_metrics(metrics):
+    """Replace the metrics backend shared by the whole process, None resets it to the configured one."""
+    global _metrics
+    _metrics = metrics
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9 on 2026-10-19 09:01
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('exchange', models.CharField(max_length=255)),
+                ('routing_key', models.CharField(blank=True, max_length=255)),
+                ('body', models.TextField()),
+                ('priority', models.PositiveSmallIntegerField(default=0)),
+                ('created_at', models.FloatField()),
+                ('claimed_by', models.CharField(db_index=True, max_length=64, null=True)),
+                ('claimed_at', models.FloatField(null=True)),
+            ],
+            options={
+                'ordering': ('id',),
+            },
+        ),
+    ]
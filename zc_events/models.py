@@ -0,0 +1,19 @@
+from django.db import models
+
+
+class OutboxEntry(models.Model):
+    """
+    An event waiting in the outbox table to be published, see `zc_events.outbox.DatabaseOutbox`. Only installed
+    with 'zc_events' in INSTALLED_APPS.
+    """
+
+    exchange = models.CharField(max_length=255)
+    routing_key = models.CharField(max_length=255, blank=True)
+    body = models.TextField()
+    priority = models.PositiveSmallIntegerField(default=0)
+    created_at = models.FloatField()
+    claimed_by = models.CharField(max_length=64, null=True, db_index=True)
+    claimed_at = models.FloatField(null=True)
+
+    class Meta:
+        ordering = ('id',)
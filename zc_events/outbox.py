@@ -0,0 +1,271 @@
+import logging
+import os
+import threading
+import time
+import ujson
+import uuid
+from collections import namedtuple
+
+logger = logging.getLogger('django')
+
+OutboxEvent = namedtuple('OutboxEvent', ['id', 'exchange', 'routing_key', 'message', 'priority'])
+
+OUTBOX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox_event (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    exchange TEXT NOT NULL,
+    routing_key TEXT NOT NULL,
+    body TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    claimed_by TEXT,
+    claimed_at REAL
+)
+"""
+
+
+class SQLiteOutbox(object):
+    """
+    Local journal of events waiting to be published to the broker, kept in a SQLite database at `path`.
+
+    The journal runs in WAL mode with `synchronous` NORMAL by default: appending is a sequential write to the log,
+    and SQLite fsyncs it once per checkpoint instead of on every commit. Events survive the process crashing, and
+    use 'FULL' to also keep them when the machine loses power.
+
+    Several processes can share the journal. A relay claims the events it publishes, and events claimed by a
+    relay that died are claimed again after `claim_timeout` seconds.
+    """
+
+    transactional = False
+
+    def __init__(self, path, synchronous='NORMAL', claim_timeout=60):
+        self.path = path
+        self.synchronous = synchronous
+        self.claim_timeout = claim_timeout
+        self._connection = None
+        self._pid = None
+        self._claim_id = None
+        self._lock = threading.Lock()
+
+    def reset_locks_after_fork(self):
+        """Replace the lock in a forked child, where a lock held by another thread of the parent stays locked."""
+        self._lock = threading.Lock()
+
+    def _get_connection(self):
+        # Called with self._lock held. sqlite3 connections must not be used across a fork.
+        if self._pid != os.getpid():
+            import sqlite3
+
+            self._connection = sqlite3.connect(self.path, timeout=30, isolation_level=None,
+                                               check_same_thread=False)
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('PRAGMA synchronous={}'.format(self.synchronous))
+            self._connection.execute(OUTBOX_SCHEMA)
+            self._pid = os.getpid()
+            self._claim_id = '{}:{}'.format(self._pid, uuid.uuid4().hex)
+        return self._connection
+
+    def append(self, events):
+        """Journal `events`, a list of (exchange, routing key, message, priority), in one transaction."""
+        now = time.time()
+        rows = [(exchange, routing_key, ujson.dumps(message), priority, now)
+                for exchange, routing_key, message, priority in events]
+
+        with self._lock:
+            connection = self._get_connection()
+            connection.execute('BEGIN')
+            try:
+                connection.executemany(
+                    'INSERT INTO outbox_event (exchange, routing_key, body, priority, created_at) '
+                    'VALUES (?, ?, ?, ?, ?)', rows)
+            except Exception:
+                connection.execute('ROLLBACK')
+                raise
+            connection.execute('COMMIT')
+
+    def claim(self, limit):
+        """Claim up to `limit` unpublished events for this process, oldest first."""
+        now = time.time()
+
+        with self._lock:
+            connection = self._get_connection()
+            # IMMEDIATE takes the write lock up front, so two relays never claim the same events.
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                connection.execute(
+                    'UPDATE outbox_event SET claimed_by = ?, claimed_at = ? WHERE id IN ('
+                    'SELECT id FROM outbox_event WHERE claimed_by IS NULL OR claimed_at < ? ORDER BY id LIMIT ?)',
+                    (self._claim_id, now, now - self.claim_timeout, limit))
+                rows = connection.execute(
+                    'SELECT id, exchange, routing_key, body, priority FROM outbox_event '
+                    'WHERE claimed_by = ? ORDER BY id', (self._claim_id,)).fetchall()
+            except Exception:
+                connection.execute('ROLLBACK')
+                raise
+            connection.execute('COMMIT')
+
+        return [OutboxEvent(event_id, exchange, routing_key, ujson.loads(body), priority)
+                for event_id, exchange, routing_key, body, priority in rows]
+
+    def delete(self, event_ids):
+        """Remove published events from the journal."""
+        self._execute_for_ids('DELETE FROM outbox_event WHERE id IN ({})', event_ids)
+
+    def release(self, event_ids):
+        """Give up the claim on events that could not be published, so they are retried."""
+        self._execute_for_ids('UPDATE outbox_event SET claimed_by = NULL, claimed_at = NULL WHERE id IN ({})',
+                              event_ids)
+
+    def _execute_for_ids(self, query, event_ids):
+        if not event_ids:
+            return
+        with self._lock:
+            connection = self._get_connection()
+            connection.execute(query.format(', '.join('?' * len(event_ids))), list(event_ids))
+
+    def count(self):
+        with self._lock:
+            connection = self._get_connection()
+            return connection.execute('SELECT COUNT(*) FROM outbox_event').fetchone()[0]
+
+
+class OutboxRelay(object):
+    """
+    Background thread draining an outbox to the broker.
+
+    `publish` is called with batches of up to `batch_size` `OutboxEvent`s, oldest first, and raises if they may
+    not have been delivered. Delivered events are deleted from the outbox. Failed batches are released and retried
+    after `interval` seconds, so events are published at least once. When the outbox is empty, the relay waits
+    `interval` seconds or until it is woken up by `wake()`.
+    """
+
+    def __init__(self, outbox, publish, batch_size=100, interval=1.0):
+        self.outbox = outbox
+        self.publish = publish
+        self.batch_size = batch_size
+        self.interval = interval
+        self.pid = os.getpid()
+        self._wake_up = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name='zc-events-outbox-relay')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stopped.set()
+        self._wake_up.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def wake(self):
+        self._wake_up.set()
+
+    def relay_once(self):
+        """Publish one batch of events. Returns the number of events published."""
+        events = self.outbox.claim(self.batch_size)
+        if not events:
+            return 0
+
+        event_ids = [event.id for event in events]
+        try:
+            self.publish(events)
+        except Exception:
+            self.outbox.release(event_ids)
+            raise
+
+        self.outbox.delete(event_ids)
+        return len(events)
+
+    def run(self):
+        while not self._stopped.is_set():
+            # Cleared before claiming, so events appended meanwhile wake the relay straight away.
+            self._wake_up.clear()
+            try:
+                published = self.relay_once()
+            except Exception:
+                logger.exception('EVENT_OUTBOX::RELAY_FAILURE: Could not publish events, retrying in %ss',
+                                 self.interval)
+                self._stopped.wait(self.interval)
+                continue
+
+            if not published:
+                self._wake_up.wait(self.interval)
+
+
+class DatabaseOutbox(object):
+    """
+    Outbox table in the service's own database, `zc_events.models.OutboxEntry`, which needs 'zc_events' in
+    INSTALLED_APPS and its migrations applied.
+
+    Events are written in the transaction they are emitted in, so they are published if and only if it commits.
+    Relays claim rows like `SQLiteOutbox` does, and any number of them, in the service processes or in a dedicated
+    one running `manage.py relay_events_outbox`, can drain the table.
+    """
+
+    # Written in the current transaction, so EVENTS_ON_COMMIT doesn't need to hold the events back.
+    transactional = True
+
+    def __init__(self, using='default', claim_timeout=60):
+        self.using = using
+        self.claim_timeout = claim_timeout
+        self._pid = None
+        self._claim_id = None
+
+    @property
+    def claim_id(self):
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._claim_id = '{}:{}'.format(self._pid, uuid.uuid4().hex)
+        return self._claim_id
+
+    def _get_queryset(self):
+        from zc_events.models import OutboxEntry
+
+        return OutboxEntry.objects.using(self.using)
+
+    def append(self, events):
+        """Write `events`, a list of (exchange, routing key, message, priority), in one INSERT."""
+        from zc_events.models import OutboxEntry
+
+        now = time.time()
+        self._get_queryset().bulk_create([
+            OutboxEntry(exchange=exchange, routing_key=routing_key, body=ujson.dumps(message), priority=priority,
+                        created_at=now)
+            for exchange, routing_key, message, priority in events
+        ])
+
+    def claim(self, limit):
+        """Claim up to `limit` unpublished events for this process, in id order."""
+        from django.db import connections, transaction
+        from django.db.models import Q
+
+        # The relay thread holds on to its connection, which the database may have closed in the meantime.
+        connections[self.using].close_if_unusable_or_obsolete()
+
+        now = time.time()
+        claimable = Q(claimed_by__isnull=True) | Q(claimed_at__lt=now - self.claim_timeout)
+        queryset = self._get_queryset()
+
+        with transaction.atomic(using=self.using):
+            event_ids = list(queryset.filter(claimable).order_by('id').values_list('id', flat=True)[:limit])
+            # Filtering on claimable again skips rows another relay claimed in the meantime.
+            queryset.filter(claimable, id__in=event_ids).update(claimed_by=self.claim_id, claimed_at=now)
+
+        rows = queryset.filter(claimed_by=self.claim_id).order_by('id').values_list(
+            'id', 'exchange', 'routing_key', 'body', 'priority')
+        return [OutboxEvent(event_id, exchange, routing_key, ujson.loads(body), priority)
+                for event_id, exchange, routing_key, body, priority in rows]
+
+    def delete(self, event_ids):
+        """Remove published events from the table."""
+        self._get_queryset().filter(id__in=event_ids).delete()
+
+    def release(self, event_ids):
+        """Give up the claim on events that could not be published, so they are retried."""
+        self._get_queryset().filter(id__in=event_ids).update(claimed_by=None, claimed_at=None)
+
+    def count(self):
+        return self._get_queryset().count()
@@ -0,0 +1,96 @@
+import threading
+
+from django.conf import settings
+
+MAX_PRIORITY = 10
+
+# Priorities used when neither the caller, the resource type nor the settings ask for one.
+DEFAULT_CALL_SITE_PRIORITIES = {
+    'emit_microservice_event': 0,
+    'async_resource_request': 5,
+    'make_service_request': 5,
+    'get_remote_resource_async': 0,
+    'get_remote_resource': 0,
+    'get_remote_resource_data': 9,
+}
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+class PriorityPolicy(object):
+    """
+    Decides the priority of outgoing events and requests, and whether a request that is close to its timeout
+    should be republished with a higher priority.
+
+    resource_types: {resource type: priority} raising the priority of requests of that resource type
+    call_sites: {EventClient method name: priority}, overriding DEFAULT_CALL_SITE_PRIORITIES
+    max_priority: the `x-max-priority` the event queues are declared with
+    promotion_threshold: fraction of a request's timeout after which a safe request that got no response
+        is republished. None disables promotion.
+    promotion_step: how much a republished request's priority is raised
+    """
+
+    def __init__(self, resource_types=None, call_sites=None, max_priority=MAX_PRIORITY, promotion_threshold=None,
+                 promotion_step=2):
+        self.resource_types = resource_types or {}
+        self.call_sites = dict(DEFAULT_CALL_SITE_PRIORITIES, **(call_sites or {}))
+        self.max_priority = max_priority
+        self.promotion_threshold = promotion_threshold
+        self.promotion_step = promotion_step
+
+        self._lock = threading.Lock()
+        self._queue_latencies = {}
+
+    @classmethod
+    def from_settings(cls):
+        """Build the policy from the EVENTS_PRIORITY_POLICY setting, a dict of `__init__` arguments."""
+        return cls(**getattr(settings, 'EVENTS_PRIORITY_POLICY', {}))
+
+    def get_priority(self, resource_type=None, call_site=None, priority=None):
+        """
+        Return `priority` if given, else the priority for the call site, raised to the one for the resource type.
+        A resource type never lowers a call site's priority, e.g. the 9 of `get_remote_resource_data`.
+        """
+        if priority is None:
+            priority = max(self.call_sites.get(call_site, 0), self.resource_types.get(resource_type, 0))
+        return min(priority, self.max_priority)
+
+    def get_promotion_delay(self, timeout, method=None, priority=None):
+        """
+        Return after how many seconds of waiting a request should be republished, or None if it shouldn't.
+
+        Only safe methods are republished, since the responder may end up handling the request twice.
+        """
+        if self.promotion_threshold is None or (method or 'GET').upper() not in SAFE_METHODS:
+            return None
+        if (priority or 0) >= self.max_priority:
+            return None
+
+        delay = int(timeout * self.promotion_threshold)
+        if not 0 < delay < timeout:
+            return None
+        return delay
+
+    def promote(self, priority):
+        return min((priority or 0) + self.promotion_step, self.max_priority)
+
+    def record_queue_latency(self, priority, latency):
+        """Record how long a request of the given priority waited in the queue, in seconds."""
+        priority = priority or 0
+        with self._lock:
+            count, total, maximum = self._queue_latencies.get(priority, (0, 0.0, 0.0))
+            self._queue_latencies[priority] = (count + 1, total + latency, max(maximum, latency))
+
+    def get_queue_latency_stats(self):
+        """Return {priority: {'count', 'mean', 'max'}} of the queue latencies recorded by this process."""
+        with self._lock:
+            latencies = dict(self._queue_latencies)
+
+        return {
+            priority: {'count': count, 'mean': total / count, 'max': maximum}
+            for priority, (count, total, maximum) in latencies.items()
+        }
+
+    def reset_queue_latency_stats(self):
+        with self._lock:
+            self._queue_latencies = {}
@@ -3,12 +3,13 @@ from __future__ import (
 )
 
 import inspect
+import itertools
 import ujson as json_module
 import re
 import six
 import urllib
 
-from collections import namedtuple, Sequence, Sized
+from collections import defaultdict, namedtuple, OrderedDict, Sequence, Sized
 from functools import update_wrapper
 from inflection import camelize
 
@@ -82,9 +83,24 @@ class EventRequestsMock(object):
         self.assert_all_requests_are_fired = assert_all_requests_are_fired
 
     def reset(self):
-        self._events = []
+        # {sequence number: event} in the order they were added, and the same events indexed by
+        # (method, resource_type, pk, related_resource), so finding and removing a match doesn't scan them all.
+        self._events = OrderedDict()
+        self._event_index = defaultdict(OrderedDict)
+        self._event_sequence = itertools.count()
         self._calls.reset()
 
+    @staticmethod
+    def _get_index_key(method, resource_type, pk, related_resource):
+        return method, resource_type, str(pk), related_resource
+
+    def _add_event(self, event):
+        sequence = next(self._event_sequence)
+        key = self._get_index_key(event['method'], event.get('resource_type'), event.get('pk'),
+                                  event.get('related_resource'))
+        self._events[sequence] = event
+        self._event_index[key][sequence] = event
+
     def add(self, method, resource_type, pk=None, body='', match_querystring=False,
             query_string=None, status=200, json=None, related_resource=None):
 
@@ -97,7 +113,7 @@ class EventRequestsMock(object):
         if isinstance(body, six.text_type):
             body = body.encode('utf-8')
 
-        self._events.append({
+        self._add_event({
             'resource_type': resource_type,
             'pk': pk,
             'method': method,
@@ -110,7 +126,7 @@ class EventRequestsMock(object):
 
     def add_callback(self, method, url, callback, match_querystring=False,
                      content_type='text/plain'):
-        self._events.append({
+        self._add_event({
             'url': url,
             'method': method,
             'callback': callback,
@@ -137,22 +153,22 @@ class EventRequestsMock(object):
         return get_wrapped(func, _wrapper_template, evaldict)
 
     def _find_match(self, resource_type, **kwargs):
-        for match in self._events:
-            if kwargs['method'] != match['method']:
-                continue
-
-            if resource_type != match['resource_type']:
-                continue
-
-            if not self._has_event_match(match, **kwargs):
-                continue
+        key = self._get_index_key(kwargs['method'], resource_type, kwargs.get('id'), kwargs.get('related_resource'))
+        candidates = self._event_index.get(key)
+        if not candidates:
+            return None
 
-            break
+        for sequence, match in six.iteritems(candidates):
+            if self._has_event_match(match, **kwargs):
+                break
         else:
             return None
         if self.assert_all_requests_are_fired:
             # for each found match remove the url from the stack
-            self._events.remove(match)
+            del candidates[sequence]
+            del self._events[sequence]
+            if not candidates:
+                del self._event_index[key]
         return match
 
     def _has_event_match(self, match, **kwargs):
@@ -222,7 +238,7 @@ class EventRequestsMock(object):
         if allow_assert and self.assert_all_requests_are_fired and self._events:
             raise AssertionError(
                 'Not all requests have been executed {0!r}'.format(
-                    [(url['method'], url['url']) for url in self._events]))
+                    [(url['method'], url['url']) for url in self._events.values()]))
 
 
 # expose default mock namespace
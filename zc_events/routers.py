@@ -1,19 +1,138 @@
-import re
 from django.conf import settings
+from inflection import underscore
+
+
+class FrozenRoute(dict):
+    """A route dict that can be cached and shared because it can't be modified."""
+
+    def _immutable(self, *args, **kwargs):
+        raise TypeError('FrozenRoute is immutable')
+
+    __setitem__ = __delitem__ = _immutable
+    clear = pop = popitem = setdefault = update = _immutable
+
+
+class ServiceRegistry(object):
+    """
+    Which service owns, and answers requests for, each resource type. The EVENTS_RESOURCE_SERVICES setting is a dict
+    of {resource type: service name}, the service name being the SERVICE_NAME of the owning service.
+    """
+
+    def __init__(self, services=None):
+        self._request_services = {}
+        for resource_type, service in (services or {}).items():
+            self.register(resource_type, service)
+
+    @classmethod
+    def from_settings(cls):
+        return cls(getattr(settings, 'EVENTS_RESOURCE_SERVICES', None))
+
+    def register(self, resource_type, service):
+        self._request_services['{}_request'.format(underscore(resource_type))] = service
+
+    def get_service(self, resource_type):
+        return self._request_services.get('{}_request'.format(underscore(resource_type)))
+
+    def get_request_service(self, event_type):
+        """Return the service answering request events of a type, e.g. 'order_request', or None."""
+        return self._request_services.get(event_type)
+
+
+def get_request_route(event_type, registry=None):
+    """
+    Return the route of request events of a type to the service owning their resource, through the direct
+    EVENTS_REQUEST_EXCHANGE, or None when they are broadcast on EVENTS_EXCHANGE.
+    """
+    request_exchange = getattr(settings, 'EVENTS_REQUEST_EXCHANGE', None)
+    if not request_exchange:
+        return None
+
+    service = (registry or ServiceRegistry.from_settings()).get_request_service(event_type)
+    if not service:
+        return None
+    return {'exchange': request_exchange, 'exchange_type': 'direct', 'routing_key': service}
 
 
 class TaskRouter(object):
+    """
+    Celery router sending events and notifications to their exchanges.
 
-    def route_for_task(self, task, args=None, kwargs=None):
-        if re.match('^microservice.event', task) is not None:
-            return {'exchange': settings.EVENTS_EXCHANGE,
-                    'exchange_type': 'fanout',
-                    'routing_key': ''}
-        elif re.match('^microservice.notification', task) is not None:
-            return {'exchange': settings.NOTIFICATIONS_EXCHANGE,
-                    'exchange_type': 'topic',
-                    'routing_key': 'microservice.notification.*'}
+    Routes are matched by task name prefix, longest prefix first. Services can add or override routes with
+    the EVENTS_TASK_ROUTES setting, a dict of {task name prefix: route}. Routes are resolved once per task
+    name and cached.
+
+    Request events for a resource type owned by a service in EVENTS_RESOURCE_SERVICES are sent straight to that
+    service, see `get_request_route`.
+    """
+
+    def __init__(self, routes=None):
+        self._extra_routes = routes
+        self._routes = None
+        self._default_route = None
+        self._cache = {}
+        self._registry = None
+        self._request_cache = {}
+
+    def get_routes(self):
+        routes = {
+            'microservice.event': {'exchange': settings.EVENTS_EXCHANGE,
+                                   'exchange_type': 'fanout',
+                                   'routing_key': ''},
+            'microservice.notification': {'exchange': settings.NOTIFICATIONS_EXCHANGE,
+                                          'exchange_type': 'topic',
+                                          'routing_key': 'microservice.notification.*'},
+        }
+        routes.update(getattr(settings, 'EVENTS_TASK_ROUTES', None) or {})
+        routes.update(self._extra_routes or {})
+        return routes
+
+    def get_default_route(self):
+        return {'exchange': 'default',
+                'exchange_type': 'direct',
+                'routing_key': settings.DEFAULT_QUEUE_NAME}
+
+    def _build_routing_table(self):
+        routes = self.get_routes()
+        self._routes = [(prefix, FrozenRoute(routes[prefix])) for prefix in sorted(routes, key=len, reverse=True)]
+        self._default_route = FrozenRoute(self.get_default_route())
+
+    def lookup_route(self, task):
+        """Return the shared, immutable route for a task name."""
+        try:
+            return self._cache[task]
+        except KeyError:
+            pass
+
+        if self._routes is None:
+            self._build_routing_table()
+
+        for prefix, route in self._routes:
+            if task.startswith(prefix):
+                break
         else:
-            return {'exchange': 'default',
-                    'exchange_type': 'direct',
-                    'routing_key': settings.DEFAULT_QUEUE_NAME}
+            route = self._default_route
+
+        self._cache[task] = route
+        return route
+
+    def lookup_request_route(self, event_type):
+        """Return the shared, immutable route for request events of a type, or None if they are broadcast."""
+        try:
+            return self._request_cache[event_type]
+        except KeyError:
+            pass
+
+        if self._registry is None:
+            self._registry = ServiceRegistry.from_settings()
+
+        route = get_request_route(event_type, self._registry)
+        route = self._request_cache[event_type] = FrozenRoute(route) if route else None
+        return route
+
+    def route_for_task(self, task, args=None, kwargs=None):
+        route = None
+        if task == 'microservice.event' and args and kwargs and kwargs.get('response_key'):
+            route = self.lookup_request_route(args[0])
+
+        # Celery updates the route it gets back in place, so it gets its own copy of the cached one.
+        return dict(route or self.lookup_route(task))
@@ -0,0 +1,317 @@
+import threading
+import time
+import ujson
+from collections import defaultdict, namedtuple
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+from inflection import underscore
+
+Message = namedtuple('Message', ['exchange', 'routing_key', 'body', 'properties'])
+
+
+class Transport(object):
+    """
+    The connections an EventClient publishes events and passes responses through.
+
+    `pika_pool` hands out connections with a pika-like `channel` from `acquire()`, used as a context manager.
+    `redis_client` needs the Redis list commands `blpop`, `rpush` and `expire`, and `pipeline()`.
+    `get_reply_queue()` returns the queue responses are published to when the client's response mode is 'amqp'.
+    """
+
+    pika_pool = None
+    redis_client = None
+
+    def bind(self, event_client):
+        """Called by the EventClient using the transport, once it is set up."""
+        pass
+
+    def after_fork(self):
+        """Called in a child process before it first uses the transport, to replace connections it inherited."""
+        pass
+
+    def get_publisher_confirms(self, connection, **kwargs):
+        """
+        Return the publisher confirms tracker of a connection acquired from `pika_pool`, see
+        `zc_events.amqp.PublisherConfirms`, or None if the transport doesn't support confirms.
+        """
+        return None
+
+    def get_reply_queue(self):
+        """
+        Return the reply queue of this process, with the `name` requests are sent with as `reply_to`, and
+        `get(correlation_id, timeout)` returning the body of the response to a request or None if it didn't arrive
+        in time. None if the transport doesn't support replies through the broker.
+        """
+        return None
+
+    def get_stats(self):
+        """Return {pool name: stats} of the connection pools of the transport."""
+        return {}
+
+    def warm_up(self, connections=1):
+        """Open up to `connections` connections in each pool ahead of time."""
+        pass
+
+
+class InMemoryChannel(object):
+
+    def __init__(self, broker):
+        self.broker = broker
+
+    def queue_declare(self, queue, durable=False, arguments=None, **kwargs):
+        self.broker.queues.setdefault(queue, arguments or {})
+
+    def exchange_declare(self, exchange, exchange_type='direct', **kwargs):
+        self.broker.exchanges.setdefault(exchange, exchange_type)
+
+    def basic_publish(self, exchange, routing_key, body, properties=None, **kwargs):
+        return self.broker.publish(Message(exchange, routing_key, body, properties))
+
+
+class InMemoryConnection(object):
+
+    def __init__(self, broker):
+        self.channel = InMemoryChannel(broker)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        pass
+
+
+class InMemoryReplyQueue(object):
+
+    def __init__(self, name):
+        self.name = name
+        self.responses = {}
+        self._condition = threading.Condition()
+
+    def deliver(self, correlation_id, body):
+        with self._condition:
+            self.responses[correlation_id] = body
+            self._condition.notify_all()
+
+    def get(self, correlation_id, timeout):
+        deadline = time.time() + timeout
+
+        with self._condition:
+            while correlation_id not in self.responses:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return None
+                self._condition.wait(remaining)
+            return self.responses.pop(correlation_id)
+
+    def clear(self):
+        with self._condition:
+            self.responses = {}
+
+
+class InMemoryBroker(object):
+    """
+    Stands in for the pika pool. Published messages are kept per event type, and handed to the handler
+    registered for their event type, if any, as soon as they are published. Messages published to a reply queue
+    through the default exchange are delivered to it.
+    """
+
+    def __init__(self):
+        self.queues = {}
+        self.exchanges = {}
+        self.reply_queues = {}
+        self.handlers = {}
+        self.messages = defaultdict(list)
+        self._connection = InMemoryConnection(self)
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        return self._connection
+
+    def publish(self, message):
+        if not message.exchange and message.routing_key in self.reply_queues:
+            self.reply_queues[message.routing_key].deliver(message.properties.correlation_id, message.body)
+            return True
+
+        # Decode the message like a worker consuming it would.
+        body = ujson.loads(message.body)
+        event_type = body['args'][0]
+
+        with self._lock:
+            self.messages[event_type].append(message)
+        handler = self.handlers.get(event_type)
+
+        if handler:
+            handler(body['kwargs'])
+        return True
+
+    def get_messages(self, event_type):
+        """Return the decoded messages published for an event type, oldest first."""
+        with self._lock:
+            messages = list(self.messages.get(event_type, ()))
+        return [ujson.loads(message.body) for message in messages]
+
+    def clear(self):
+        with self._lock:
+            self.messages = defaultdict(list)
+        for reply_queue in self.reply_queues.values():
+            reply_queue.clear()
+
+
+class InMemoryPipeline(object):
+
+    def __init__(self, store):
+        self.store = store
+        self.command_stack = []
+
+    def rpush(self, key, *values):
+        self.command_stack.append((self.store.rpush, (key,) + values))
+        return self
+
+    def expire(self, key, seconds):
+        self.command_stack.append((self.store.expire, (key, seconds)))
+        return self
+
+    def execute(self):
+        results = [command(*args) for command, args in self.command_stack]
+        self.command_stack = []
+        return results
+
+
+class InMemoryKeyValueStore(object):
+    """
+    Stands in for Redis, implementing the list commands used to pass responses back, and SET used to claim
+    requests.
+    """
+
+    def __init__(self):
+        self.lists = {}
+        self.values = {}
+        self.expires = {}
+        self._condition = threading.Condition()
+
+    def _expire_key(self, key):
+        expires_at = self.expires.get(key)
+        if expires_at is not None and expires_at <= time.time():
+            self.lists.pop(key, None)
+            self.values.pop(key, None)
+            self.expires.pop(key, None)
+
+    def pipeline(self):
+        return InMemoryPipeline(self)
+
+    def rpush(self, key, *values):
+        with self._condition:
+            self._expire_key(key)
+            values_list = self.lists.setdefault(key, [])
+            values_list.extend(values)
+            self._condition.notify_all()
+            return len(values_list)
+
+    def expire(self, key, seconds):
+        with self._condition:
+            self._expire_key(key)
+            if key not in self.lists:
+                return False
+            self.expires[key] = time.time() + seconds
+            return True
+
+    def set(self, key, value, ex=None, nx=False):
+        with self._condition:
+            self._expire_key(key)
+            if nx and key in self.values:
+                return None
+            self.values[key] = value
+            if ex:
+                self.expires[key] = time.time() + ex
+            else:
+                self.expires.pop(key, None)
+            return True
+
+    def llen(self, key):
+        with self._condition:
+            self._expire_key(key)
+            return len(self.lists.get(key, ()))
+
+    def blpop(self, key, timeout=0):
+        """Pop the first value of a list, waiting up to `timeout` seconds for one. 0 waits forever, like Redis."""
+        deadline = time.time() + timeout if timeout else None
+
+        with self._condition:
+            while True:
+                self._expire_key(key)
+                values = self.lists.get(key)
+                if values:
+                    value = values.pop(0)
+                    if not values:
+                        del self.lists[key]
+                        self.expires.pop(key, None)
+                    return key, value
+
+                if deadline is None:
+                    self._condition.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return None
+                    self._condition.wait(remaining)
+
+    def flushall(self):
+        with self._condition:
+            self.lists = {}
+            self.values = {}
+            self.expires = {}
+
+
+class InMemoryTransport(Transport):
+    """
+    Transport keeping everything in process memory, for tests and benchmarks that run without RabbitMQ or Redis.
+
+    Events still go through the same encoding, compression and `handle_request_event` as in production. Register
+    the views answering requests for a resource type with `register_view`, and requests for it are handled
+    in-process as soon as they are published.
+    """
+
+    def __init__(self):
+        self.pika_pool = InMemoryBroker()
+        self.redis_client = InMemoryKeyValueStore()
+        self.event_client = None
+        self.reply_queue = InMemoryReplyQueue('in-memory-reply')
+        self.pika_pool.reply_queues[self.reply_queue.name] = self.reply_queue
+
+    def bind(self, event_client):
+        self.event_client = event_client
+
+    def get_reply_queue(self):
+        return self.reply_queue
+
+    def register_handler(self, event_type, handler):
+        """Call `handler` with the kwargs of every event of that type published from now on."""
+        self.pika_pool.handlers[event_type] = handler
+
+    def register_view(self, resource_type, view=None, viewset=None, relationship_viewset=None):
+        """Answer requests for a resource type with a view or viewset, see `EventClient.handle_request_event`."""
+        def handler(event):
+            self.event_client.handle_request_event(event, view=view, viewset=viewset,
+                                                   relationship_viewset=relationship_viewset)
+
+        self.register_handler('{}_request'.format(underscore(resource_type)), handler)
+
+    def get_messages(self, event_type):
+        return self.pika_pool.get_messages(event_type)
+
+    def reset(self):
+        """Forget published messages and stored responses, registered handlers are kept."""
+        self.pika_pool.clear()
+        self.redis_client.flushall()
+
+
+def get_transport():
+    """
+    Instantiate the transport named by the EVENTS_TRANSPORT setting, a dotted path to a class, by default
+    `zc_events.amqp.AMQPRedisTransport`.
+    """
+    transport_path = getattr(settings, 'EVENTS_TRANSPORT', None)
+    if not transport_path:
+        transport_path = 'zc_events.amqp.AMQPRedisTransport'
+    return import_string(transport_path)()
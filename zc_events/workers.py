@@ -0,0 +1,28 @@
+import logging
+import os
+
+logger = logging.getLogger('django')
+
+
+def warm_up_worker(event_client, connections=1):
+    """
+    Open the connections of an EventClient in a freshly forked worker process, so its first events and requests
+    don't wait for them. Failures are logged rather than raised, the client connects on first use anyway.
+    """
+    event_client.reset_locks_after_fork()
+    try:
+        event_client.warm_up(connections)
+    except Exception:
+        logger.exception('EVENT_CLIENT::WARM_UP_FAILURE: Could not open connections in worker process %s',
+                         os.getpid())
+
+
+def connect_worker_warm_up(event_client, connections=1):
+    """Warm up an EventClient in every prefork Celery worker process as soon as it starts."""
+    from celery.signals import worker_process_init
+
+    def warm_up(**kwargs):
+        warm_up_worker(event_client, connections)
+
+    worker_process_init.connect(warm_up, weak=False)
+    return warm_up